@@ -1,30 +1,82 @@
 import os
 import logging
 import json
-from typing import TypedDict, List, Annotated
+import asyncio
+import hashlib
+from typing import TypedDict, List, Annotated, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from langgraph.graph import StateGraph, END
-from google import genai
-from google.genai import types
-from backend.models import AuditRule, Finding, VerifiedFinding, UploadedFile
+from langchain_core.callbacks.manager import adispatch_custom_event
+from google.genai import types, errors
+from backend.models import AuditRule, Finding, CheckedFinding, VerifiedFinding, UploadedFile
+from backend.gemini_client import gemini_clients
+from backend.context_cache import ReferenceContextCache, reference_parts
+from backend.findings_store import FindingsStore, rules_hash
+from backend.rule_cache import RuleCache
+from backend.checkpoints import RunCheckpoints
+from backend.reference_index import ReferenceIndex, format_passages
+from backend.icd10_index import Icd10Index
+from backend.evidence_check import EvidenceVerifier, HALLUCINATION, UNVERIFIED, summarize
+from backend.pdf_chunker import PageWindow, page_count, plan_windows, extract_window
+from backend.model_calls import model_calls, estimate_tokens
+from backend.metrics import track_node, record_cache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini Client
-api_key = os.environ.get("GOOGLE_API_KEY")
-client = genai.Client(api_key=api_key) if api_key else None
-
 def get_client():
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY not found in environment variables.")
-    if client: return client
-    return genai.Client(api_key=api_key)
+    """The process-wide Gemini client (shared connection pools). Raises ValueError without an API key."""
+    return gemini_clients.get()
+
+MODEL_NAME = "gemini-2.5-flash-lite"
+
+# Cached-content handles for reference sets, shared by the strategist, the verifier and later turns
+reference_cache = ReferenceContextCache(get_client)
+
+# Strategist output per (scenario, query intent, reference corpus); a hit skips the strategist node
+rule_cache = RuleCache()
+
+# Per-target findings from earlier runs, so re-audits only cover new or changed files
+findings_store = FindingsStore()
+
+# Per-run progress (rules, each audited file/window/shard, the draft findings), for resuming failed runs
+run_checkpoints = RunCheckpoints()
+
+# Page text of reference PDFs (indexed at upload), so large references are sent as their relevant pages only
+reference_index = ReferenceIndex()
+
+# Finds each finding's evidence quote in its target's page text (from the index above) before the report
+evidence_verifier = EvidenceVerifier(reference_index.page_texts)
+
+# Compiled ICD-10-CM neoplasm table (None if not built), to check quoted codes before the verifier's model call
+icd10_index = Icd10Index.open_default()
+ICD10_CODE_CHECK = os.environ.get("ICD10_CODE_CHECK", "1") == "1"
+
+# Deadline for the strategist's and verifier's model calls (the verifier's covers the whole stream)
+MODEL_CALL_TIMEOUT = float(os.environ.get("MODEL_CALL_TIMEOUT", "180")) # seconds
+
+# Auditor fan-out settings. Each target file is an independent model call, so we
+# run them side by side and cap how many are in flight at once.
+AUDITOR_MAX_CONCURRENCY = int(os.environ.get("AUDITOR_MAX_CONCURRENCY", "8"))
+AUDITOR_FILE_TIMEOUT = float(os.environ.get("AUDITOR_FILE_TIMEOUT", "120")) # seconds per file
+
+# Page-window mode for long targets: PDFs over the threshold are split locally into
+# overlapping windows that are audited in parallel and merged per rule.
+AUDITOR_CHUNK_THRESHOLD = int(os.environ.get("AUDITOR_CHUNK_THRESHOLD", "40")) # pages, 0 disables
+AUDITOR_CHUNK_PAGES = int(os.environ.get("AUDITOR_CHUNK_PAGES", "20"))
+AUDITOR_CHUNK_OVERLAP = int(os.environ.get("AUDITOR_CHUNK_OVERLAP", "2"))
+# Windows are sent inline, which the API caps at ~20 MB per request
+INLINE_PDF_LIMIT = 18 * 1024 * 1024
+
+# Rule sharding: large rule sets are split into shards of roughly this many prompt tokens,
+# evaluated concurrently per file. Smaller shards = more, faster, more reliable calls.
+AUDITOR_RULE_SHARD_TOKENS = int(os.environ.get("AUDITOR_RULE_SHARD_TOKENS", "2000"))
+# Per-scenario overrides, e.g. '{"Medical": 1200}'
+AUDITOR_RULE_SHARD_TOKENS_BY_SCENARIO = json.loads(os.environ.get("AUDITOR_RULE_SHARD_TOKENS_BY_SCENARIO", "{}"))
 
 # Define State
 class AgentState(TypedDict):
@@ -33,6 +85,7 @@ class AgentState(TypedDict):
     chat_history: List[dict]
     reference_files: List[UploadedFile]
     target_files: List[UploadedFile]
+    run_id: Optional[str] # checkpoint key for resuming this run; None = no checkpoints
     
     # Internal state
     audit_plan: str  # Strategist's understanding of what to do
@@ -43,14 +96,141 @@ class AgentState(TypedDict):
     
     messages: List[str] # Log
 
+async def _reference_excerpts(reference_files: List[UploadedFile], query: Optional[str]) -> Optional[str]:
+    """The reference pages most relevant to `query` as prompt text, or None to send the documents whole."""
+    if not query or not reference_files:
+        return None
+    try:
+        passages = await asyncio.to_thread(reference_index.search, reference_files, query)
+    except Exception as e:
+        logger.warning(f"Reference retrieval failed, sending whole documents: {e}")
+        passages = None
+    record_cache("reference_index", passages is not None)
+    if passages is None:
+        return None
+    logger.info(f"Sending {len(passages)} reference pages: {', '.join(f'{p.file_name} p{p.page}' for p in passages)}")
+    return format_passages(passages)
+
+async def _generate_with_references(reference_files: List[UploadedFile], prompt: str, config: types.GenerateContentConfig, label: str = "generate", query: str = None):
+    """
+    Runs a prompt over the reference documents, through the context cache when possible.
+    With a `query`, large indexed references are sent as their best-matching pages instead.
+    """
+    excerpts = await _reference_excerpts(reference_files, query)
+    cache_name = None
+    if excerpts is None:
+        # Cache lookup may create the handle remotely (blocking SDK call), keep it off the event loop
+        cache_name = await asyncio.to_thread(reference_cache.get, MODEL_NAME, reference_files)
+        if reference_files:
+            record_cache("context_cache", bool(cache_name))
+    if cache_name:
+        try:
+            return await model_calls.call(
+                lambda: asyncio.wait_for(
+                    get_client().aio.models.generate_content(
+                        model=MODEL_NAME,
+                        contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
+                        config=config.model_copy(update={"cached_content": cache_name})
+                    ),
+                    MODEL_CALL_TIMEOUT
+                ),
+                estimate_tokens(prompt),
+                label
+            )
+        except errors.ClientError as e:
+            # Handle expired/deleted/rejected remotely: forget it and send the references inline.
+            # Rate limiting (already retried by model_calls) is not a cache problem, let it surface.
+            if e.code == 429:
+                raise
+            logger.warning(f"Context cache {cache_name} rejected ({e}), retrying with inline references.")
+            await asyncio.to_thread(reference_cache.invalidate, MODEL_NAME, reference_files)
+
+    parts = [types.Part.from_text(text=excerpts)] if excerpts is not None else reference_parts(reference_files)
+    parts.append(types.Part.from_text(text=prompt))
+    return await model_calls.call(
+        lambda: asyncio.wait_for(
+            get_client().aio.models.generate_content(
+                model=MODEL_NAME,
+                contents=[types.Content(role="user", parts=parts)],
+                config=config
+            ),
+            MODEL_CALL_TIMEOUT
+        ),
+        estimate_tokens((excerpts or "") + prompt),
+        label
+    )
+
+async def _stream_with_references(reference_files: List[UploadedFile], prompt: str, config: types.GenerateContentConfig, label: str = "stream", query: str = None):
+    """Streaming variant of _generate_with_references; yields response chunks as they arrive."""
+    excerpts = await _reference_excerpts(reference_files, query)
+    cache_name = None
+    if excerpts is None:
+        cache_name = await asyncio.to_thread(reference_cache.get, MODEL_NAME, reference_files)
+        if reference_files:
+            record_cache("context_cache", bool(cache_name))
+    if cache_name:
+        started = False
+        try:
+            stream = model_calls.stream(
+                lambda: get_client().aio.models.generate_content_stream(
+                    model=MODEL_NAME,
+                    contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
+                    config=config.model_copy(update={"cached_content": cache_name})
+                ),
+                estimate_tokens(prompt),
+                label
+            )
+            async for chunk in stream:
+                started = True
+                yield chunk
+            return
+        except errors.ClientError as e:
+            # Only recoverable before anything was sent downstream
+            if started or e.code == 429:
+                raise
+            logger.warning(f"Context cache {cache_name} rejected ({e}), retrying with inline references.")
+            await asyncio.to_thread(reference_cache.invalidate, MODEL_NAME, reference_files)
+
+    parts = [types.Part.from_text(text=excerpts)] if excerpts is not None else reference_parts(reference_files)
+    parts.append(types.Part.from_text(text=prompt))
+    stream = model_calls.stream(
+        lambda: get_client().aio.models.generate_content_stream(
+            model=MODEL_NAME,
+            contents=[types.Content(role="user", parts=parts)],
+            config=config
+        ),
+        estimate_tokens((excerpts or "") + prompt),
+        label
+    )
+    async for chunk in stream:
+        yield chunk
+
+async def _emit_event(name: str, data: dict):
+    """Publishes a custom event to astream_events listeners, if running inside the graph."""
+    try:
+        await adispatch_custom_event(name, data)
+    except RuntimeError:
+        pass # Node called directly, outside a LangGraph run: nobody to stream to
+
+async def _emit_delta(text: str):
+    """Publishes a piece of the report as it is generated."""
+    await _emit_event("final_delta", {"content": text})
+
+def _instrumented(name: str, node):
+    """Wraps a node so its timing, tokens, retries and cache hits are recorded and published as 'node_metrics'."""
+    async def run(state: AgentState):
+        async with track_node(name) as stats:
+            result = await node(state)
+        await _emit_event("node_metrics", {"node": name, **stats.summary()})
+        return result
+    return run
+
 # --- Nodes ---
 
-def strategist_agent(state: AgentState):
+async def strategist_agent(state: AgentState):
     """Analyzes query and references to define the Audit Strategy/Rules."""
     logger.info("Strategist: analyzing request...")
     
-    ref_file_uris = [f.uri for f in state['reference_files']]
-    
     # If no references, we can't extract specific rules, but we can still try to answer or use general knowledge?
     # For this system, let's assume references are key.
     
@@ -72,24 +252,26 @@ def strategist_agent(state: AgentState):
     DO NOT return an empty list. You MUST provide rules for the Auditor to work with.
     """
     
-    # Prepare parts
-    parts = []
-    for uri in ref_file_uris:
-        parts.append(types.Part.from_uri(file_uri=uri, mime_type="application/pdf")) # Generic mime
-    parts.append(types.Part.from_text(text=prompt))
-    
     try:
-        response = get_client().models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=[types.Content(role="user", parts=parts)],
-            config=types.GenerateContentConfig(
+        # Reference pages are picked by the request alone: the rules are cached per scenario, intent and
+        # references (not targets), so they mustn't depend on which target happened to be audited first
+        response = await _generate_with_references(
+            state['reference_files'],
+            prompt,
+            types.GenerateContentConfig(
                 response_mime_type="application/json",
                 response_schema=list[AuditRule]
-            )
+            ),
+            label="strategist",
+            query=f"{state['scenario']} {state['user_query']}"
         )
         
         rules = response.parsed
-        if not rules: 
+        if rules:
+            await asyncio.to_thread(rule_cache.put, state['scenario'], state['user_query'], state['reference_files'], rules)
+            if state.get('run_id'):
+                await asyncio.to_thread(run_checkpoints.put_rules, state['run_id'], rules)
+        else:
             # Double fallback if model returns empty list
             rules = [AuditRule(rule_id="GEN-001", description=f"General compliance check for {state['scenario']}", severity="High")]
         
@@ -100,81 +282,315 @@ def strategist_agent(state: AgentState):
         }
 
     except Exception as e:
-        logger.error(f"Strategist error: {e}")
-        # Fallback empty rules
-        return {"rules": [], "messages": state.get("messages", []) + [f"Strategist error: {str(e)}"]}
+        # No rules means nothing to audit: an audit against an empty rule set would come back "no findings",
+        # and that report would be saved as the session's outcome. Fail the run instead (it can be resumed).
+        logger.error(f"Strategist error: {e!r}")
+        raise
 
 
-def auditor_agent(state: AgentState):
-    """Audits each target file against the rules."""
-    logger.info("Auditor: Checking targets...")
+async def _audit_file(target_file: UploadedFile, rules_json: str, window: Optional[PageWindow], limiter: asyncio.Semaphore) -> Optional[List[Finding]]:
+    """
+    Audits a single target file (or one page window of it) against the rules.
+    At most `limiter`'s worth run at once. Errors are logged and return None.
+    """
+    if window:
+        scope = f'pages {window.start}-{window.end} of the file "{target_file.name}" (the attached excerpt)'
+        page_hint = f"Set 'page_number' to the page of the attached excerpt (1 = its first page) where the evidence appears."
+    else:
+        scope = f'this specific file: "{target_file.name}"'
+        page_hint = "Set 'page_number' to the page (starting at 1) where the evidence appears."
+
+    prompt = f"""
+    You are an Expert Auditor.
+    Task: Audit {scope} against the following Rules.
     
-    rules_json = json.dumps([r.model_dump() for r in state['rules']], indent=2)
-    all_findings = []
+    Rules:
+    {rules_json}
     
-    if not state['target_files']:
-        return {"draft_findings": [], "messages": state.get("messages", []) + ["No target files to audit."]}
+    For EACH rule:
+    - Determine Pass/Fail/Warning.
+    - Give the Evidence: quote the document verbatim, inside double quotes ("..."). If the rule fails
+      because something is missing, say what is missing, without quotes.
+    
+    Output a JSON list of Finding objects. 
+    IMPORTANT: Include 'file_name': "{target_file.name}" in each finding.
+    {page_hint}
+    """
+    
+    try:
+        async with limiter:
+            if window:
+                # Page extraction is CPU/disk work, keep it off the event loop
+                data = await asyncio.to_thread(extract_window, target_file.local_path, window)
+                if len(data) > INLINE_PDF_LIMIT:
+                    raise ValueError(f"pages {window.start}-{window.end} are {len(data)} bytes, too large to send inline")
+                document = types.Part.from_bytes(data=data, mime_type="application/pdf")
+            else:
+                document = types.Part.from_uri(file_uri=target_file.uri, mime_type="application/pdf")
 
-    for target_file in state['target_files']:
-        prompt = f"""
-        You are an Expert Auditor.
-        Task: Audit this specific file: "{target_file.name}" against the following Rules.
-        
-        Rules:
-        {rules_json}
-        
-        For EACH rule:
-        - Determine Pass/Fail/Warning.
-        - Quote the Evidence.
-        
-        Output a JSON list of Finding objects. 
-        IMPORTANT: Include 'file_name': "{target_file.name}" in each finding.
-        """
-        
-        try:
-            response = get_client().models.generate_content(
-                model="gemini-2.5-flash-lite",
-                contents=[
-                    types.Content(
-                        role="user",
-                        parts=[
-                            types.Part.from_uri(file_uri=target_file.uri, mime_type="application/pdf"),
-                            types.Part.from_text(text=prompt)
-                        ]
-                    )
-                ],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=list[Finding]
-                )
+            # The deadline starts once the call holds a slot, not while it queues;
+            # each retry of a rate-limited/5xx call gets a fresh one.
+            response = await model_calls.call(
+                lambda: asyncio.wait_for(
+                    get_client().aio.models.generate_content(
+                        model=MODEL_NAME,
+                        contents=[
+                            types.Content(
+                                role="user",
+                                parts=[
+                                    document,
+                                    types.Part.from_text(text=prompt)
+                                ]
+                            )
+                        ],
+                        config=types.GenerateContentConfig(
+                            response_mime_type="application/json",
+                            response_schema=list[Finding]
+                        )
+                    ),
+                    AUDITOR_FILE_TIMEOUT
+                ),
+                estimate_tokens(prompt),
+                "auditor"
             )
+        findings = response.parsed or []
+        for f in findings:
+            # Keyed on when merging windows/shards, so don't trust the model's spelling
+            f.file_name = target_file.name
+            if window and f.page_number is not None:
+                # Map excerpt-relative page numbers back onto the whole document
+                f.page_number = min(max(window.start + f.page_number - 1, window.start), window.end)
+        return findings
             
-            if response.parsed:
-                all_findings.extend(response.parsed)
-                
-        except Exception as e:
-            logger.error(f"Auditor error on {target_file.name}: {e}")
+    except Exception as e:
+        where = f" pages {window.start}-{window.end}" if window else ""
+        logger.error(f"Auditor error on {target_file.name}{where}: {e!r}")
+        return None
+
+
+_STATUS_RANK = {"pass": 0, "warning": 1, "fail": 2}
+
+
+def _merge_findings_by_rule(findings: List[Finding]) -> List[Finding]:
+    """
+    Collapses findings for the same (file, rule) into one: the worst status wins,
+    and evidence from every part is kept.
+    """
+    merged = {}
+    for f in findings:
+        key = (f.file_name, f.rule_id)
+        current = merged.get(key)
+        if current is None:
+            merged[key] = f.model_copy()
+            continue
+        if _STATUS_RANK.get(f.status.lower(), 0) > _STATUS_RANK.get(current.status.lower(), 0):
+            # The worse finding leads; its evidence and page come first
+            evidence = [f.evidence, current.evidence]
+            current = merged[key] = f.model_copy()
+        else:
+            evidence = [current.evidence, f.evidence]
+        current.evidence = "\n...\n".join(dict.fromkeys(e for e in evidence if e))
+    return list(merged.values())
+
+
+def _shard_rules(rules: List[AuditRule], max_tokens: int) -> List[str]:
+    """Packs rules, in order, into JSON shards whose estimated size stays under max_tokens."""
+    shards, current, current_tokens = [], [], 0
+    for rule in rules:
+        rule_tokens = estimate_tokens(json.dumps(rule.model_dump(), indent=2))
+        if current and current_tokens + rule_tokens > max_tokens:
+            shards.append(current)
+            current, current_tokens = [], 0
+        current.append(rule.model_dump())
+        current_tokens += rule_tokens
+    if current:
+        shards.append(current)
+    return [json.dumps(shard, indent=2) for shard in shards]
+
+
+def _unit_key(file_key: str, window: Optional[PageWindow], shard: str) -> str:
+    """Checkpoint key of one auditor call: the file's findings-store key, page window and rule shard."""
+    pages = f"{window.start}-{window.end}" if window else "all"
+    return f"{file_key}:{pages}:{hashlib.sha256(shard.encode('utf-8')).hexdigest()[:16]}"
+
+
+async def _audit_unit(target_file: UploadedFile, shard: str, window: Optional[PageWindow], limiter: asyncio.Semaphore,
+                      run_id: Optional[str], unit_key: str) -> Optional[List[Finding]]:
+    """_audit_file, checkpointed as soon as it succeeds so a resumed run doesn't repeat it."""
+    findings = await _audit_file(target_file, shard, window, limiter)
+    if findings is not None and run_id:
+        await asyncio.to_thread(run_checkpoints.put_unit, run_id, unit_key, findings)
+    return findings
+
+
+def _plan_target(target_file: UploadedFile) -> List[Optional[PageWindow]]:
+    """Work units for one target: [None] for a whole-file audit, or its page windows."""
+    if AUDITOR_CHUNK_THRESHOLD <= 0:
+        return [None]
+    pages = page_count(target_file.local_path)
+    if not pages or pages <= AUDITOR_CHUNK_THRESHOLD:
+        return [None]
+    windows = plan_windows(pages, AUDITOR_CHUNK_PAGES, AUDITOR_CHUNK_OVERLAP)
+    logger.info(f"Auditor: splitting {target_file.name} ({pages} pages) into {len(windows)} windows.")
+    return windows
+
+
+async def auditor_agent(state: AgentState):
+    """Audits each target file against the rules, several files at a time, reusing stored findings."""
+    logger.info("Auditor: Checking targets...")
+    
+    if not state.get('rules'):
+        raise ValueError("Auditor called without audit rules.")
+
+    shard_tokens = AUDITOR_RULE_SHARD_TOKENS_BY_SCENARIO.get(state.get('scenario'), AUDITOR_RULE_SHARD_TOKENS)
+    rule_shards = _shard_rules(state['rules'], shard_tokens)
+    target_files = state['target_files']
+    
+    if not target_files:
+        return {"draft_findings": [], "messages": state.get("messages", []) + ["No target files to audit."]}
+
+    # Targets whose content was already audited against this exact rule set keep their findings.
+    rules_digest = rules_hash(state['rules'])
+    # Only a content hash identifies a target's bytes: files without one (pending or failed uploads, whose
+    # uri is empty too) get a key of their own for this run and are neither looked up nor stored.
+    keys = [FindingsStore.key(f.content_hash or f"unhashed:{i}:{f.name}", rules_digest, MODEL_NAME) for i, f in enumerate(target_files)]
+    storable = {key for f, key in zip(target_files, keys) if f.content_hash}
+    stored = await asyncio.to_thread(findings_store.get_many, [k for k in keys if k in storable])
+    to_audit = [(f, key) for f, key in zip(target_files, keys) if key not in stored]
+    record_cache("findings_store", True, len(stored))
+    record_cache("findings_store", False, len(to_audit))
+
+    fresh = {}
+    incomplete = [] # targets with at least one failed call, even after retries
+    if to_audit:
+        # Long PDFs become several page-window units, big rule sets several shards;
+        # every (file, window, shard) unit shares one concurrency limit.
+        plans = await asyncio.gather(*(asyncio.to_thread(_plan_target, f) for f, _ in to_audit))
+        units = [(i, window, shard) for i, windows in enumerate(plans) for window in windows for shard in rule_shards]
+        limiter = asyncio.Semaphore(max(1, AUDITOR_MAX_CONCURRENCY))
+        # A resumed run only repeats the calls that didn't succeed last time
+        run_id = state.get('run_id')
+        done = await asyncio.to_thread(run_checkpoints.units, run_id) if run_id else {}
+        unit_keys = [_unit_key(to_audit[i][1], window, shard) for i, window, shard in units]
+        if done:
+            logger.info(f"Auditor: resuming, {sum(k in done for k in unit_keys)} of {len(units)} calls already done.")
+
+        async def run_unit(unit, unit_key):
+            i, window, shard = unit
+            if unit_key in done:
+                return done[unit_key]
+            return await _audit_unit(to_audit[i][0], shard, window, limiter, run_id, unit_key)
+
+        # gather returns results in input order, so findings stay grouped by
+        # target file (and window) no matter which call finishes first.
+        results = await asyncio.gather(*(run_unit(unit, unit_key) for unit, unit_key in zip(units, unit_keys)))
+
+        per_target = {}
+        for (i, _, _), findings in zip(units, results):
+            per_target.setdefault(i, []).append(findings)
+        for i, (target_file, key) in enumerate(to_audit):
+            parts = per_target.get(i, [])
+            if None in parts:
+                incomplete.append(target_file.name)
+            if all(p is None for p in parts):
+                continue # failed call, don't remember it
+            findings = [f for p in parts if p for f in p]
+            if len(parts) > 1:
+                # Overlapping windows and shards can report the same rule more than once
+                findings = _merge_findings_by_rule(findings)
+            # A file with a failed window is reported but not remembered as complete
+            if None not in parts and key in storable:
+                await asyncio.to_thread(findings_store.put, key, findings)
+            fresh[key] = findings
+
+    all_findings = []
+    for target_file, key in zip(target_files, keys):
+        if key in stored:
+            # Same bytes may have been uploaded under a different name this time
+            all_findings.extend(f.model_copy(update={"file_name": target_file.name}) for f in stored[key])
+        else:
+            all_findings.extend(fresh.get(key, []))
             
-    logger.info(f"Auditor found {len(all_findings)} total issues.")
+    logger.info(f"Auditor found {len(all_findings)} total issues ({len(stored)} files reused, {len(to_audit)} audited).")
+    messages = [f"Auditor checked {len(target_files)} files ({len(stored)} unchanged since last audit), found {len(all_findings)} items."]
+    if incomplete:
+        # Say so rather than passing a partial audit off as complete
+        messages.append(f"Auditor could not fully audit {len(incomplete)} files: {', '.join(incomplete)}.")
+    elif state.get('run_id'):
+        # A resumed run can go straight to the verifier from here
+        await asyncio.to_thread(run_checkpoints.put_audit, state['run_id'], all_findings, state.get("messages", []) + messages)
     return {
         "draft_findings": all_findings,
-        "messages": state.get("messages", []) + [f"Auditor checked {len(state['target_files'])} files, found {len(all_findings)} items."]
+        "messages": state.get("messages", []) + messages
     }
 
 
-def verifier_agent(state: AgentState):
+def _check_codes(findings: List[Finding]) -> List[Finding]:
+    """
+    Stamps each finding with a lookup of the ICD-10 codes its evidence quotes.
+    Codes outside the table's categories aren't reported: they may not be ICD-10 at all.
+    """
+    if icd10_index is None or not ICD10_CODE_CHECK:
+        return findings
+    checked = []
+    for f in findings:
+        checks = [c._asdict() for c in icd10_index.check_text(f.evidence) if c.status != "not_covered"]
+        checked.append(CheckedFinding(**f.model_dump(), code_checks=checks) if checks else f)
+    return checked
+
+async def verifier_agent(state: AgentState):
     """Verifies findings and compiles the chat response."""
     logger.info("Verifier: Validating and summarizing...")
-    
-    findings_json = json.dumps([f.model_dump() for f in state['draft_findings']], indent=2)
-    ref_uris = [f.uri for f in state['reference_files']]
+    messages = state.get("messages", [])
+
+    # Code validity is a table lookup: settle it here instead of asking the model
+    draft_findings = _check_codes(state['draft_findings'])
+    code_checks = [c for f in draft_findings for c in getattr(f, "code_checks", [])]
+    code_instruction = ""
+    if code_checks:
+        counts = {}
+        for c in code_checks:
+            counts[c["status"]] = counts.get(c["status"], 0) + 1
+        summary = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+        logger.info(f"Verifier: ICD-10 code check: {summary}.")
+        messages = messages + [f"Code check: {summary} (ICD-10-CM neoplasm table)."]
+        code_instruction = """
+    CODE CHECKS: Findings with "code_checks" had their ICD-10 codes looked up in the ICD-10-CM
+    Table of Neoplasms. A code marked "invalid" is missing from a category the table covers: treat
+    that as settled. The other results are advisory: "incomplete" means the table lists the code
+    only with further characters, and "extension not checked" means the characters after a listed
+    code weren't verified. Confirm those, and whether any code fits the case, against the reference
+    documents.
+    """
+
+    # Evidence quotes are looked up in the targets' text, so a hallucinated quote isn't taken on trust
+    verified_findings = []
+    evidence_instruction = ""
+    try:
+        verified_findings = await asyncio.to_thread(evidence_verifier.verify, draft_findings, state['target_files'])
+    except Exception as e:
+        logger.error(f"Verifier: evidence check failed: {e}")
+    counts = summarize(verified_findings)
+    if set(counts) - {UNVERIFIED}:
+        summary = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+        logger.info(f"Verifier: evidence check: {summary}.")
+        messages = messages + [f"Evidence check: {summary}."]
+        evidence_instruction = f"""
+    EVIDENCE CHECKS: "verification_status" says whether the quoted text in a finding's evidence was
+    found in the target document's text ("Verified", location in "explanation") or not ("{HALLUCINATION}").
+    Never present the evidence of a "{HALLUCINATION}" finding as a quote from the document: report
+    the finding as unsupported and say that its quote could not be found. "{UNVERIFIED}" evidence
+    (e.g. a statement that something is missing) was not checked; judge it as usual.
+    """
+
+    findings_json = json.dumps([f.model_dump() for f in verified_findings or draft_findings], indent=2)
     
     prompt = f"""
     You are a Lead Auditor at a Regulatory Body.
     
     1. Review the Draft Findings below:
     {findings_json}
-    
+    {code_instruction}{evidence_instruction}
     2. Cross-reference EXACTLY with the Reference Documents (attached).
     3. Generate a **COMPREHENSIVE, END-TO-END PROFESSIONAL AUDIT REPORT** in Markdown.
     
@@ -213,41 +629,63 @@ def verifier_agent(state: AgentState):
     **Output**: ONLY the Markdown report. Do not start with "Okay" or "Here is the report".
     """
     
-    parts = []
-    for uri in ref_uris:
-         # Re-attach references for verification context
-        parts.append(types.Part.from_uri(file_uri=uri, mime_type="application/pdf"))
-    parts.append(types.Part.from_text(text=prompt))
-    
     try:
-        response = get_client().models.generate_content(
-            model="gemini-2.5-flash-lite",
-            contents=[types.Content(role="user", parts=parts)],
-            config=types.GenerateContentConfig(
+        # Re-attach references for verification context (same cached handle as the strategist)
+        # Reference pages are picked by what has to be verified: the rules and the evidence quoted for them
+        query = " ".join([state['user_query']] + [r.description for r in state.get('rules', [])] +
+                         [f"{f.rule_id} {f.description} {f.evidence}" for f in draft_findings])
+        stream = _stream_with_references(
+            state['reference_files'],
+            prompt,
+            types.GenerateContentConfig(
                 response_mime_type="text/plain" # Free text markdown for the final chat response
-            )
+            ),
+            label="verifier",
+            query=query
         )
+
+        # Forward text as it is generated; chat_stream relays these as 'final_delta' events.
+        pieces = []
+        async with asyncio.timeout(MODEL_CALL_TIMEOUT):
+            async for chunk in stream:
+                if chunk.text:
+                    pieces.append(chunk.text)
+                    await _emit_delta(chunk.text)
         
-        final_text = response.text
+        final_text = "".join(pieces)
         return {
             "final_response": final_text,
-            "messages": state.get("messages", []) + ["Verification complete. Response generated."]
+            "draft_findings": draft_findings,
+            "verified_findings": verified_findings,
+            "messages": messages + ["Verification complete. Response generated."]
         }
 
+    except TimeoutError:
+        # Raised by asyncio.timeout with no message of its own
+        logger.error(f"Verifier: report not finished within {MODEL_CALL_TIMEOUT:.0f}s")
+        error = f"the model did not finish the report within {MODEL_CALL_TIMEOUT:.0f}s"
+        return {"final_response": f"Error generating final report: {error}", "messages": messages + [f"Verifier error: {error}"]}
     except Exception as e:
-        logger.error(f"Verifier error: {e}")
+        logger.error(f"Verifier error: {e!r}")
         import traceback
         traceback.print_exc()
-        return {"final_response": f"Error generating final report: {str(e)}", "messages": state.get("messages", []) + [f"Verifier error: {str(e)}"]}
+        return {"final_response": f"Error generating final report: {str(e)}", "messages": messages + [f"Verifier error: {str(e)}"]}
 
 # --- Graph ---
 workflow = StateGraph(AgentState)
 
-workflow.add_node("strategist", strategist_agent)
-workflow.add_node("auditor", auditor_agent)
-workflow.add_node("verifier", verifier_agent)
+workflow.add_node("strategist", _instrumented("strategist", strategist_agent))
+workflow.add_node("auditor", _instrumented("auditor", auditor_agent))
+workflow.add_node("verifier", _instrumented("verifier", verifier_agent))
+
+def _route_start(state: AgentState):
+    # Resuming from a checkpoint: start at the first node without a result
+    if state.get("rules") and state.get("draft_findings") is not None:
+        return "verifier"
+    # Rules pre-filled from the rule cache (or a checkpoint) make the strategist redundant
+    return "auditor" if state.get("rules") else "strategist"
 
-workflow.set_entry_point("strategist")
+workflow.set_conditional_entry_point(_route_start, {"strategist": "strategist", "auditor": "auditor", "verifier": "verifier"})
 workflow.add_edge("strategist", "auditor")
 workflow.add_edge("auditor", "verifier")
 workflow.add_edge("verifier", END)
@@ -0,0 +1,151 @@
+import time
+import uuid
+import asyncio
+import logging
+from typing import AsyncIterator
+from backend.agents import app_graph, rule_cache, run_checkpoints
+from backend.metrics import record_cache, REQUEST_DURATION
+from backend.models import ChatRequest
+
+logger = logging.getLogger(__name__)
+
+AGENT_STEPS = ["strategist", "auditor", "verifier"]
+
+
+async def run_audit(request: ChatRequest, user_id: str, file_manager) -> AsyncIterator[dict]:
+    """
+    Runs one audit end to end and yields its progress events, the same dicts
+    /chat/stream sends as SSE `data:` lines. Used by the streaming endpoint and
+    by the background job workers. Errors are raised to the caller.
+
+    Progress is checkpointed under request.run_id (a new id if not given, sent
+    in the 'started' event); running the same run_id again resumes at the first
+    incomplete node, or at the auditor's first unfinished call.
+    """
+    request_started = time.perf_counter()
+
+    # Wait for any background uploads to finish before starting agent
+    yield {'step': 'init', 'status': 'Verifying uploads...'}
+
+    # Hydrate Session from Request Data (Crucial for Serverless Persistence)
+    # This ensures that files already known by the UI are registered in the backend session.
+    # One read + at most one write for the whole file set, run off the event loop.
+    # The request body stays the source of truth for the audit, so a failed write isn't fatal.
+    try:
+        await asyncio.to_thread(
+            file_manager.add_files_to_session,
+            request.session_id,
+            {"reference": request.reference_files, "target": request.target_files},
+            user_id
+        )
+    except Exception as e:
+        logger.error(f"Session hydration failed for {request.session_id}: {e}")
+    await file_manager.wait_for_uploads(request.session_id, user_id)
+
+    # CRITICAL FIX: Use the files from the request body directly!
+    # The previous logic re-queried Firestore, which returns empty lists if Firestore is not initialized.
+    # The request body is the source of truth for serverless deployments.
+    # Only fall back to Firestore if the request body has no files (backward compatibility).
+
+    session_refs = request.reference_files if request.reference_files else file_manager.get_session_files(request.session_id, "reference", user_id=user_id)
+    session_targets = request.target_files if request.target_files else file_manager.get_session_files(request.session_id, "target", user_id=user_id)
+
+    # Page windows, retrieval queries and evidence checks read the files' local copies:
+    # found here by content hash, never taken from the request
+    session_refs = await asyncio.to_thread(file_manager.resolve_local_copies, session_refs)
+    session_targets = await asyncio.to_thread(file_manager.resolve_local_copies, session_targets)
+
+    # Log for debugging
+    logger.info(f"Agent State - Reference Files: {len(session_refs)}, Target Files: {len(session_targets)}")
+    for f in session_refs:
+        logger.info(f"  REF: {f.name} -> {f.uri}")
+    for f in session_targets:
+        logger.info(f"  TGT: {f.name} -> {f.uri}")
+
+    run_id = request.run_id or uuid.uuid4().hex
+    # Checkpoints are per user, so nobody can resume (and read) someone else's run
+    checkpoint_key = f"{user_id}:{run_id}"
+
+    initial_state = {
+        "user_query": request.message,
+        "scenario": request.scenario,
+        "chat_history": request.history,
+        "reference_files": session_refs, # Use request body files directly
+        "target_files": session_targets, # Use request body files directly
+        "run_id": checkpoint_key,
+        "messages": []
+    }
+
+    await asyncio.to_thread(run_checkpoints.maybe_purge)
+    resumed = await asyncio.to_thread(run_checkpoints.load, checkpoint_key) if request.run_id else {}
+    cached_rules = None
+    if resumed:
+        logger.info(f"Resuming run {run_id}: {', '.join(resumed)} restored from checkpoints.")
+        initial_state.update(resumed)
+        if "messages" not in resumed:
+            initial_state["messages"] = [f"Strategist defined {len(resumed['rules'])} audit criteria."]
+    else:
+        # Reuse the strategist's rules when the same scenario/intent/references were audited before
+        lookup_started = time.perf_counter()
+        cached_rules = await asyncio.to_thread(rule_cache.get, request.scenario, request.message, session_refs)
+        lookup_ms = round((time.perf_counter() - lookup_started) * 1000)
+        record_cache("rule_cache", bool(cached_rules))
+        if cached_rules:
+            logger.info(f"Rule cache hit: reusing {len(cached_rules)} rules, skipping strategist.")
+            initial_state["rules"] = cached_rules
+            initial_state["messages"] = [f"Strategist reused {len(cached_rules)} cached audit criteria."]
+            # Pinned to the run, so a resume audits against the same rules even if the cache changes
+            await asyncio.to_thread(run_checkpoints.put_rules, checkpoint_key, cached_rules)
+
+    # Yield initial handshake
+    yield {'step': 'init', 'status': 'started', 'run_id': run_id, 'resumed': bool(resumed)}
+
+    if cached_rules:
+        # The graph starts at the auditor, report the strategist step as usual
+        yield {'step': 'strategist', 'status': 'running'}
+        yield {'step': 'strategist', 'status': 'completed', 'cached': True, 'metrics': {'duration_ms': lookup_ms, 'calls': 0, 'cache_hits': {'rule_cache': 1}}}
+
+    if resumed:
+        # Steps finished by an earlier attempt are reported as usual, without running again
+        restored = ["strategist", "auditor"] if "draft_findings" in resumed else ["strategist"]
+        for step in restored:
+            yield {'step': step, 'status': 'running'}
+            yield {'step': step, 'status': 'completed', 'checkpoint': True, 'metrics': {'duration_ms': 0, 'calls': 0}}
+
+    # Per-node timing/token summaries, published by each node just before it completes
+    node_metrics = {}
+
+    # Stream events from LangGraph
+    async for event in app_graph.astream_events(initial_state, version="v2"):
+        kind = event["event"]
+        name = event["name"]
+
+        # Verifier report text, token by token
+        if kind == "on_custom_event" and name == "final_delta":
+            yield {'step': 'final_delta', 'content': event['data']['content']}
+            continue
+
+        if kind == "on_custom_event" and name == "node_metrics":
+            data = dict(event['data'])
+            node_metrics[data.pop('node')] = data
+            continue
+
+        # Log when a node STARTS
+        if kind == "on_chain_start" and name in AGENT_STEPS:
+            yield {'step': name, 'status': 'running'}
+
+        # Log when a node COMPLETES
+        if kind == "on_chain_end" and name in AGENT_STEPS:
+            yield {'step': name, 'status': 'completed', 'metrics': node_metrics.get(name)}
+
+            # Capture Final Response from Verifier directly
+            if name == "verifier":
+                output = event['data'].get('output')
+                # Verifier returns a dict with 'final_response' key
+                if output and 'final_response' in output:
+                    yield {'step': 'final', 'content': output['final_response']}
+
+                    # Save final response to session summary for Profile Page
+                    await asyncio.to_thread(file_manager.update_session_summary, request.session_id, output['final_response'], user_id=user_id)
+
+    REQUEST_DURATION.observe(time.perf_counter() - request_started)
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from backend.models import AuditRule, Finding
+
+logger = logging.getLogger(__name__)
+
+AUDIT_CHECKPOINTS_PATH = os.environ.get("AUDIT_CHECKPOINTS_PATH", os.path.join(tempfile.gettempdir(), "universal_audit_checkpoints.db"))
+AUDIT_CHECKPOINT_RETENTION = float(os.environ.get("AUDIT_CHECKPOINT_RETENTION", str(7 * 24 * 3600))) # seconds
+
+# Checkpoint steps
+STRATEGIST = "strategist"       # the run's rules
+AUDITOR_UNIT = "auditor_unit"   # findings of one (file, page window, rule shard) call, keyed by unit
+AUDITOR = "auditor"             # the auditor's complete output: draft findings and log messages
+
+
+class RunCheckpoints:
+    """
+    Per-run progress of an audit, so a failed or interrupted run can be resumed
+    at the first incomplete node (and, inside the auditor, at the first unaudited
+    file) instead of starting over. Backed by a local SQLite file.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or AUDIT_CHECKPOINTS_PATH
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists checkpoints ("
+                " run_id text not null,"
+                " step text not null,"
+                " item text not null default '',"
+                " data text not null,"
+                " created_at real not null,"
+                " primary key (run_id, step, item))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps this safe to use from the auditor's worker threads.
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def put(self, run_id: str, step: str, data: Any, item: str = ""):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "insert or replace into checkpoints (run_id, step, item, data, created_at) values (?, ?, ?, ?, ?)",
+                    (run_id, step, item, json.dumps(data), time.time())
+                )
+        except Exception as e:
+            # Losing a checkpoint only costs redoing that step on resume
+            logger.warning(f"Failed to checkpoint {step} for run {run_id}: {e}")
+
+    def items(self, run_id: str, step: str) -> Dict[str, Any]:
+        """All checkpoints of a step, by item."""
+        try:
+            with self._connect() as conn:
+                rows = conn.execute("select item, data from checkpoints where run_id = ? and step = ?", (run_id, step)).fetchall()
+        except Exception as e:
+            logger.warning(f"Checkpoint read failed for run {run_id}, redoing {step}: {e}")
+            return {}
+        return {item: json.loads(data) for item, data in rows}
+
+    def get(self, run_id: str, step: str, item: str = "") -> Optional[Any]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute("select data from checkpoints where run_id = ? and step = ? and item = ?", (run_id, step, item)).fetchone()
+        except Exception as e:
+            logger.warning(f"Checkpoint read failed for run {run_id}, redoing {step}: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    # --- typed helpers for the graph ---
+
+    def put_rules(self, run_id: str, rules: List[AuditRule]):
+        self.put(run_id, STRATEGIST, [r.model_dump() for r in rules])
+
+    def put_unit(self, run_id: str, unit_key: str, findings: List[Finding]):
+        self.put(run_id, AUDITOR_UNIT, [f.model_dump() for f in findings], item=unit_key)
+
+    def units(self, run_id: str) -> Dict[str, List[Finding]]:
+        return {key: [Finding(**f) for f in findings] for key, findings in self.items(run_id, AUDITOR_UNIT).items()}
+
+    def put_audit(self, run_id: str, draft_findings: List[Finding], messages: List[str]):
+        self.put(run_id, AUDITOR, {"draft_findings": [f.model_dump() for f in draft_findings], "messages": messages})
+
+    def load(self, run_id: str) -> dict:
+        """
+        The state to resume the run from: {} for a new run, {"rules"} once the
+        strategist is done, plus {"draft_findings", "messages"} once the auditor is.
+        """
+        state = {}
+        try:
+            with self._connect() as conn:
+                rows = dict(conn.execute(
+                    "select step, data from checkpoints where run_id = ? and step in (?, ?) and item = ''",
+                    (run_id, STRATEGIST, AUDITOR)
+                ).fetchall())
+        except Exception as e:
+            logger.warning(f"Checkpoint read failed for run {run_id}, starting over: {e}")
+            return state
+        if STRATEGIST in rows:
+            state["rules"] = [AuditRule(**r) for r in json.loads(rows[STRATEGIST])]
+            if AUDITOR in rows:
+                audit = json.loads(rows[AUDITOR])
+                state["draft_findings"] = [Finding(**f) for f in audit["draft_findings"]]
+                state["messages"] = audit["messages"]
+        return state
+
+    def purge(self, older_than: float = AUDIT_CHECKPOINT_RETENTION) -> int:
+        """Deletes runs whose latest checkpoint is older than `older_than` seconds."""
+        self._last_purge = time.time()
+        try:
+            with self._connect() as conn:
+                return conn.execute(
+                    "delete from checkpoints where run_id in"
+                    " (select run_id from checkpoints group by run_id having max(created_at) < ?)",
+                    (time.time() - older_than,)
+                ).rowcount
+        except Exception as e:
+            logger.warning(f"Checkpoint purge failed: {e}")
+            return 0
+
+    def maybe_purge(self, interval: float = 3600):
+        if time.time() - self._last_purge > interval:
+            self.purge()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import pytest
+
+# Tests run offline, against throwaway stores. Set before any backend module reads its configuration.
+_scratch = tempfile.mkdtemp(prefix="universal_audit_tests_")
+for name, file_name in [
+    ("FINDINGS_STORE_PATH", "findings.db"),
+    ("UPLOAD_CACHE_PATH", "upload_cache.db"),
+    ("AUDIT_CHECKPOINTS_PATH", "checkpoints.db"),
+    ("AUDIT_JOBS_PATH", "jobs.db"),
+    ("REFERENCE_INDEX_DIR", "index"),
+]:
+    os.environ.setdefault(name, os.path.join(_scratch, file_name))
+os.environ.setdefault("GEMINI_CLIENT", "fake")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "supabase_schema.sql")
+
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    """A throwaway local Postgres with supabase_schema.sql applied. Needs pgserver and psycopg2, skipped without them."""
+    pgserver = pytest.importorskip("pgserver")
+    pytest.importorskip("psycopg2")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("postgres")), cleanup_mode="stop")
+    with open(SCHEMA_PATH) as f:
+        server.psql(f.read())
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture
+def postgres(postgres_server):
+    """A psycopg2 connection (autocommit) to the test database, with the sessions table emptied."""
+    import psycopg2
+
+    conn = psycopg2.connect(postgres_server.get_uri())
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("truncate sessions, rule_cache")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def file_manager():
+    """A FileManager on an in-memory Supabase (bench/fake_supabase), not polling for other workers' uploads."""
+    from bench.fake_supabase import InMemorySupabase
+    from backend.file_manager import FileManager
+
+    manager = FileManager()
+    manager.db = InMemorySupabase()
+    manager.poll_upload_fallback = False
+    return manager
+
+
+@pytest.fixture
+def fake_gemini():
+    """Installs a FakeGeminiClient as the process-wide client (the test may swap in its own) and resets it after."""
+    from backend.fake_gemini import FakeGeminiClient
+    from backend.gemini_client import gemini_clients
+
+    client = FakeGeminiClient()
+    gemini_clients.use(client)
+    yield client
+    gemini_clients.use(None)
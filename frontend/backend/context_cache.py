@@ -0,0 +1,162 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from google.genai import types
+from backend.models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_ENABLED = os.environ.get("REFERENCE_CONTEXT_CACHE", "1") == "1"
+CONTEXT_CACHE_TTL = int(os.environ.get("REFERENCE_CONTEXT_CACHE_TTL", "3600")) # seconds
+CONTEXT_CACHE_MAX_ENTRIES = int(os.environ.get("REFERENCE_CONTEXT_CACHE_MAX_ENTRIES", "64"))
+# Extend a handle's TTL once less than this fraction of it is left.
+REFRESH_FRACTION = 0.25
+# After a failed create (e.g. reference set below the model's minimum cacheable size),
+# don't retry the same set for this long.
+FAILURE_BACKOFF = 600 # seconds
+
+
+def reference_parts(reference_files: List[UploadedFile]) -> List[types.Part]:
+    """The reference documents as inline file parts."""
+    return [types.Part.from_uri(file_uri=f.uri, mime_type="application/pdf") for f in reference_files] # Generic mime
+
+
+class ReferenceContextCache:
+    """
+    Gemini cached-content handles for a session's reference documents, so the
+    strategist, the verifier and follow-up turns don't each pay to re-process
+    the same large PDFs. Keyed by model + the set of reference files.
+    """
+
+    def __init__(self, client_factory: Callable, ttl: int = CONTEXT_CACHE_TTL, max_entries: int = CONTEXT_CACHE_MAX_ENTRIES, enabled: bool = CONTEXT_CACHE_ENABLED):
+        self.client_factory = client_factory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict() # key -> {"name", "expires_at"}
+        self._failures = {} # key -> time of last failed create
+        self._lock = threading.Lock()
+        self._key_locks = {} # key -> [lock, callers using it]; only keys being looked up right now
+
+    @staticmethod
+    def _key(model: str, reference_files: List[UploadedFile]) -> Optional[tuple]:
+        # Content hash, so re-uploads of the same bytes share a handle; None (no caching) if one is unknown
+        if any(not f.content_hash for f in reference_files):
+            return None
+        return (model, tuple(sorted(f.content_hash for f in reference_files)))
+
+    @contextmanager
+    def _key_lock(self, key: tuple):
+        """Serializes lookups of one reference set. The lock is dropped when its last user is done."""
+        with self._lock:
+            holder = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            holder[1] += 1
+        try:
+            with holder[0]:
+                yield
+        finally:
+            with self._lock:
+                holder[1] -= 1
+                if not holder[1]:
+                    del self._key_locks[key]
+
+    def get(self, model: str, reference_files: List[UploadedFile]) -> Optional[str]:
+        """
+        Returns a cached-content name covering these references, creating or refreshing
+        it as needed. Returns None when caching isn't possible; callers then send the
+        references inline via reference_parts().
+        """
+        if not self.enabled or not reference_files:
+            return None
+
+        key = self._key(model, reference_files)
+        if key is None:
+            return None
+        # One create per reference set at a time; other sets aren't blocked.
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                failed_at = self._failures.get(key)
+            if failed_at and time.time() - failed_at < FAILURE_BACKOFF:
+                return None
+
+            if entry:
+                remaining = entry["expires_at"] - time.time()
+                if remaining > self.ttl * REFRESH_FRACTION:
+                    with self._lock:
+                        self._entries.move_to_end(key)
+                    return entry["name"]
+                if remaining > 0 and self._refresh(entry):
+                    return entry["name"]
+                # Expired or couldn't be extended: build a new one
+                self._drop(key)
+
+            return self._create(key, model, reference_files)
+
+    def _create(self, key: tuple, model: str, reference_files: List[UploadedFile]) -> Optional[str]:
+        try:
+            cached = self.client_factory().caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"references-{len(reference_files)}",
+                    contents=[types.Content(role="user", parts=reference_parts(reference_files))],
+                    ttl=f"{self.ttl}s"
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Reference context caching unavailable, sending references inline: {e}")
+            now = time.time()
+            with self._lock:
+                # Forget failures whose backoff is over, so the map doesn't grow with every set ever tried
+                self._failures = {k: t for k, t in self._failures.items() if now - t < FAILURE_BACKOFF}
+                self._failures[key] = now
+            return None
+
+        logger.info(f"Created reference context cache {cached.name} for {len(reference_files)} file(s).")
+        with self._lock:
+            self._failures.pop(key, None)
+            self._entries[key] = {"name": cached.name, "expires_at": self._expiry(cached)}
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for old in evicted:
+            self._delete_remote(old["name"])
+        return cached.name
+
+    def _refresh(self, entry: dict) -> bool:
+        try:
+            cached = self.client_factory().caches.update(
+                name=entry["name"],
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+            )
+            entry["expires_at"] = self._expiry(cached)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to refresh context cache {entry['name']}: {e}")
+            return False
+
+    def _expiry(self, cached) -> float:
+        if getattr(cached, "expire_time", None):
+            return cached.expire_time.timestamp()
+        return time.time() + self.ttl
+
+    def _drop(self, key: tuple):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry:
+            self._delete_remote(entry["name"])
+
+    def _delete_remote(self, name: str):
+        try:
+            self.client_factory().caches.delete(name=name)
+        except Exception as e:
+            # Remote caches expire on their own, so this is only a cleanup nicety
+            logger.info(f"Could not delete context cache {name}: {e}")
+
+    def invalidate(self, model: str, reference_files: List[UploadedFile]):
+        """Drops the handle for a reference set, e.g. after the model rejected it."""
+        self._drop(self._key(model, reference_files))
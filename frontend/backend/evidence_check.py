@@ -0,0 +1,250 @@
+import os
+import re
+import bisect
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional
+from backend.models import Finding, UploadedFile, VerifiedFinding
+
+logger = logging.getLogger(__name__)
+
+# Share of the quote's word trigrams that must appear, in one place, in the document
+EVIDENCE_MATCH_THRESHOLD = float(os.environ.get("EVIDENCE_MATCH_THRESHOLD", "0.6"))
+SHINGLE_WORDS = 3
+# Pages ranked by shared shingles that get an exact alignment
+CANDIDATE_PAGES = 3
+INDEX_CACHE_ENTRIES = 16
+
+# verification_status values
+VERIFIED = "Verified"
+HALLUCINATION = "Hallucination"
+UNVERIFIED = "Unverified" # nothing to check: no text layer or local copy, or evidence that isn't a quote
+
+_WORD = re.compile(r"[^\W_]+")
+# Quoted text in the evidence (straight or curly double quotes). Only quotes are claimed
+# to be verbatim; the rest may be a paraphrase or say that something is missing.
+_QUOTED = re.compile(r'"([^"]+)"|\u201c([^\u201d]+)\u201d')
+# Quotes joined with an ellipsis (the auditor's merged findings, or elided text) are checked part by part
+_ELLIPSIS = re.compile(r"\.{3,}|\u2026")
+_HYPHEN_BREAK = re.compile(r"-\s*\n\s*")
+
+# Index keys: shingle hash in the high bits, page number in the low bits
+_PAGE_BITS = 20
+_HASH_MASK = (1 << (64 - _PAGE_BITS)) - 1
+
+
+def words(text: str) -> List[str]:
+    """Lower-cased words, ignoring punctuation, ligatures and words hyphenated over a line break."""
+    text = unicodedata.normalize("NFKC", _HYPHEN_BREAK.sub("", text or "")).lower()
+    return _WORD.findall(text)
+
+
+def quoted_spans(evidence: str) -> List[str]:
+    """The double-quoted passages of an evidence string, in order."""
+    return [a or b for a, b in _QUOTED.findall(evidence or "") if words(a or b)]
+
+
+def _shingle_hash(shingle: str) -> int:
+    # Python's string hash: fast, and only used within this process
+    return hash(shingle) & _HASH_MASK
+
+
+def _shingles(ws: List[str]) -> List[str]:
+    return list(map(" ".join, zip(*(ws[i:] for i in range(SHINGLE_WORDS)))))
+
+
+class EvidenceMatch(NamedTuple):
+    file_name: str
+    page: int # 1-based
+    score: float # share of the quote found in the matched span
+    excerpt: str # the matched span, normalized
+
+
+class ShingleIndex:
+    """
+    Word-trigram index of one document: a sorted array of (shingle hash, page)
+    keys, so candidate pages for a quote are a few bisects. Page text is kept
+    normalized for the final alignment on the best candidates.
+    """
+
+    def __init__(self, pages: List[str]):
+        self.pages = [" ".join(words(p)) for p in pages]
+        keys = set()
+        for page, text in enumerate(self.pages[:1 << _PAGE_BITS]):
+            ws = text.split()
+            # Shingles straddling the page break belong to the earlier page, so quotes across pages match too
+            if page + 1 < len(self.pages):
+                ws = ws + self.pages[page + 1].split(None, SHINGLE_WORDS - 1)[:SHINGLE_WORDS - 1]
+            keys.update([((hash(s) & _HASH_MASK) << _PAGE_BITS) | page for s in _shingles(ws)])
+        self.keys = array("Q", sorted(keys))
+
+    def _pages_with(self, shingle: str) -> List[int]:
+        h = _shingle_hash(shingle) << _PAGE_BITS
+        lo = bisect.bisect_left(self.keys, h)
+        hi = bisect.bisect_left(self.keys, h + (1 << _PAGE_BITS), lo)
+        return [key & ((1 << _PAGE_BITS) - 1) for key in self.keys[lo:hi]]
+
+    def _align(self, quote: List[str], quote_shingles: set, page: int) -> tuple:
+        """Best window on the page (and the start of the next) for the quote: (score, page, excerpt)."""
+        ws = self.pages[page].split()
+        page_len = len(ws)
+        if page + 1 < len(self.pages):
+            ws += self.pages[page + 1].split()[:len(quote)]
+        hits = [i for i, s in enumerate(_shingles(ws)) if s in quote_shingles]
+        if not hits:
+            return 0.0, page, ""
+        # Largest cluster of matching shingles within a quote-sized window (some slack for small edits)
+        width = len(quote) + len(quote) // 4 + 2
+        best, best_start, best_end, start = 0, hits[0], hits[0], 0
+        for end in range(len(hits)):
+            while hits[end] - hits[start] > width:
+                start += 1
+            if end - start + 1 > best:
+                best, best_start, best_end = end - start + 1, hits[start], hits[end]
+        # Scored by the words the matching shingles cover: one wrong word in a short quote still matches mostly
+        covered = set()
+        for i in hits:
+            if best_start <= i <= best_end:
+                covered.update(range(i, i + SHINGLE_WORDS))
+        score = min(1.0, len(covered) / len(quote))
+        span_page = page if best_start < page_len else page + 1
+        return score, span_page, " ".join(ws[best_start:best_end + SHINGLE_WORDS])
+
+    def match(self, quote: str) -> Optional[tuple]:
+        """(score, 0-based page, excerpt) of the quote's best match, None if nothing matches."""
+        q = words(quote)
+        if not q:
+            return None
+        if len(q) < SHINGLE_WORDS:
+            # Too short to shingle ("C41.2", "stage II"): plain search
+            needle = f" {' '.join(q)} "
+            for page, text in enumerate(self.pages):
+                if needle in f" {text} ":
+                    return 1.0, page, needle.strip()
+            return 0.0, 0, ""
+        quote_shingles = set(_shingles(q))
+        candidates = Counter()
+        for s in quote_shingles:
+            candidates.update(self._pages_with(s))
+        if not candidates:
+            return 0.0, 0, ""
+        return max(self._align(q, quote_shingles, page) for page, _ in candidates.most_common(CANDIDATE_PAGES))
+
+
+class EvidenceVerifier:
+    """
+    Checks that each finding's evidence quote really appears in its target
+    document, before the report is written. `page_text` returns a file's
+    extracted page texts (None when it has no text layer or isn't available).
+    """
+
+    def __init__(self, page_text: Callable[[UploadedFile], Optional[List[str]]], threshold: float = None):
+        self.page_text = page_text
+        self.threshold = EVIDENCE_MATCH_THRESHOLD if threshold is None else threshold
+        self._cache: "OrderedDict[str, ShingleIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, file_obj: UploadedFile) -> bool:
+        """Builds (and keeps) the file's index ahead of its audit. True if it has text to check against."""
+        return self._index(file_obj) is not None
+
+    def _index(self, file_obj: UploadedFile) -> Optional[ShingleIndex]:
+        key = file_obj.content_hash or file_obj.local_path
+        if not key:
+            return None
+        with self._lock:
+            index = self._cache.get(key)
+            if index is not None:
+                self._cache.move_to_end(key)
+                return index
+        try:
+            pages = self.page_text(file_obj)
+        except Exception as e:
+            logger.warning(f"No page text for {file_obj.name}: {e}")
+            pages = None
+        if not pages:
+            return None
+        index = ShingleIndex(pages)
+        with self._lock:
+            self._cache[key] = index
+            while len(self._cache) > INDEX_CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+        return index
+
+    def locate(self, quote: str, target_files: List[UploadedFile], file_name: str = None) -> Optional[EvidenceMatch]:
+        """
+        Best match of the quote in the named file, or in any target if the name
+        matches none (or the quote isn't there). None when no target has text.
+        """
+        named = [f for f in target_files if f.name == file_name]
+        others = [f for f in target_files if f.name != file_name]
+        best = None
+        for group in (named, others):
+            for f in group:
+                index = self._index(f)
+                if index is None:
+                    continue
+                found = index.match(quote)
+                if found is None:
+                    continue
+                score, page, excerpt = found
+                if best is None or score > best.score:
+                    best = EvidenceMatch(f.name, page + 1, round(score, 3), excerpt)
+            if best is not None and best.score >= self.threshold:
+                break
+        return best
+
+    def _match_parts(self, texts: List[str], target_files: List[UploadedFile], file_name: str) -> Optional[EvidenceMatch]:
+        """
+        Matches each part of the quotes (split at ellipses, which mark elided text or merged findings);
+        the score is the parts' average, weighted by length.
+        """
+        parts = [(part, len(words(part))) for text in texts for part in _ELLIPSIS.split(text)]
+        parts = [(part, n) for part, n in parts if n]
+        if not parts:
+            return None
+        matches = [(self.locate(part, target_files, file_name), n) for part, n in parts]
+        if any(m is None for m, _ in matches):
+            return None
+        score = sum(m.score * n for m, n in matches) / sum(n for _, n in matches)
+        # Reported at the longest part
+        lead = max(matches, key=lambda t: t[1])[0]
+        return lead._replace(score=round(score, 3))
+
+    def verify(self, findings: List[Finding], target_files: List[UploadedFile]) -> List[VerifiedFinding]:
+        """
+        Quoted evidence must be in the document, or the finding is a Hallucination. Evidence without
+        quotes is matched too, as the auditor may quote without marks, but not finding it proves
+        nothing (a paraphrase, "no discharge date recorded"): that is Unverified.
+        """
+        verified = []
+        for f in findings:
+            data = f.model_dump()
+            quotes = quoted_spans(f.evidence)
+            match = self._match_parts(quotes or [f.evidence], target_files, f.file_name)
+            if match is None:
+                data.update(verification_status=UNVERIFIED, explanation="Evidence could not be checked: no extracted text for the target document.")
+            elif match.score >= self.threshold:
+                data.update(verification_status=VERIFIED,
+                            explanation=f"Evidence found in {match.file_name}, page {match.page} ({match.score:.0%} of the quote matches).")
+                if match.file_name == f.file_name:
+                    data["page_number"] = match.page
+            elif quotes:
+                closest = f' Closest text ({match.score:.0%}): "{match.excerpt[:160]}"' if match.excerpt else ""
+                data.update(verification_status=HALLUCINATION,
+                            explanation=f"Quoted evidence not found in the target documents.{closest}")
+            else:
+                data.update(verification_status=UNVERIFIED,
+                            explanation="Evidence is not a quote from the document (no quoted text), so it was not checked.")
+            verified.append(VerifiedFinding(**data))
+        return verified
+
+
+def summarize(findings: List[VerifiedFinding]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for f in findings:
+        counts[f.verification_status] = counts.get(f.verification_status, 0) + 1
+    return counts
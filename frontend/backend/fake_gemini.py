@@ -0,0 +1,164 @@
+import re
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Optional
+from backend.models import AuditRule, Finding
+
+
+class FakeResponse:
+    """Mimics the parts of GenerateContentResponse the backend reads."""
+
+    def __init__(self, text: str = "", parsed=None, prompt_tokens: int = 0, output_tokens: int = 0):
+        self.text = text
+        self.parsed = parsed
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            cached_content_token_count=0,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+
+
+def _prompt_text(contents) -> str:
+    texts = []
+    for content in contents or []:
+        for part in getattr(content, "parts", None) or []:
+            if getattr(part, "text", None):
+                texts.append(part.text)
+    return "\n".join(texts)
+
+
+def default_responder(model: str, contents, config) -> FakeResponse:
+    """
+    Deterministic canned answers shaped like the real ones: a small rule set for the
+    strategist, one passing finding per rule for the auditor, a short report for the verifier.
+    """
+    prompt = _prompt_text(contents)
+    prompt_tokens = len(prompt) // 4 + 1
+    schema = getattr(config, "response_schema", None)
+
+    if schema == list[AuditRule]:
+        rules = [
+            AuditRule(rule_id=f"GEN-{i:03d}", description=f"Standard compliance check #{i}", severity="Medium")
+            for i in range(1, 6)
+        ]
+        return FakeResponse(text=json.dumps([r.model_dump() for r in rules]), parsed=rules, prompt_tokens=prompt_tokens, output_tokens=60 * len(rules))
+
+    if schema == list[Finding]:
+        match = re.search(r"'file_name': \"([^\"]*)\"", prompt)
+        file_name = match.group(1) if match else "unknown"
+        rule_ids = re.findall(r'"rule_id": "([^"]+)"', prompt) or ["GEN-001"]
+        findings = [
+            Finding(rule_id=rule_id, description="Checked", status="Pass", evidence="Document is consistent with the rule.", file_name=file_name, page_number=1)
+            for rule_id in rule_ids
+        ]
+        return FakeResponse(text=json.dumps([f.model_dump() for f in findings]), parsed=findings, prompt_tokens=prompt_tokens, output_tokens=50 * len(findings))
+
+    report = "# Audit Report\n\n#### 1. Audit Certificate\n- **Outcome**: PASS\n- **Summary**: Offline fake report.\n"
+    return FakeResponse(text=report, prompt_tokens=prompt_tokens, output_tokens=len(report) // 4 + 1)
+
+
+def _chunks(response: FakeResponse, size: int = 16):
+    text = response.text or ""
+    pieces = [FakeResponse(text=text[i:i + size]) for i in range(0, len(text), size)] or [FakeResponse()]
+    # Like the real API, the final chunk reports the usage for the whole response
+    pieces[-1].usage_metadata = response.usage_metadata
+    yield from pieces
+
+
+class _FakeModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, *, model, contents, config=None):
+        self._owner.calls.append(("generate_content", model))
+        time.sleep(self._owner.latency(model, contents, config))
+        return self._owner.responder(model, contents, config)
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        self._owner.calls.append(("generate_content_stream", model))
+        time.sleep(self._owner.latency(model, contents, config))
+        return _chunks(self._owner.responder(model, contents, config), self._owner.chunk_chars)
+
+
+class _FakeAsyncModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def generate_content(self, *, model, contents, config=None):
+        self._owner.calls.append(("aio.generate_content", model))
+        await asyncio.sleep(self._owner.latency(model, contents, config))
+        return self._owner.responder(model, contents, config)
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        self._owner.calls.append(("aio.generate_content_stream", model))
+        # Latency here is time to first chunk; the rest of the stream arrives at once
+        await asyncio.sleep(self._owner.latency(model, contents, config))
+        response = self._owner.responder(model, contents, config)
+
+        async def stream():
+            for chunk in _chunks(response, self._owner.chunk_chars):
+                yield chunk
+        return stream()
+
+
+class _FakeFiles:
+    def __init__(self):
+        self._files = {}
+
+    def upload(self, *, file, config=None):
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        remote = SimpleNamespace(
+            name=name,
+            display_name=str(file),
+            uri=f"https://fake.local/v1beta/{name}",
+            state=SimpleNamespace(name="ACTIVE"),
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48),
+        )
+        self._files[name] = remote
+        return remote
+
+    def get(self, *, name):
+        if name not in self._files:
+            raise KeyError(f"{name} not found")
+        return self._files[name]
+
+    def list(self):
+        return list(self._files.values())
+
+    def delete(self, *, name):
+        self._files.pop(name, None)
+
+
+class _FakeCaches:
+    def create(self, *, model, config=None):
+        return SimpleNamespace(name=f"cachedContents/{uuid.uuid4().hex[:12]}", expire_time=None)
+
+    def update(self, *, name, config=None):
+        return SimpleNamespace(name=name, expire_time=None)
+
+    def delete(self, *, name):
+        pass
+
+
+class FakeGeminiClient:
+    """
+    Offline stand-in for genai.Client with the surface this backend uses
+    (models, aio.models, files, caches). Pass a responder to script answers
+    and a latency function (model, contents, config) -> seconds to simulate the network.
+    Streams are cut into chunks of `chunk_chars` characters.
+    """
+
+    def __init__(self, responder: Optional[Callable] = None, latency: Optional[Callable] = None, chunk_chars: int = 16):
+        self.responder = responder or default_responder
+        self.latency = latency or (lambda model, contents, config: 0)
+        self.chunk_chars = chunk_chars
+        self.calls = []
+        self.models = _FakeModels(self)
+        self.aio = SimpleNamespace(models=_FakeAsyncModels(self))
+        self.files = _FakeFiles()
+        self.caches = _FakeCaches()
@@ -1,30 +1,43 @@
 import os
+import time
+import atexit
 import shutil
 import logging
 import asyncio
-from typing import List, Optional
-import google.genai.files
-from google import genai
+import mimetypes
+from typing import List, Optional, Dict
 from supabase import create_client, Client
-from backend.models import UploadedFile
+from backend.models import UploadedFile, HistoryPage, SessionList
+from backend.gemini_client import gemini_clients
+from backend.upload_cache import UploadCache, hash_file
+from backend.uploads import UploadRegistry, UPLOAD_PENDING_TIMEOUT
+from backend.session_store import SessionStore, file_key, HISTORY_PAGE_SIZE
+from backend.session_cache import SessionCache
+from backend.model_calls import model_calls
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class FileManager:
     def __init__(self):
-        # Initialize Gemini
+        # Gemini client comes from the shared registry (created lazily, same pool as the agents)
         self.api_key = os.environ.get("GOOGLE_API_KEY")
         if not self.api_key:
             logger.warning("GOOGLE_API_KEY not found. File operations will verify.")
-        
-        try:
-            self.client = genai.Client(api_key=self.api_key)
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini Client: {e}")
-            self.client = None
+
+        # Content-addressed cache of files already sitting in the Gemini File API
+        self.upload_cache = UploadCache()
+        # Uploads in flight in this process, so waiters don't have to poll the DB
+        self.upload_registry = UploadRegistry()
+        # Multi-worker deployments also need to see uploads running in other processes
+        self.poll_upload_fallback = os.environ.get("UPLOAD_WAIT_POLL_FALLBACK", "1") == "1"
 
         # Initialize Supabase
+        self.sessions = SessionStore()
+        # Parsed session rows kept in memory (with write-behind for column overwrites that coalesce)
+        self.session_cache = SessionCache(self._write_session_columns)
+        # Don't lose deferred writes on a clean shutdown
+        atexit.register(self.flush_session_writes)
         self.supabase_url = os.environ.get("SUPABASE_URL")
         self.supabase_key = os.environ.get("SUPABASE_KEY")
         self.db: Optional[Client] = None
@@ -38,52 +51,91 @@ class FileManager:
         else:
             logger.warning("SUPABASE_URL or SUPABASE_KEY not found. Database operations will fail.")
 
-    def get_session_details(self, session_id: str, user_id: str = None, db_client: Client = None):
-        """Returns full session details from Supabase using the provided client or default."""
-        client = db_client or self.db
-        if not client:
-            return {"reference": [], "target": [], "summary": None, "history": []}
-        
+    @property
+    def client(self):
+        """Shared Gemini client, or None if it can't be created (e.g. no API key)."""
+        return gemini_clients.get_optional()
+
+    def get_session_details(self, session_id: str, user_id: str = None, db_client: Client = None, max_age: float = None):
+        """Returns the session's files and summary (no history, see get_session_history), from the session cache when fresh."""
         try:
-            query = client.table("sessions").select("*").eq("session_id", session_id)
-            if user_id:
-                query = query.eq("user_id", user_id)
-            response = query.execute()
-            
-            if response.data and len(response.data) > 0:
-                data = response.data[0]
-                
-                def parse_files(file_list):
-                    valid_files = []
-                    if not file_list:
-                        return valid_files
-                    
-                    # Check if file_list is a list of dicts or strings (if legacy data)
-                    if isinstance(file_list, str):
-                        import json
-                        try:
-                            file_list = json.loads(file_list)
-                        except:
-                            return []
-
-                    for f in file_list:
-                        try:
-                            # Handle potential missing fields by checking dict keys against model
-                            valid_files.append(UploadedFile(**f))
-                        except Exception as parse_err:
-                            logger.error(f"Failed to parse file record in session {session_id}: {f}, Error: {parse_err}")
-                    return valid_files
-
-                return {
-                    "reference": parse_files(data.get("reference", [])),
-                    "target": parse_files(data.get("target", [])),
-                    "summary": data.get("summary"),
-                    "history": data.get("history", [])
-                }
+            details = self._session_details(session_id, user_id, db_client, max_age)
+            if details:
+                return details
         except Exception as e:
             logger.error(f"Failed to load session {session_id} from Supabase: {e}")
             
-        return {"reference": [], "target": [], "summary": None, "history": []}
+        return {"reference": [], "target": [], "summary": None}
+
+    def _session_details(self, session_id: str, user_id: str = None, db_client: Client = None, max_age: float = None) -> Optional[dict]:
+        """Like get_session_details, but returns None for unknown sessions and lets DB errors through."""
+        client = db_client or self.db
+        if not client:
+            return None
+        if db_client is not None:
+            # Caller-supplied credentials: don't serve or populate the shared cache
+            loaded = self._load_session(client, session_id, user_id)
+            return loaded[0] if loaded else None
+        return self.session_cache.get(
+            session_id,
+            user_id,
+            loader=lambda: self._load_session(client, session_id, user_id),
+            version_of=lambda: self.sessions.get_version(client, session_id, user_id),
+            max_age=max_age
+        )
+
+    def _load_session(self, client: Client, session_id: str, user_id: str = None):
+        """Reads and parses a session row (minus history). Returns (details, updated_at, owner), or None if there is no such session."""
+        data = self.sessions.get_overview(client, session_id, user_id)
+        if not data:
+            return None
+
+        details = {
+            "reference": self._parse_files(session_id, data.get("reference", [])),
+            "target": self._parse_files(session_id, data.get("target", [])),
+            "summary": data.get("summary"),
+        }
+        return details, data.get("updated_at"), data.get("user_id")
+
+    def get_session_history(self, session_id: str, user_id: str = None, page: int = 1, page_size: int = HISTORY_PAGE_SIZE, db_client: Client = None) -> HistoryPage:
+        """One page of the session's chat history (page 1 = most recent messages)."""
+        client = db_client or self.db
+        if not client:
+            return HistoryPage(page=page, page_size=page_size)
+        try:
+            return self.sessions.get_history_page(client, session_id, user_id, page, page_size)
+        except Exception as e:
+            logger.error(f"Failed to load history of session {session_id}: {e}")
+            return HistoryPage(page=page, page_size=page_size)
+
+    def list_sessions(self, user_id: str, limit: int = 20, cursor: str = None, db_client: Client = None) -> SessionList:
+        """The user's sessions, newest activity first. Raises ValueError on a bad cursor."""
+        client = db_client or self.db
+        if not client:
+            return SessionList()
+        return self.sessions.list_sessions(client, user_id, limit, cursor)
+
+    @staticmethod
+    def _parse_files(session_id: str, file_list) -> List[UploadedFile]:
+        valid_files = []
+        if not file_list:
+            return valid_files
+        
+        # Check if file_list is a list of dicts or strings (if legacy data)
+        if isinstance(file_list, str):
+            import json
+            try:
+                file_list = json.loads(file_list)
+            except:
+                return []
+
+        for f in file_list:
+            try:
+                # Handle potential missing fields by checking dict keys against model
+                valid_files.append(UploadedFile(**f))
+            except Exception as parse_err:
+                logger.error(f"Failed to parse file record in session {session_id}: {f}, Error: {parse_err}")
+        return valid_files
 
     def get_session_files(self, session_id: str, file_type: str = "reference", user_id: str = None, db_client: Client = None):
         """Retrieve files for a specific session from Supabase."""
@@ -91,66 +143,116 @@ class FileManager:
         return details.get(file_type, [])
 
     def _save_session_to_db(self, session_id: str, data: dict, user_id: str = None, db_client: Client = None):
-        """Internal helper to save data to Supabase (Upsert)."""
+        """Internal helper to save data to Supabase (Upsert of the given columns only)."""
         client = db_client or self.db
         if not client:
             return
         
+        if db_client is None:
+            # Our own deferred write goes first, or this write would make it stale
+            self.session_cache.flush(session_id)
         try:
-            # Check existence first to decide INSERT vs UPDATE if needed, 
-            # OR rely on upsert if we provide all columns.
-            # But we often provide partial updates (e.g. only summary).
-            # Supabase upsert usually replaces row unless on_conflict handles it?
-            # Actually, `table.upsert` behaves as INSERT ON CONFLICT DO UPDATE.
-            # BUT if we omit columns, they might get set to DEFAULT (or null).
-            # So partial update via `update` is better if record exists.
-            
-            
-            check = client.table("sessions").select("session_id").eq("session_id", session_id).execute()
-            exists = len(check.data) > 0
-            
-            if exists:
-                query = client.table("sessions").update(data).eq("session_id", session_id)
-                if user_id:
-                    # Ensure we only update if user owns it? Or trust the caller?
-                    # Generally good to enforce.
-                    query = query.eq("user_id", user_id)
-                query.execute()
-            else:
-                # For insert, we need session_id in payload
-                payload = {"session_id": session_id, **data}
-                if user_id:
-                    payload["user_id"] = user_id
-                client.table("sessions").insert(payload).execute()
-
+            self.sessions.upsert(client, session_id, data, user_id)
             logger.info(f"Session {session_id} saved to Supabase.")
         except Exception as e:
             logger.error(f"Failed to save session {session_id} to Supabase: {e}")
             raise e
+        if db_client is None:
+            self.session_cache.set_columns(session_id, data, user_id)
+
+    def _write_session_columns(self, session_id: str, data: dict, user_id: str = None, version: str = None) -> bool:
+        """Write-behind target of the session cache. False if the row changed since `version`."""
+        if not self.db:
+            return True
+        written = self.sessions.upsert_if_unchanged(self.db, session_id, data, version, user_id)
+        if written:
+            logger.info(f"Session {session_id}: flushed deferred write of {', '.join(data)}.")
+        return written
+
+    def flush_session_writes(self, session_id: str = None):
+        """Writes deferred session updates now (one session, or all of them)."""
+        self.session_cache.flush(session_id)
 
     def add_file_to_session(self, session_id: str, file_obj: UploadedFile, file_type: str, user_id: str = None, db_client: Client = None):
         """Add a file to a session's list in Supabase."""
-        details = self.get_session_details(session_id, user_id, db_client)
-        
-        # Avoid duplicates in session (by URI)
-        existing = [f for f in details[file_type] if f.uri == file_obj.uri]
-        if not existing:
-            details[file_type].append(file_obj)
-            
-            # Save the updated list.
-            db_data = {
-                file_type: [f.model_dump() for f in details[file_type]]
-            }
-            self._save_session_to_db(session_id, db_data, user_id, db_client)
+        self.add_files_to_session(session_id, {file_type: [file_obj]}, user_id, db_client)
+
+    def add_files_to_session(self, session_id: str, files: Dict[str, List[UploadedFile]], user_id: str = None, db_client: Client = None):
+        """
+        Add many files (keyed by "reference"/"target") to a session with one read and at most one write.
+        Files the session already has are skipped, so re-sending a known file set costs no write at all.
+        """
+        client = db_client or self.db
+        if not client or not any(files.values()):
+            return
+
+        try:
+            cached = self.session_cache.peek(session_id, user_id) if db_client is None else None
+            if cached:
+                # Hot session: diff against the cached lists, no read needed
+                stored = {t: [f.model_dump() for f in cached[t]] for t in ("reference", "target")}
+            else:
+                stored = self.sessions.get_files(client, session_id, user_id)
+            new_files = {}
+            for file_type, file_objs in files.items():
+                known = {file_key(f) for f in stored.get(file_type, [])}
+                for f in file_objs:
+                    record = f.model_dump()
+                    key = file_key(record)
+                    # Files with neither URI nor local path can't be told apart, skip them
+                    if key and key not in known:
+                        new_files.setdefault(file_type, []).append(record)
+                        known.add(key)
+
+            if not new_files:
+                return
+            if db_client is None:
+                self.session_cache.flush(session_id)
+            self.sessions.append_file_sets(client, session_id, new_files, user_id)
+            if db_client is None:
+                self.session_cache.add_files(session_id, {t: [UploadedFile(**r) for r in records] for t, records in new_files.items()}, user_id)
+            logger.info(f"Session {session_id}: added {sum(len(v) for v in new_files.values())} file(s).")
+        except Exception as e:
+            logger.error(f"Failed to add files to session {session_id}: {e}")
+            raise e
 
     def update_session_summary(self, session_id: str, summary: str, user_id: str = None, db_client: Client = None):
         """Update the summary field for a session."""
+        # Written directly, one upsert: a run writes its summary once, so deferring it coalesces nothing,
+        # and a deferred write guarded by the row version would be dropped by any file update in between.
         self._save_session_to_db(session_id, {"summary": summary}, user_id, db_client)
 
-    def get_cached_file(self, file_path: str):
-        """Check if file exists in Gemini (via internal cache logic if needed)."""
-        # For now, we don't cache locally. We rely on Gemini URIs.
-        return None
+    @staticmethod
+    def _resolve_mime_type(file_path: str, mime_type: str = None) -> str:
+        if not mime_type:
+            mime_type, _ = mimetypes.guess_type(file_path)
+        # If still None, default to octet-stream
+        return mime_type or "application/octet-stream"
+
+    def get_cached_file(self, file_path: str, mime_type: str = None, content_hash: str = None) -> Optional[str]:
+        """Returns the Gemini URI of an earlier upload of the same bytes, if it is still live."""
+        if not self.client:
+            return None
+        mime_type = self._resolve_mime_type(file_path, mime_type)
+        content_hash = content_hash or hash_file(file_path)
+
+        entry = self.upload_cache.get(content_hash, mime_type)
+        if not entry:
+            return None
+
+        # Expiry is tracked locally, but the file may also have been deleted remotely.
+        # A metadata lookup is far cheaper than re-sending the bytes.
+        try:
+            remote = self.client.files.get(name=entry["name"])
+            if remote.state and remote.state.name != "ACTIVE":
+                raise ValueError(f"remote file state is {remote.state.name}")
+        except Exception as e:
+            logger.info(f"Cached upload {entry['name']} is no longer usable ({e}), will re-upload.")
+            self.upload_cache.evict(content_hash, mime_type)
+            return None
+
+        logger.info(f"Upload cache hit for {os.path.basename(file_path)} -> {entry['uri']}")
+        return entry["uri"]
 
     def upload_file(self, file: UploadedFile, mime_type: str = None) -> UploadedFile:
         """Uploads file to Gemini and returns the updated file object."""
@@ -166,21 +268,34 @@ class FileManager:
             if not os.path.exists(file.local_path):
                 raise FileNotFoundError(f"File not found: {file.local_path}")
 
-            import mimetypes
-            if not mime_type:
-                mime_type, _ = mimetypes.guess_type(file.local_path)
-            
-            # If still None, default to octet-stream
-            if not mime_type:
-                mime_type = "application/octet-stream"
+            mime_type = self._resolve_mime_type(file.local_path, mime_type)
+            if not file.content_hash:
+                file.content_hash = hash_file(file.local_path)
+
+            cached_uri = self.get_cached_file(file.local_path, mime_type, file.content_hash)
+            if cached_uri:
+                file.uri = cached_uri
+                file.status = "uploaded"
+                return file
 
             logger.info(f"Uploading {file.name} to Gemini... Mime: {mime_type}")
-            gemini_file = self.client.files.upload(
-                file=file.local_path,
-                config={'mime_type': mime_type}
+            # Shares the agents' rate limits, retry policy and circuit breaker
+            gemini_file = model_calls.call_sync(
+                lambda: self.client.files.upload(
+                    file=file.local_path,
+                    config={'mime_type': mime_type}
+                ),
+                label="upload"
             )
             
             logger.info(f"Uploaded to Gemini: {gemini_file.uri}")
+            self.upload_cache.put(
+                file.content_hash,
+                mime_type,
+                uri=gemini_file.uri,
+                name=gemini_file.name,
+                expires_at=gemini_file.expiration_time
+            )
             
             file.uri = gemini_file.uri
             file.status = "uploaded"
@@ -192,18 +307,45 @@ class FileManager:
             file.error_message = str(e)
             return file
 
-    def register_pending_file(self, file_path: str, display_name: str, session_id: str, file_type: str = "reference", user_id: str = None, db_client: Client = None) -> UploadedFile:
-        """Register a file as pending upload in the DB."""
-        # Use display_name as name initially or generate unique?
-        # status="pending"
-        import uuid
+    def build_pending_file(self, file_path: str, display_name: str, file_type: str = "reference", content_hash: str = None) -> UploadedFile:
+        """Builds the file record for a saved upload, already marked uploaded if the same bytes are in Gemini."""
+        content_hash = content_hash or hash_file(file_path)
         file_obj = UploadedFile(
-             name=display_name, # or generate unique?
+             name=display_name,
              uri="",
              type=file_type, # "reference" or "target"
              status="pending",
-             local_path=file_path
+             local_path=file_path,
+             content_hash=content_hash,
+             pending_since=time.time()
         )
+
+        # Audits find the bytes by hash, request bodies never say where they are on this host
+        self.upload_cache.put_local(content_hash, file_path)
+
+        # Cache hit: no background upload needed, callers only queue work for "pending" files.
+        cached_uri = self.get_cached_file(file_path, content_hash=content_hash)
+        if cached_uri:
+            file_obj.uri = cached_uri
+            file_obj.status = "uploaded"
+        return file_obj
+
+    def resolve_local_copies(self, files: List[UploadedFile]) -> List[UploadedFile]:
+        """
+        Copies of the file records with local_path set from this host's saved
+        uploads, looked up by content hash. Client-supplied paths are discarded.
+        """
+        resolved = []
+        for f in files:
+            local_path = self.upload_cache.local_path(f.content_hash) if f.content_hash else None
+            resolved.append(f.model_copy(update={"local_path": local_path}))
+        return resolved
+
+    def register_pending_file(self, file_path: str, display_name: str, session_id: str, file_type: str = "reference", user_id: str = None, db_client: Client = None, content_hash: str = None) -> UploadedFile:
+        """Register a file in the DB, as pending upload unless the same bytes are already in Gemini."""
+        file_obj = self.build_pending_file(file_path, display_name, file_type, content_hash)
+        if file_obj.status == "pending":
+            self.upload_registry.track(session_id, file_path)
         self.add_file_to_session(session_id, file_obj, file_type, user_id, db_client)
         return file_obj
 
@@ -229,47 +371,72 @@ class FileManager:
                 self.update_file_status(session_id, file_obj, file_type, user_id, db_client)
             except:
                 pass
+        finally:
+            # Wake up anyone waiting on this session's uploads
+            self.upload_registry.complete(session_id, file_obj.local_path)
 
     def update_file_status(self, session_id: str, file_obj: UploadedFile, file_type: str, user_id: str = None, db_client: Client = None):
         """Updates a specific file's status in the session list."""
-        details = self.get_session_details(session_id, user_id, db_client)
-        files = details.get(file_type, [])
-        
-        # Find and replace
-        updated_files = []
-        found = False
-        for f in files:
-            # Identify by local_path? name?
-            # Name in UploadedFile is display name initially.
-            if f.local_path == file_obj.local_path: # Best proxy for identity if unique per upload request
-                updated_files.append(file_obj)
-                found = True
-            else:
-                updated_files.append(f)
-        
-        if found:
-            # Update DB
-            db_data = {
-                file_type: [f.model_dump() for f in updated_files]
-            }
-            self._save_session_to_db(session_id, db_data, user_id, db_client)
-
-    async def wait_for_uploads(self, session_id: str, timeout: int = 60):
-        """Wait for all pending uploads in a session to complete."""
-        elapsed = 0
-        interval = 2
-        while elapsed < timeout:
-            details = self.get_session_details(session_id)
-            all_files = details.get("reference", []) + details.get("target", [])
-            
-            pending = [f for f in all_files if f.status == "pending"]
+        client = db_client or self.db
+        if not client:
+            return
+
+        if db_client is None:
+            self.session_cache.flush(session_id)
+        # Identified by local_path, the best proxy for identity as it is unique per upload request
+        try:
+            self.sessions.patch_file(client, session_id, file_type, file_obj.model_dump(), user_id)
+        except Exception as e:
+            logger.error(f"Failed to update {file_obj.name} in session {session_id}: {e}")
+            raise e
+        if db_client is None:
+            self.session_cache.patch_file(session_id, file_type, file_obj, user_id)
+
+    def get_session_file_statuses(self, session_id: str, user_id: str = None, db_client: Client = None) -> List[str]:
+        """
+        Returns just the upload statuses of a session's files (status-only projection, never cached: used for polling).
+        Uploads pending for longer than UPLOAD_PENDING_TIMEOUT were abandoned and are reported as 'failed'.
+        """
+        client = db_client or self.db
+        if not client:
+            return []
+        return self.sessions.get_file_statuses(client, session_id, user_id, stale_after=UPLOAD_PENDING_TIMEOUT)
+
+    async def wait_for_uploads(self, session_id: str, user_id: str = None, timeout: int = 60):
+        """Wait for all pending uploads in the user's session to complete (or be abandoned)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        # Uploads handled by this process signal completion directly.
+        if self.upload_registry.pending_count(session_id):
+            logger.info(f"Waiting for {self.upload_registry.pending_count(session_id)} local uploads in session {session_id}...")
+            if not await self.upload_registry.wait(session_id, timeout):
+                logger.warning(f"Upload wait timeout for session {session_id}")
+                return
+
+        if not self.poll_upload_fallback:
+            logger.info(f"All uploads complete for session {session_id}")
+            return
+
+        # Fallback for uploads running in other workers: poll with exponential backoff.
+        interval = 0.25
+        while True:
+            try:
+                statuses = await asyncio.to_thread(self.get_session_file_statuses, session_id, user_id)
+            except Exception as e:
+                logger.error(f"Failed to poll upload status for session {session_id}: {e}")
+                return
+            pending = [s for s in statuses if s == "pending"]
             if not pending:
                 logger.info(f"All uploads complete for session {session_id}")
                 return
-            
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
             logger.info(f"Waiting for {len(pending)} pending uploads in session {session_id}...")
-            await asyncio.sleep(interval)
-            elapsed += interval
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, 4)
         
         logger.warning(f"Upload wait timeout for session {session_id}")
 
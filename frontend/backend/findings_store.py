@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from typing import List, Optional, Dict
+from backend.models import AuditRule, Finding
+
+logger = logging.getLogger(__name__)
+
+
+def rules_hash(rules: List[AuditRule]) -> str:
+    """Order-independent fingerprint of a rule set."""
+    canonical = sorted(json.dumps(r.model_dump(), sort_keys=True) for r in rules)
+    return hashlib.sha256("\n".join(canonical).encode("utf-8")).hexdigest()
+
+
+class FindingsStore:
+    """
+    Auditor findings persisted per (target content, rule set, model), so a
+    re-run only audits targets that are new or changed. Backed by a local
+    SQLite file.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get(
+            "FINDINGS_STORE_PATH",
+            os.path.join(tempfile.gettempdir(), "universal_audit_findings.db")
+        )
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists findings ("
+                " key text primary key,"
+                " findings text not null,"
+                " created_at real not null)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps this safe to use from the auditor's worker threads.
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def key(target_identity: str, rules_digest: str, model: str) -> str:
+        return hashlib.sha256(f"{target_identity}|{rules_digest}|{model}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[Finding]]:
+        """Returns stored findings for whichever of the keys are known."""
+        if not keys:
+            return {}
+        try:
+            with self._connect() as conn:
+                placeholders = ",".join("?" for _ in keys)
+                rows = conn.execute(f"select key, findings from findings where key in ({placeholders})", keys).fetchall()
+        except Exception as e:
+            logger.warning(f"Findings store read failed, auditing everything: {e}")
+            return {}
+        return {key: [Finding(**f) for f in json.loads(data)] for key, data in rows}
+
+    def put(self, key: str, findings: List[Finding]):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "insert or replace into findings (key, findings, created_at) values (?, ?, ?)",
+                    (key, json.dumps([f.model_dump() for f in findings]), time.time())
+                )
+        except Exception as e:
+            logger.warning(f"Failed to store findings: {e}")
+
+    def get(self, key: str) -> Optional[List[Finding]]:
+        return self.get_many([key]).get(key)
@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from typing import Optional
+import httpx
+from google import genai
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Connection pool sizing for the shared client (applies to both the sync and async transports)
+GEMINI_MAX_CONNECTIONS = int(os.environ.get("GEMINI_MAX_CONNECTIONS", "64"))
+GEMINI_MAX_KEEPALIVE = int(os.environ.get("GEMINI_MAX_KEEPALIVE", "32"))
+GEMINI_KEEPALIVE_EXPIRY = float(os.environ.get("GEMINI_KEEPALIVE_EXPIRY", "60")) # seconds
+# "fake" swaps in the offline FakeGeminiClient (local development, tests, benchmarks)
+GEMINI_CLIENT_MODE = os.environ.get("GEMINI_CLIENT", "live")
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=GEMINI_MAX_CONNECTIONS,
+        max_keepalive_connections=GEMINI_MAX_KEEPALIVE,
+        keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+    )
+
+
+def _connection_counts(http_client) -> Optional[dict]:
+    # httpx doesn't expose pool state publicly; read httpcore's pool when it is there.
+    try:
+        connections = list(http_client._transport._pool.connections)
+    except Exception:
+        return None
+    idle = sum(1 for c in connections if c.is_idle())
+    return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+class ClientRegistry:
+    """
+    One genai.Client per process, created lazily on first use and shared by
+    FileManager and every agent node, so all calls reuse the same keep-alive
+    connection pools instead of paying connection setup + TLS each time.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        self._clients_created = 0
+        self._lookups = 0
+
+    def get(self):
+        """Returns the shared client. Raises ValueError if no API key is configured."""
+        self._lookups += 1
+        if self._client is not None:
+            return self._client
+        with self._lock:
+            if self._client is None:
+                self._client = self._create()
+                self._clients_created += 1
+            return self._client
+
+    def get_optional(self):
+        """Like get(), but returns None instead of raising when no client can be built."""
+        try:
+            return self.get()
+        except Exception as e:
+            logger.debug(f"Gemini client unavailable: {e}")
+            return None
+
+    def _create(self):
+        if GEMINI_CLIENT_MODE == "fake":
+            from backend.fake_gemini import FakeGeminiClient
+            logger.info("Using offline FakeGeminiClient (GEMINI_CLIENT=fake).")
+            return FakeGeminiClient()
+
+        api_key = os.environ.get("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+        return genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                client_args={"limits": _pool_limits()},
+                async_client_args={"limits": _pool_limits()},
+            )
+        )
+
+    def use(self, client):
+        """Swaps in a specific client (e.g. a FakeGeminiClient in tests). None resets to lazy creation."""
+        with self._lock:
+            self._client = client
+
+    def stats(self) -> dict:
+        """Pool configuration and live connection counts, for monitoring."""
+        stats = {
+            "clients_created": self._clients_created,
+            "lookups": self._lookups,
+            "client": type(self._client).__name__ if self._client is not None else None,
+            "pool_limits": {
+                "max_connections": GEMINI_MAX_CONNECTIONS,
+                "max_keepalive_connections": GEMINI_MAX_KEEPALIVE,
+                "keepalive_expiry": GEMINI_KEEPALIVE_EXPIRY,
+            },
+        }
+        api_client = getattr(self._client, "_api_client", None)
+        if api_client is not None:
+            stats["sync_connections"] = _connection_counts(getattr(api_client, "_httpx_client", None))
+            stats["async_connections"] = _connection_counts(getattr(api_client, "_async_httpx_client", None))
+        return stats
+
+
+# Process-wide registry
+gemini_clients = ClientRegistry()
@@ -0,0 +1,363 @@
+"""
+ICD-10-CM code index: the Table of Neoplasms compiled into a compact, memory-mapped
+file of sorted fixed-width code records, for exact, prefix and hierarchy lookups
+without a model call (or even a PDF read) at audit time.
+
+    cd frontend
+    python -m backend.icd10_index build ../temp_uploads/icd10cm_neoplasm_2026.pdf
+    python -m backend.icd10_index lookup C41.2 D16.61 C41.5
+"""
+import os
+import re
+import sys
+import mmap
+import bisect
+import struct
+import logging
+import argparse
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+ICD10_INDEX_PATH = os.environ.get(
+    "ICD10_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "icd10cm_neoplasm_2026.idx")
+)
+
+# Table columns, in order
+COLUMNS = ("Malignant Primary", "Malignant Secondary", "Ca in situ", "Benign", "Uncertain Behavior", "Unspecified Behavior")
+
+# A code as printed in the table: letter, two characters, optional dot and up to four more,
+# and a trailing dash when an additional character (e.g. laterality) is required
+_TABLE_CODE = re.compile(r"^[A-Z][0-9][0-9A-Z](?:\.[0-9A-Z]{0,4})?-?$") # "D05.-" too
+# The same in free text (finding evidence)
+CODE_PATTERN = re.compile(r"\b([A-Z][0-9][0-9A-Z](?:\.[0-9A-Z]{1,4})?)(-?)(?![0-9A-Za-z]|\.[0-9A-Za-z])")
+# What makes a bare three-character token ("Room D12", "ID C34") a code: a keyword just before it,
+# or before a list of codes it ends ("ICD-10: C34, C50")
+_CODE_CONTEXT = re.compile(
+    r"\b(?:ICD(?:-?10(?:-CM)?)?|codes?|dx|diagnos[ie]s)\s*[:#]?\s*"
+    r"(?:[A-Z][0-9][0-9A-Z](?:\.[0-9A-Z]{1,4})?-?\s*(?:,|and|or|/)\s*)*$",
+    re.IGNORECASE
+)
+# The column header repeated at the top of every page
+_HEADER_LINES = {"Neoplasm Malignant", "Primary", "Malignant", "Secondary", "Ca in situ Benign Uncertain", "Behavior", "Unspecified"}
+
+# File layout: header, code records (sorted), postings, term offsets, term text
+_MAGIC = b"ICD10IX1"
+_HEADER = struct.Struct("<8sIIII")      # magic, codes, postings, terms, term text bytes
+_CODE = struct.Struct("<8sBBHI")        # code, flags, column bits, padding, first posting
+_POSTING = struct.Struct("<IB3x")       # term id, column
+_OFFSET = struct.Struct("<I")
+_REQUIRES_MORE = 0x01                   # listed with a dash: the table's code needs another character
+
+
+def normalize(code: str) -> str:
+    """'c412' / 'C41.2-' -> 'C41.2', 'D05.-' -> 'D05'."""
+    code = code.strip().upper().rstrip("-").rstrip(".")
+    if len(code) > 3 and "." not in code:
+        code = f"{code[:3]}.{code[3:]}"
+    return code
+
+
+# --- building ---
+
+def _is_code_or_blank(token: str) -> bool:
+    return token == "-" or bool(_TABLE_CODE.match(token))
+
+
+def _depth_and_text(line: str) -> Tuple[int, str]:
+    depth = 0
+    while line.startswith("- "):
+        depth += 1
+        line = line[2:]
+    return depth, line.strip()
+
+
+def parse_neoplasm_table(pdf_path: str) -> Iterable[Tuple[Tuple[str, ...], List[Optional[str]]]]:
+    """
+    Yields (term path, six codes-or-None) per table row, e.g.
+    (("Neoplasm, neoplastic", "bone", "axis"), ["C41.2-"... ]). Rows wrapped over
+    several lines (or pages) are joined; cross references ("-see ...") are dropped.
+    """
+    lines = []
+    started = False
+    for page in PdfReader(pdf_path).pages:
+        for line in (page.extract_text() or "").splitlines():
+            line = line.strip()
+            if not started:
+                # Skip the introduction on the first page
+                started = line.startswith("Neoplasm, neoplastic")
+            if started and line and line not in _HEADER_LINES:
+                lines.append(line)
+
+    entries, current = [], None
+    for line in lines:
+        tokens = line.split()
+        codes_only = all(_is_code_or_blank(t) for t in tokens)
+        complete = current is not None and _row_codes(current) is not None
+        if current is not None and not complete and codes_only:
+            current += " " + line # the row's codes carried over to the next line
+        elif line.startswith("- ") or line.startswith("Neoplasm, neoplastic") or current is None:
+            if current is not None:
+                entries.append(current)
+            current = line
+        else:
+            current += " " + line # wrapped term text
+    if current is not None:
+        entries.append(current)
+
+    path: List[str] = []
+    for entry in entries:
+        depth, text = _depth_and_text(entry)
+        codes = _row_codes(text)
+        term = text.rsplit(None, 6)[0] if codes else text
+        term = re.split(r"\s+-see\b", term)[0].strip().rstrip(",")
+        path = path[:depth] + [term]
+        yield tuple(path), codes or [None] * len(COLUMNS)
+
+
+def _row_codes(text: str) -> Optional[List[Optional[str]]]:
+    tokens = text.split()
+    if len(tokens) < len(COLUMNS) + 1:
+        return None
+    tail = tokens[-len(COLUMNS):]
+    if not all(_is_code_or_blank(t) for t in tail):
+        return None
+    return [None if t == "-" else t for t in tail]
+
+
+def build_index(pdf_paths: List[str], out_path: str = ICD10_INDEX_PATH) -> dict:
+    """Compiles ICD-10-CM neoplasm tables into the on-disk index. Returns counts."""
+    terms: List[str] = []
+    occurrences: Dict[str, List[Tuple[int, int, bool]]] = {} # code -> [(term id, column, listed with dash)]
+    for pdf_path in pdf_paths:
+        for path, codes in parse_neoplasm_table(pdf_path):
+            term_id = len(terms)
+            terms.append(", ".join(path))
+            for column, code in enumerate(codes):
+                if code:
+                    occurrences.setdefault(normalize(code), []).append((term_id, column, code.endswith("-")))
+
+    codes = sorted(occurrences)
+    term_blob = bytearray()
+    offsets = []
+    for term in terms:
+        offsets.append(len(term_blob))
+        term_blob += term.encode("utf-8")
+    offsets.append(len(term_blob))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        n_postings = sum(len(v) for v in occurrences.values())
+        f.write(_HEADER.pack(_MAGIC, len(codes), n_postings, len(terms), len(term_blob)))
+        first = 0
+        for code in codes:
+            found = occurrences[code]
+            # Needs another character only if the table never lists it as complete
+            flags = _REQUIRES_MORE if all(dashed for _, _, dashed in found) else 0
+            column_bits = 0
+            for _, column, _ in found:
+                column_bits |= 1 << column
+            f.write(_CODE.pack(code.encode("ascii"), flags, column_bits, 0, first))
+            first += len(found)
+        for code in codes:
+            for term_id, column, _ in occurrences[code]:
+                f.write(_POSTING.pack(term_id, column))
+        for offset in offsets:
+            f.write(_OFFSET.pack(offset))
+        f.write(term_blob)
+    os.replace(tmp_path, out_path)
+    return {"codes": len(codes), "terms": len(terms), "bytes": os.path.getsize(out_path)}
+
+
+# --- lookups ---
+
+class CodeEntry(NamedTuple):
+    code: str
+    requires_more: bool          # listed with a dash: a further character (e.g. laterality) is required
+    columns: Tuple[str, ...]     # table columns the code appears in
+    terms: Tuple[str, ...]       # index term paths listing it, e.g. "Neoplasm, neoplastic, bone, axis"
+
+
+class CodeCheck(NamedTuple):
+    code: str
+    status: str # "valid", "incomplete", "invalid" (missing from a covered category), "not_covered"
+    detail: str
+
+
+class _CodeKeys:
+    """The sorted code column of the mapped file, as a sequence bisect can search."""
+
+    def __init__(self, index: "Icd10Index"):
+        self.index = index
+
+    def __len__(self):
+        return self.index.n_codes
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.index.codes_at + i * _CODE.size
+        return self.index.buf[start:start + 8].rstrip(b"\0")
+
+
+class Icd10Index:
+    """Read-only view of a compiled code index. The file is memory-mapped, nothing is parsed up front."""
+
+    def __init__(self, path: str = ICD10_INDEX_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_codes, self.n_postings, self.n_terms, _ = _HEADER.unpack_from(self.buf, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not an ICD-10 code index")
+        self.codes_at = _HEADER.size
+        self.postings_at = self.codes_at + self.n_codes * _CODE.size
+        self.offsets_at = self.postings_at + self.n_postings * _POSTING.size
+        self.text_at = self.offsets_at + (self.n_terms + 1) * _OFFSET.size
+        self._keys = _CodeKeys(self)
+        # Three-character categories present; codes elsewhere are outside the table's scope
+        self.categories = frozenset(self._keys[i][:3].decode("ascii") for i in range(self.n_codes))
+
+    @classmethod
+    def open_default(cls) -> Optional["Icd10Index"]:
+        """The index at ICD10_INDEX_PATH, or None if it hasn't been built."""
+        if not os.path.exists(ICD10_INDEX_PATH):
+            return None
+        try:
+            return cls(ICD10_INDEX_PATH)
+        except Exception as e:
+            logger.warning(f"ICD-10 index at {ICD10_INDEX_PATH} unusable: {e}")
+            return None
+
+    def _find(self, code: str) -> int:
+        key = code.encode("ascii")
+        i = bisect.bisect_left(self._keys, key)
+        return i if i < self.n_codes and self._keys[i] == key else -1
+
+    def _term(self, term_id: int) -> str:
+        start, end = struct.unpack_from("<II", self.buf, self.offsets_at + term_id * _OFFSET.size)
+        return self.buf[self.text_at + start:self.text_at + end].decode("utf-8")
+
+    def _entry(self, i: int) -> CodeEntry:
+        raw, flags, column_bits, _, first = _CODE.unpack_from(self.buf, self.codes_at + i * _CODE.size)
+        last = _CODE.unpack_from(self.buf, self.codes_at + (i + 1) * _CODE.size)[4] if i + 1 < self.n_codes else self.n_postings
+        terms = []
+        for p in range(first, last):
+            term_id, column = _POSTING.unpack_from(self.buf, self.postings_at + p * _POSTING.size)
+            terms.append(f"{self._term(term_id)} ({COLUMNS[column]})")
+        return CodeEntry(
+            code=raw.rstrip(b"\0").decode("ascii"),
+            requires_more=bool(flags & _REQUIRES_MORE),
+            columns=tuple(name for bit, name in enumerate(COLUMNS) if column_bits & (1 << bit)),
+            terms=tuple(terms),
+        )
+
+    def _display(self, code: str) -> str:
+        """The code as the table prints it (with the dash when it needs another character)."""
+        flags = self.buf[self.codes_at + self._find(code) * _CODE.size + 8]
+        return f"{code}-" if flags & _REQUIRES_MORE else code
+
+    def lookup(self, code: str) -> Optional[CodeEntry]:
+        """Exact lookup."""
+        i = self._find(normalize(code))
+        return self._entry(i) if i >= 0 else None
+
+    def prefix(self, prefix: str, limit: int = None) -> List[str]:
+        """Codes starting with `prefix` ("C41" -> C41.0, C41.1, ...), in order."""
+        key = normalize(prefix).encode("ascii") if len(prefix.rstrip("-")) > 3 else prefix.strip().upper().encode("ascii")
+        i = bisect.bisect_left(self._keys, key)
+        found = []
+        while i < self.n_codes and (limit is None or len(found) < limit):
+            code = self._keys[i]
+            if not code.startswith(key):
+                break
+            found.append(code.decode("ascii"))
+            i += 1
+        return found
+
+    def hierarchy(self, code: str) -> dict:
+        """The code's ancestors and descendants that the table lists (C44.509 -> C44.50?, C44.5?, C44)."""
+        code = normalize(code)
+        parents = []
+        candidate = code
+        while len(candidate) > 3:
+            candidate = candidate[:-1].rstrip(".")
+            if self._find(candidate) >= 0:
+                parents.append(candidate)
+        return {"code": code, "parents": parents, "children": [c for c in self.prefix(code) if c != code]}
+
+    def check(self, code: str) -> CodeCheck:
+        """Deterministic verdict on one code against the table."""
+        code = normalize(code)
+        i = self._find(code)
+        if i >= 0:
+            entry = self._entry(i)
+            where = entry.terms[0] + (f" and {len(entry.terms) - 1} more" if len(entry.terms) > 1 else "")
+            if entry.requires_more:
+                return CodeCheck(code, "incomplete", f"{code} requires an additional character (e.g. laterality); listed for {where}")
+            return CodeCheck(code, "valid", f"listed for {where}")
+        # Extending a code the table lists with a dash (by any number of characters) is how it's completed
+        parents = self.hierarchy(code)["parents"]
+        for parent in parents:
+            entry = self._entry(self._find(parent))
+            if entry.requires_more:
+                return CodeCheck(code, "valid", f"extends {parent}- ({entry.terms[0]}); extension not checked")
+        # A category or subcategory of listed codes still needs its remaining characters
+        children = self.prefix(code, limit=6)
+        if children:
+            listed = ", ".join(self._display(c) for c in children)
+            return CodeCheck(code, "incomplete", f"{code} is a category, not a complete code; the table lists {listed}")
+        if code[:3] in self.categories:
+            listed = [self._display(c) for c in self.prefix(code[:3], limit=6)]
+            return CodeCheck(code, "invalid", f"not in the ICD-10-CM neoplasm table; {code[:3]} lists {', '.join(listed)}")
+        return CodeCheck(code, "not_covered", f"category {code[:3]} is outside the neoplasm table")
+
+    def _is_code(self, text: str, match: re.Match) -> bool:
+        """
+        A token shaped like a code is taken as one if it has a decimal part, follows a code
+        keyword, or is a complete code in the table; otherwise it is likely a room, ID or
+        reference number.
+        """
+        if "." in match.group(1) or _CODE_CONTEXT.search(text, max(0, match.start() - 80), match.start()):
+            return True
+        i = self._find(match.group(1))
+        return i >= 0 and not self._entry(i).requires_more
+
+    def check_text(self, text: str) -> List[CodeCheck]:
+        """Checks every code mentioned in the text, once each, in order of appearance."""
+        seen, checks = set(), []
+        text = text or ""
+        for match in CODE_PATTERN.finditer(text):
+            code = normalize(match.group(1))
+            if code not in seen and self._is_code(text, match):
+                seen.add(code)
+                checks.append(self.check(code))
+        return checks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the ICD-10-CM code index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="compile neoplasm table PDFs")
+    build.add_argument("pdfs", nargs="+")
+    build.add_argument("-o", "--output", default=ICD10_INDEX_PATH)
+    lookup = sub.add_parser("lookup", help="check codes against the index")
+    lookup.add_argument("codes", nargs="+")
+    lookup.add_argument("--index", default=ICD10_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        print(build_index(args.pdfs, args.output))
+        return
+    index = Icd10Index(args.index)
+    for code in args.codes:
+        check = index.check(code)
+        print(f"{check.code:<9} {check.status:<12} {check.detail}")
+        h = index.hierarchy(code)
+        if h["parents"] or h["children"]:
+            print(f"{'':<9} parents: {', '.join(h['parents']) or '-'}; children: {', '.join(h['children'][:10]) or '-'}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
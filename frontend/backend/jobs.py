@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from backend.models import AuditJob, ChatRequest
+
+logger = logging.getLogger(__name__)
+
+# Queue location. Every API instance and worker process on the host must point at the same file.
+AUDIT_JOBS_PATH = os.environ.get("AUDIT_JOBS_PATH", os.path.join(tempfile.gettempdir(), "universal_audit_jobs.db"))
+# Workers started inside each API process; 0 = enqueue only, run `python -m backend.worker` separately
+AUDIT_WORKERS = int(os.environ.get("AUDIT_WORKERS", "2"))
+# A running job belongs to its worker while the lease lasts; heartbeats renew it every third of it.
+# A crashed or restarted worker's jobs are picked up again once their lease runs out.
+AUDIT_JOB_LEASE = float(os.environ.get("AUDIT_JOB_LEASE", "60")) # seconds
+AUDIT_JOB_MAX_ATTEMPTS = int(os.environ.get("AUDIT_JOB_MAX_ATTEMPTS", "3"))
+AUDIT_JOB_POLL_INTERVAL = float(os.environ.get("AUDIT_JOB_POLL_INTERVAL", "1.0")) # seconds, idle workers and attached streams
+# Progress events are written in batches at most this far apart (report deltas arrive many per second)
+AUDIT_JOB_EVENT_FLUSH = float(os.environ.get("AUDIT_JOB_EVENT_FLUSH", "0.25")) # seconds
+AUDIT_JOB_RETENTION = float(os.environ.get("AUDIT_JOB_RETENTION", str(7 * 24 * 3600))) # seconds, finished jobs and their events
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+class JobStore:
+    """
+    Durable audit job queue and per-job progress log in a local SQLite file.
+    Jobs go queued -> running (leased to one worker) -> succeeded/failed.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or AUDIT_JOBS_PATH
+        with self._connect() as conn:
+            # WAL lets attached streams read while workers append events
+            conn.execute("pragma journal_mode=wal")
+            conn.execute(
+                "create table if not exists jobs ("
+                " job_id text primary key,"
+                " user_id text not null,"
+                " session_id text not null,"
+                " request text not null,"
+                " status text not null,"
+                " attempts integer not null default 0,"
+                " worker_id text,"
+                " lease_until real,"
+                " result text,"
+                " error text,"
+                " created_at real not null,"
+                " started_at real,"
+                " finished_at real)"
+            )
+            conn.execute("create index if not exists jobs_status_idx on jobs (status, created_at)")
+            conn.execute(
+                "create table if not exists job_events ("
+                " id integer primary key autoincrement,"
+                " job_id text not null,"
+                " event text not null)"
+            )
+            conn.execute("create index if not exists job_events_job_idx on job_events (job_id, id)")
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call, like the findings store: safe from any thread or process.
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _job(row) -> AuditJob:
+        job_id, user_id, session_id, status, attempts, error, created_at, started_at, finished_at = row
+        return AuditJob(job_id=job_id, user_id=user_id, session_id=session_id, status=status, attempts=attempts, error=error,
+                        created_at=_iso(created_at), started_at=_iso(started_at), finished_at=_iso(finished_at))
+
+    _JOB_COLUMNS = "job_id, user_id, session_id, status, attempts, error, created_at, started_at, finished_at"
+
+    def enqueue(self, user_id: str, request: ChatRequest) -> AuditJob:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "insert into jobs (job_id, user_id, session_id, request, status, created_at) values (?, ?, ?, ?, 'queued', ?)",
+                (job_id, user_id, request.session_id, request.model_dump_json(), time.time())
+            )
+        logger.info(f"Queued audit job {job_id} for session {request.session_id}")
+        return self.get(job_id)
+
+    def get(self, job_id: str, user_id: str = None) -> Optional[AuditJob]:
+        """The job, or None if it doesn't exist (or isn't this user's)."""
+        with self._connect() as conn:
+            row = conn.execute(f"select {self._JOB_COLUMNS} from jobs where job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = self._job(row)
+        if user_id and job.user_id != user_id:
+            return None
+        return job
+
+    def result(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("select result from jobs where job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def claim(self, worker_id: str) -> Optional[Tuple[AuditJob, ChatRequest]]:
+        """Leases the oldest runnable job (queued, or running under an expired lease) to the worker."""
+        now = time.time()
+        with self._connect() as conn:
+            # Jobs whose workers keep dying are given up on instead of taking down the next one too
+            conn.execute(
+                "update jobs set status = 'failed', finished_at = ?, worker_id = null,"
+                " error = coalesce(error, 'Worker lost ' || attempts || ' times')"
+                " where status = 'running' and lease_until < ? and attempts >= ?",
+                (now, now, AUDIT_JOB_MAX_ATTEMPTS)
+            )
+        for _ in range(5):
+            with self._connect() as conn:
+                row = conn.execute(
+                    "select job_id from jobs where status = 'queued' or (status = 'running' and lease_until < ?)"
+                    " order by created_at limit 1",
+                    (now,)
+                ).fetchone()
+                if not row:
+                    return None
+                # Another worker may have taken it between the select and here; the guard makes that a no-op
+                claimed = conn.execute(
+                    "update jobs set status = 'running', worker_id = ?, lease_until = ?, attempts = attempts + 1,"
+                    " started_at = coalesce(started_at, ?)"
+                    " where job_id = ? and (status = 'queued' or (status = 'running' and lease_until < ?))",
+                    (worker_id, now + AUDIT_JOB_LEASE, now, row[0], now)
+                ).rowcount
+                if claimed:
+                    request = conn.execute("select request from jobs where job_id = ?", (row[0],)).fetchone()[0]
+            if claimed:
+                return self.get(row[0]), ChatRequest.model_validate_json(request)
+        return None
+
+    def renew(self, job_id: str, worker_id: str) -> bool:
+        """Extends the worker's lease. False means the job is no longer the worker's."""
+        with self._connect() as conn:
+            return conn.execute(
+                "update jobs set lease_until = ? where job_id = ? and worker_id = ? and status = 'running'",
+                (time.time() + AUDIT_JOB_LEASE, job_id, worker_id)
+            ).rowcount == 1
+
+    def finish(self, job_id: str, worker_id: str, result: dict = None, error: str = None) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "update jobs set status = ?, result = ?, error = ?, finished_at = ?, worker_id = null, lease_until = null"
+                " where job_id = ? and worker_id = ? and status = 'running'",
+                ("failed" if error else "succeeded", json.dumps(result) if result is not None else None, error,
+                 time.time(), job_id, worker_id)
+            ).rowcount == 1
+
+    def requeue(self, job_id: str) -> bool:
+        """Puts a finished job back in the queue for another attempt. False if it isn't finished."""
+        with self._connect() as conn:
+            requeued = conn.execute(
+                "update jobs set status = 'queued', attempts = 0, error = null, result = null, finished_at = null"
+                " where job_id = ? and status in ('succeeded', 'failed')",
+                (job_id,)
+            ).rowcount == 1
+            if requeued:
+                # Attached streams see where the earlier attempt's events end
+                conn.execute("insert into job_events (job_id, event) values (?, ?)", (job_id, json.dumps({'step': 'job', 'status': 'resumed'})))
+        return requeued
+
+    def release(self, job_id: str, worker_id: str):
+        """Hands a job back to the queue without counting the attempt (graceful shutdown)."""
+        with self._connect() as conn:
+            conn.execute(
+                "update jobs set status = 'queued', worker_id = null, lease_until = null, attempts = max(0, attempts - 1)"
+                " where job_id = ? and worker_id = ? and status = 'running'",
+                (job_id, worker_id)
+            )
+
+    def append_events(self, job_id: str, events: List[dict]):
+        if not events:
+            return
+        with self._connect() as conn:
+            conn.executemany("insert into job_events (job_id, event) values (?, ?)",
+                             [(job_id, json.dumps(e)) for e in events])
+
+    def events(self, job_id: str, after: int = 0, limit: int = 500) -> List[Tuple[int, dict]]:
+        """Progress events with id > after, oldest first. Ids only ever grow, so they work as resume cursors."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "select id, event from job_events where job_id = ? and id > ? order by id limit ?",
+                (job_id, after, limit)
+            ).fetchall()
+        return [(event_id, json.loads(event)) for event_id, event in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            return dict(conn.execute("select status, count(*) from jobs group by status").fetchall())
+
+    def purge(self, older_than: float = AUDIT_JOB_RETENTION) -> int:
+        """Deletes finished jobs (and their events) older than `older_than` seconds."""
+        cutoff = time.time() - older_than
+        with self._connect() as conn:
+            expired = [r[0] for r in conn.execute(
+                "select job_id from jobs where status in ('succeeded', 'failed') and finished_at < ?", (cutoff,)
+            ).fetchall()]
+            for i in range(0, len(expired), 500):
+                chunk = expired[i:i + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                conn.execute(f"delete from job_events where job_id in ({placeholders})", chunk)
+                conn.execute(f"delete from jobs where job_id in ({placeholders})", chunk)
+        return len(expired)
+
+
+class AuditWorkerPool:
+    """
+    Runs queued audit jobs on this process's event loop, `workers` at a time.
+    runner(request, user_id) yields the job's progress events (see audit_pipeline.run_audit).
+    """
+
+    def __init__(self, store: JobStore, runner: Callable[[ChatRequest, str], AsyncIterator[dict]], workers: int = AUDIT_WORKERS):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._progress: Dict[str, asyncio.Event] = {} # job_id -> set when new events are stored
+        self._running: Dict[str, str] = {} # job_id -> worker_id
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(f"{self.worker_prefix}:{n}")) for n in range(self.workers)]
+        logger.info(f"Started {self.workers} audit workers ({self.worker_prefix})")
+
+    async def stop(self):
+        """Stops the workers. Jobs they were running go back to the queue for the next worker."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self):
+        """Wakes an idle worker now instead of at its next poll (call after enqueueing)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_for_progress(self, job_id: str, timeout: float = AUDIT_JOB_POLL_INTERVAL):
+        """Waits until the job has new events or `timeout` passes (jobs running elsewhere are polled)."""
+        event = self._progress.get(job_id)
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _signal(self, job_id: str):
+        event = self._progress.get(job_id)
+        if event is not None:
+            event.set()
+            self._progress[job_id] = asyncio.Event()
+
+    def stats(self) -> dict:
+        return {"workers": len(self._tasks), "running": len(self._running), "jobs": self.store.counts()}
+
+    async def _work(self, worker_id: str):
+        while True:
+            try:
+                if time.time() - self._last_purge > 3600:
+                    self._last_purge = time.time()
+                    purged = await asyncio.to_thread(self.store.purge)
+                    if purged:
+                        logger.info(f"Purged {purged} finished audit jobs")
+                claimed = await asyncio.to_thread(self.store.claim, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Audit worker {worker_id} could not claim a job: {e}")
+                claimed = None
+
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), AUDIT_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job, request = claimed
+            await self._run(worker_id, job, request)
+
+    async def _run(self, worker_id: str, job: AuditJob, request: ChatRequest):
+        logger.info(f"Worker {worker_id} running audit job {job.job_id} (attempt {job.attempts})")
+        self._running[job.job_id] = worker_id
+        self._progress[job.job_id] = asyncio.Event()
+        run = asyncio.create_task(self._execute(job, request))
+        heartbeat = asyncio.create_task(self._heartbeat(job.job_id, worker_id, run))
+        try:
+            result = await run
+            if not await asyncio.to_thread(self.store.finish, job.job_id, worker_id, result):
+                logger.warning(f"Audit job {job.job_id} finished after its lease was lost; result not recorded")
+            else:
+                logger.info(f"Audit job {job.job_id} succeeded")
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled():
+                # The heartbeat gave up the run: the lease is someone else's now
+                logger.warning(f"Lost the lease on audit job {job.job_id}, stopped running it")
+            else:
+                # Shutting down: hand the job to the next worker
+                run.cancel()
+                await asyncio.to_thread(self.store.release, job.job_id, worker_id)
+                raise
+        except Exception as e:
+            logger.error(f"Audit job {job.job_id} failed: {e}")
+            await asyncio.to_thread(self.store.finish, job.job_id, worker_id, None, str(e) or type(e).__name__)
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.job_id, None)
+            self._signal(job.job_id)
+            self._progress.pop(job.job_id, None)
+
+    async def _heartbeat(self, job_id: str, worker_id: str, run: asyncio.Task):
+        while True:
+            await asyncio.sleep(AUDIT_JOB_LEASE / 3)
+            try:
+                owned = await asyncio.to_thread(self.store.renew, job_id, worker_id)
+            except Exception as e:
+                logger.error(f"Lease renewal failed for audit job {job_id}: {e}")
+                continue
+            if not owned:
+                # Someone else has it now (we stalled past the lease); two runs must not race
+                run.cancel()
+                return
+
+    async def _execute(self, job: AuditJob, request: ChatRequest) -> dict:
+        """Runs the audit, storing its events as it goes. Returns the job's result."""
+        buffer: List[dict] = []
+        last_flush = time.monotonic()
+        result = {"final_response": None, "metrics": {}}
+
+        async def flush():
+            nonlocal buffer, last_flush
+            batch, buffer = buffer, []
+            last_flush = time.monotonic()
+            await asyncio.to_thread(self.store.append_events, job.job_id, batch)
+            self._signal(job.job_id)
+
+        if job.attempts > 1:
+            buffer.append({'step': 'job', 'status': 'retrying', 'attempt': job.attempts})
+        # Every attempt of a job is the same run, so retries resume from its checkpoints
+        request = request.model_copy(update={"run_id": request.run_id or job.job_id})
+        try:
+            async for event in self.runner(request, job.user_id):
+                buffer.append(event)
+                if event.get('status') == 'completed' and event.get('metrics') is not None:
+                    result["metrics"][event['step']] = event['metrics']
+                if event.get('step') == 'final':
+                    result["final_response"] = event['content']
+                # Step changes go out at once, report deltas in batches
+                if event.get('step') != 'final_delta' or time.monotonic() - last_flush >= AUDIT_JOB_EVENT_FLUSH:
+                    await flush()
+        except asyncio.CancelledError:
+            await asyncio.shield(flush())
+            raise
+        except Exception as e:
+            buffer.append({'error': str(e)})
+            await flush()
+            raise
+        await flush()
+        return result
@@ -1,5 +1,4 @@
 import os
-import shutil
 import logging
 import asyncio
 from dotenv import load_dotenv
@@ -7,12 +6,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, BackgroundTasks, Depends, Header
+from typing import Optional
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from backend.file_manager import FileManager
-from backend.agents import app_graph
-from backend.models import ChatRequest
+from backend.session_store import HISTORY_PAGE_SIZE
+from backend.gemini_client import gemini_clients
+from backend.model_calls import model_calls
+from backend.metrics import metrics
+from backend.agents import rule_cache, reference_index, evidence_verifier
+from backend.audit_pipeline import run_audit
+from backend.jobs import JobStore, AuditWorkerPool, TERMINAL_STATUSES
+from backend.models import ChatRequest, UploadedFile, AuditJob
+from backend.uploads import receive_upload, safe_filename, RegistrationBatcher
 import tempfile
 import firebase_admin
 from firebase_admin import credentials, auth
@@ -29,6 +36,10 @@ app = FastAPI(
     root_path="/api"
 )
 file_manager = FileManager()
+registration_batcher = RegistrationBatcher(file_manager)
+rule_cache.attach_db(file_manager.db)
+job_store = JobStore()
+audit_workers = AuditWorkerPool(job_store, lambda request, user_id: run_audit(request, user_id, file_manager))
 
 # CORS config (Allowing Next.js frontend)
 app.add_middleware(
@@ -75,75 +86,95 @@ TEMP_DIR = tempfile.gettempdir()
 
 
 
-# Update upload_reference
-@app.post("/upload/reference")
-def upload_reference(
+async def _finish_upload(file_obj: UploadedFile, session_id: str, file_type: str, user_id: str):
+    """Registers the file in the session (batched with other uploads) and pushes it to Gemini if needed."""
+    try:
+        await registration_batcher.register(session_id, file_obj, file_type, user_id)
+    except Exception:
+        # The upload never starts, so release anyone waiting on it.
+        file_manager.upload_registry.complete(session_id, file_obj.local_path)
+        raise
+    work = []
+    if file_obj.status == "pending":
+        work.append(asyncio.to_thread(file_manager.perform_background_upload, file_obj, session_id, file_type, user_id=user_id))
+    # Page text, extracted while the Gemini upload runs: retrieval for references, evidence checks for targets
+    work.append(_index_pages(file_obj))
+    await asyncio.gather(*work)
+
+
+async def _index_pages(file_obj: UploadedFile):
+    try:
+        await asyncio.to_thread(reference_index.ingest, file_obj)
+        if file_obj.type == "target":
+            # The shingle index takes a second or so for a thousand pages, better spent now than in the verifier
+            await asyncio.to_thread(evidence_verifier.prepare, file_obj)
+    except Exception as e:
+        # Without an index a reference is simply sent whole, and a target's evidence goes unchecked
+        logger.error(f"Indexing {file_obj.name} failed: {e}")
+
+
+async def _handle_upload(request: Request, background_tasks: BackgroundTasks, file_type: str, user_id: str):
+    # Streamed straight from the request body to disk: the size limit applies as the bytes arrive.
+    upload = await receive_upload(request, TEMP_DIR)
+    session_id = upload.fields.get("session_id")
+    if not session_id:
+        os.remove(upload.path)
+        raise HTTPException(status_code=422, detail="Missing form field 'session_id'")
+
+    # Save to temp location so it survives until the background task runs. We must NOT delete it here.
+    # Both parts of the name come from the client: reduced to a single path component, never a path.
+    filename = safe_filename(upload.filename)
+    save_path = os.path.join(TEMP_DIR, safe_filename(f"{session_id}_{filename}"))
+    os.replace(upload.path, save_path)
+    logger.info(f"Saved {filename} ({upload.size} bytes) for session {session_id}")
+
+    # Cache lookup may hit the network, keep it off the event loop.
+    file_obj = await asyncio.to_thread(
+        file_manager.build_pending_file,
+        save_path,
+        filename,
+        file_type,
+        upload.content_hash
+    )
+
+    if file_obj.status == "pending":
+        # Tracked from now on so a chat arriving before the upload finishes can wait for it
+        file_manager.upload_registry.track(session_id, save_path)
+
+    if os.environ.get("VERCEL"):
+        # Vercel kills bg tasks, so run inline
+        await _finish_upload(file_obj, session_id, file_type, user_id)
+    else:
+        background_tasks.add_task(_finish_upload, file_obj, session_id, file_type, user_id)
+
+    return {"name": file_obj.name, "uri": file_obj.uri, "type": file_obj.type, "status": file_obj.status, "content_hash": file_obj.content_hash}
+
+
+# Multipart bodies (fields "file" and "session_id") are parsed by receive_upload rather than
+# UploadFile/Form, which would have Starlette spool the whole body before the handler runs.
+@app.post("/upload/reference", status_code=202)
+async def upload_reference(
+    request: Request,
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...), 
-    session_id: str = Form(...),
     user_id: str = Depends(get_current_user_id)
 ):
     try:
-        # Save to permanent temp location (files/ directory or similar) to ensure it survives until bg task runs
-        # We can use the existing temp pattern but we must NOT delete it here.
-        safe_name = f"{session_id}_{file.filename}"
-        save_path = os.path.join(TEMP_DIR, safe_name)
-        
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Register Intent - pass client
-        file_obj = file_manager.register_pending_file(
-            file_path=save_path, 
-            display_name=file.filename, 
-            session_id=session_id, 
-            file_type="reference",
-            user_id=user_id
-        )
-        
-        # If pending, queue background task
-        # If pending, queue background task OR run sync if on Vercel
-        if file_obj.status == "pending":
-            if os.environ.get("VERCEL"):
-                # Vercel kills bg tasks, so run sync
-                file_manager.perform_background_upload(file_obj, session_id, "reference", user_id=user_id)
-            else:
-                background_tasks.add_task(file_manager.perform_background_upload, file_obj, session_id, "reference", user_id=user_id)
-            
-        return {"name": file_obj.name, "uri": file_obj.uri, "type": file_obj.type, "status": file_obj.status}
-        
+        return await _handle_upload(request, background_tasks, "reference", user_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/upload/target")
-def upload_target(
+@app.post("/upload/target", status_code=202)
+async def upload_target(
+    request: Request,
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...), 
-    session_id: str = Form(...),
     user_id: str = Depends(get_current_user_id)
 ):
     try:
-        safe_name = f"{session_id}_{file.filename}"
-        save_path = os.path.join(TEMP_DIR, safe_name)
-        
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        file_obj = file_manager.register_pending_file(
-            file_path=save_path, 
-            display_name=file.filename, 
-            session_id=session_id, 
-            file_type="target",
-            user_id=user_id
-        )
-        
-        if file_obj.status == "pending":
-            if os.environ.get("VERCEL"):
-                file_manager.perform_background_upload(file_obj, session_id, "target", user_id=user_id)
-            else:
-                background_tasks.add_task(file_manager.perform_background_upload, file_obj, session_id, "target", user_id=user_id)
-            
-        return {"name": file_obj.name, "uri": file_obj.uri, "type": file_obj.type, "status": file_obj.status}
+        return await _handle_upload(request, background_tasks, "target", user_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -165,16 +196,34 @@ def delete_file(name: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/sessions")
+def list_sessions(limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None, user_id: str = Depends(get_current_user_id)):
+    """Lists the user's sessions, most recently updated first. Pass `next_cursor` back as `cursor` for the next page."""
+    try:
+        return file_manager.list_sessions(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to list sessions for user {user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to list sessions")
+
 @app.get("/session/{session_id}")
-def get_session_info(session_id: str, user_id: str = Depends(get_current_user_id)):
-    """Get session details including files and summary."""
+def get_session_info(session_id: str, history_page: int = Query(1, ge=1), history_page_size: int = Query(HISTORY_PAGE_SIZE, ge=1, le=500), user_id: str = Depends(get_current_user_id)):
+    """
+    Get session details including files and summary, plus one page of the chat history
+    (page 1 = most recent messages; see history_total for how many there are).
+    """
     logger.info(f"Fetching session: {session_id} for user {user_id}")
     details = file_manager.get_session_details(session_id, user_id)
+    history = file_manager.get_session_history(session_id, user_id, history_page, history_page_size)
     result = {
         "reference": [f.model_dump() if hasattr(f, 'model_dump') else f for f in details.get("reference", [])],
         "target": [f.model_dump() if hasattr(f, 'model_dump') else f for f in details.get("target", [])],
         "summary": details.get("summary"),
-        "history": details.get("history", [])
+        "history": history.items,
+        "history_page": history.page,
+        "history_page_size": history.page_size,
+        "history_total": history.total
     }
     logger.info(f"Session {session_id}: {len(result['reference'])} refs, {len(result['target'])} targets, summary={'yes' if result['summary'] else 'no'}")
     return result
@@ -186,8 +235,17 @@ def debug_status():
         "supabase_initialized": file_manager.db is not None,
         "google_api_key_set": bool(os.environ.get("GOOGLE_API_KEY")),
         "supabase_keys_set": bool(os.environ.get("SUPABASE_URL") and os.environ.get("SUPABASE_KEY")),
+        "gemini_client": gemini_clients.stats(),
+        "model_calls": model_calls.stats(),
+        "session_cache": file_manager.session_cache.stats(),
+        "audit_jobs": audit_workers.stats(),
     }
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Node/Gemini call latency, token, retry and cache histograms in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 import time
 
 @app.get("/debug/write_test")
@@ -205,8 +263,9 @@ def debug_write_test():
         # Use file_manager helper which handles Supabase syntax
         file_manager._save_session_to_db(session_id, data)
         
-        # Read back to verify
-        read_back = file_manager.get_session_details(session_id)
+        # Read back to verify (from the DB, not the session cache)
+        read_back = file_manager.get_session_details(session_id, max_age=0)
+        read_back["history"] = file_manager.get_session_history(session_id).items
         
         return {
             "status": "success", 
@@ -224,85 +283,10 @@ async def chat_stream(request: ChatRequest, user_id: str = Depends(get_current_u
     """
     Streams the agents' thought process and final response.
     """
-    # Hydrate Session from Request Data (Crucial for Serverless Persistence)
-    # This ensures that files already known by the UI are registered in the backend session
-    from backend.models import UploadedFile
-    
-    for f in request.reference_files:
-        # Check if f is already an UploadedFile object or a dict from JSON
-        # Fastapi handles Pydantic model conversion automatically for nested models in ChatRequest.
-        # So 'f' here is ALREADY an UploadedFile instance from models.py!
-        # We just need to ensure we pass it correctly. 
-        # The 'status' field might default to 'uploaded' if not sent by frontend, which is fine.
-        file_manager.add_file_to_session(
-            request.session_id, 
-            f, 
-            "reference",
-            user_id=user_id
-        )
-    for f in request.target_files:
-        file_manager.add_file_to_session(
-            request.session_id, 
-            f, 
-            "target",
-            user_id=user_id
-        )
-
     async def event_generator():
         try:
-            # Wait for any background uploads to finish before starting agent
-            yield f"data: {json.dumps({'step': 'init', 'status': 'Verifying uploads...'})}\n\n"
-            await file_manager.wait_for_uploads(request.session_id)
-            
-            # CRITICAL FIX: Use the files from the request body directly!
-            # The previous logic re-queried Firestore, which returns empty lists if Firestore is not initialized.
-            # The request body is the source of truth for serverless deployments.
-            # Only fall back to Firestore if the request body has no files (backward compatibility).
-            
-            session_refs = request.reference_files if request.reference_files else file_manager.get_session_files(request.session_id, "reference", user_id=user_id)
-            session_targets = request.target_files if request.target_files else file_manager.get_session_files(request.session_id, "target", user_id=user_id)
-            
-            # Log for debugging
-            logger.info(f"Agent State - Reference Files: {len(session_refs)}, Target Files: {len(session_targets)}")
-            for f in session_refs:
-                logger.info(f"  REF: {f.name} -> {f.uri}")
-            for f in session_targets:
-                logger.info(f"  TGT: {f.name} -> {f.uri}")
-            
-            initial_state = {
-                "user_query": request.message,
-                "scenario": request.scenario,
-                "chat_history": request.history,
-                "reference_files": session_refs, # Use request body files directly
-                "target_files": session_targets, # Use request body files directly
-                "messages": []
-            }
-            
-            # Yield initial handshake
-            yield f"data: {json.dumps({'step': 'init', 'status': 'started'})}\n\n"
-            
-            # Stream events from LangGraph
-            async for event in app_graph.astream_events(initial_state, version="v1"):
-                kind = event["event"]
-                name = event["name"]
-
-                # Log when a node STARTS
-                if kind == "on_chain_start" and name in ["strategist", "auditor", "verifier"]:
-                     yield f"data: {json.dumps({'step': name, 'status': 'running'})}\n\n"
-
-                # Log when a node COMPLETES
-                if kind == "on_chain_end" and name in ["strategist", "auditor", "verifier"]:
-                    yield f"data: {json.dumps({'step': name, 'status': 'completed'})}\n\n"
-                    
-                    # Capture Final Response from Verifier directly
-                    if name == "verifier":
-                        output = event['data'].get('output')
-                        # Verifier returns a dict with 'final_response' key
-                        if output and 'final_response' in output:
-                            yield f"data: {json.dumps({'step': 'final', 'content': output['final_response']})}\n\n"
-                            
-                            # Save final response to session summary for Profile Page
-                            file_manager.update_session_summary(request.session_id, output['final_response'], user_id=user_id)
+            async for event in run_audit(request, user_id, file_manager):
+                yield f"data: {json.dumps(event)}\n\n"
 
             yield "data: [DONE]\n\n"
             yield "data: [DONE]\n\n"
@@ -315,6 +299,99 @@ async def chat_stream(request: ChatRequest, user_id: str = Depends(get_current_u
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+
+# --- Background audit jobs ---
+# The audit runs on a worker, not inside the request, so it survives client
+# disconnects, serverless time limits and API restarts.
+
+@app.on_event("startup")
+async def start_audit_workers():
+    if os.environ.get("VERCEL"):
+        # Invocations are frozen between requests; jobs need a long-running `python -m backend.worker`
+        logger.warning("Running on Vercel, audit jobs are only queued here.")
+        return
+    audit_workers.start()
+
+
+@app.on_event("shutdown")
+async def stop_audit_workers():
+    await audit_workers.stop()
+
+
+@app.post("/audits", status_code=202)
+async def create_audit(request: ChatRequest, user_id: str = Depends(get_current_user_id)):
+    """Queues an audit and returns its job; follow it via /audits/{job_id}/events."""
+    job = await asyncio.to_thread(job_store.enqueue, user_id, request)
+    audit_workers.notify()
+    return job
+
+
+async def _get_job(job_id: str, user_id: str) -> AuditJob:
+    job = await asyncio.to_thread(job_store.get, job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Audit job not found")
+    return job
+
+
+@app.get("/audits/{job_id}")
+async def get_audit(job_id: str, user_id: str = Depends(get_current_user_id)):
+    return await _get_job(job_id, user_id)
+
+
+@app.get("/audits/{job_id}/result")
+async def get_audit_result(job_id: str, user_id: str = Depends(get_current_user_id)):
+    """The final report and per-step metrics, once the job has finished."""
+    job = await _get_job(job_id, user_id)
+    if job.status not in TERMINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Audit job is {job.status}")
+    result = await asyncio.to_thread(job_store.result, job_id)
+    return {"job_id": job_id, "status": job.status, "error": job.error, **(result or {"final_response": None, "metrics": {}})}
+
+
+@app.post("/audits/{job_id}/resume", status_code=202)
+async def resume_audit(job_id: str, user_id: str = Depends(get_current_user_id)):
+    """
+    Runs a finished (typically failed) job again. Completed steps are restored
+    from the run's checkpoints, so only the failed node, or the auditor's
+    unfinished files, are redone.
+    """
+    job = await _get_job(job_id, user_id)
+    if not await asyncio.to_thread(job_store.requeue, job_id):
+        raise HTTPException(status_code=409, detail=f"Audit job is {job.status}")
+    audit_workers.notify()
+    return await _get_job(job_id, user_id)
+
+
+@app.get("/audits/{job_id}/events")
+async def stream_audit_events(job_id: str, after: int = Query(0, ge=0), last_event_id: Optional[str] = Header(None), user_id: str = Depends(get_current_user_id)):
+    """
+    Streams a job's progress (the same events as /chat/stream), from the start or
+    after a given event id. Reconnecting clients resume via Last-Event-ID.
+    """
+    await _get_job(job_id, user_id)
+    cursor = max(after, int(last_event_id)) if last_event_id and last_event_id.isdigit() else after
+
+    async def event_generator():
+        nonlocal cursor
+        while True:
+            # Status before events: a finished job has stored all of its events, so nothing is missed
+            job = await asyncio.to_thread(job_store.get, job_id)
+            events = await asyncio.to_thread(job_store.events, job_id, cursor)
+            for event_id, event in events:
+                cursor = event_id
+                yield f"id: {event_id}\ndata: {json.dumps(event)}\n\n"
+            if events:
+                continue
+            if job is None or job.status in TERMINAL_STATUSES:
+                break
+            await audit_workers.wait_for_progress(job_id)
+
+        if job is not None:
+            yield f"data: {json.dumps({'step': 'job', 'status': job.status, 'error': job.error})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,183 @@
+import time
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Sequence, Tuple
+
+# Latency buckets (seconds) sized for model calls: sub-second cache hits up to multi-minute audits
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """Process-local metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics) + "\n"
+
+
+metrics = MetricsRegistry()
+
+NODE_DURATION = metrics.histogram("audit_node_duration_seconds", "Wall time of each agent node.", ["node"])
+REQUEST_DURATION = metrics.histogram("audit_request_duration_seconds", "Wall time of a whole /chat/stream audit.")
+CALL_DURATION = metrics.histogram("gemini_call_duration_seconds", "Wall time of each Gemini call, retries included.", ["call", "outcome"])
+CALL_TOKENS = metrics.histogram("gemini_call_tokens", "Tokens per Gemini call, from usage_metadata.", ["call", "kind"], TOKEN_BUCKETS)
+CALL_RETRIES = metrics.counter("gemini_call_retries_total", "Retried Gemini call attempts.", ["call"])
+CACHE_LOOKUPS = metrics.counter("audit_cache_lookups_total", "Cache lookups by cache and result.", ["cache", "result"])
+
+
+class NodeStats:
+    """What one node run spent: model calls, retries, tokens and cache hits."""
+
+    def __init__(self, node: str):
+        self.node = node
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.calls = 0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.cache_hits: Dict[str, int] = {}
+        self.cache_misses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def summary(self) -> dict:
+        return {
+            "duration_ms": round(self.duration * 1000),
+            "calls": self.calls,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hits": dict(self.cache_hits),
+            "cache_misses": dict(self.cache_misses),
+        }
+
+
+# The node currently running in this task (copied into gather()/to_thread() children)
+_current_node: contextvars.ContextVar[Optional[NodeStats]] = contextvars.ContextVar("current_node", default=None)
+
+
+@asynccontextmanager
+async def track_node(node: str):
+    """Times a node run and collects the calls made inside it into a NodeStats."""
+    stats = NodeStats(node)
+    token = _current_node.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_node.reset(token)
+        stats.duration = time.perf_counter() - stats.started
+        NODE_DURATION.observe(stats.duration, node=node)
+
+
+def record_call(call: str, duration: float, attempts: int, usage=None, outcome: str = "ok"):
+    """Records one Gemini call (all its attempts) globally and on the current node."""
+    prompt = getattr(usage, "prompt_token_count", None) or 0
+    output = getattr(usage, "candidates_token_count", None) or 0
+    cached = getattr(usage, "cached_content_token_count", None) or 0
+    retries = max(0, attempts - 1)
+
+    CALL_DURATION.observe(duration, call=call, outcome=outcome)
+    if retries:
+        CALL_RETRIES.inc(retries, call=call)
+    if usage:
+        CALL_TOKENS.observe(prompt, call=call, kind="input")
+        CALL_TOKENS.observe(output, call=call, kind="output")
+        CALL_TOKENS.observe(cached, call=call, kind="cached")
+
+    stats = _current_node.get()
+    if stats:
+        with stats._lock:
+            stats.calls += 1
+            stats.retries += retries
+            stats.input_tokens += prompt
+            stats.output_tokens += output
+            stats.cached_tokens += cached
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    """Counts cache lookups (context cache, rule cache, findings store...)."""
+    if count <= 0:
+        return
+    CACHE_LOOKUPS.inc(count, cache=cache, result="hit" if hit else "miss")
+    stats = _current_node.get()
+    if stats:
+        with stats._lock:
+            bucket = stats.cache_hits if hit else stats.cache_misses
+            bucket[cache] = bucket.get(cache, 0) + count
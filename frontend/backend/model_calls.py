@@ -0,0 +1,262 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+import httpx
+from google.genai import errors
+from backend.metrics import record_call
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Client-side budget, roughly the project's Gemini quota. 0 disables a limit.
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", "4000"))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", "4000000"))
+# Retry on 429/5xx/connection errors with full-jitter exponential backoff
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "4"))
+GEMINI_RETRY_BASE = float(os.environ.get("GEMINI_RETRY_BASE", "1.0")) # seconds
+GEMINI_RETRY_CAP = float(os.environ.get("GEMINI_RETRY_CAP", "30")) # seconds
+# Circuit breaker: open after this many consecutive retryable failures, probe again after the cooldown
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "8"))
+GEMINI_BREAKER_COOLDOWN = float(os.environ.get("GEMINI_BREAKER_COOLDOWN", "30")) # seconds
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Quota (429), server-side (5xx) and transport errors are worth another try; other 4xx are not."""
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError))
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` units per minute up to that many. Usable from threads and coroutines."""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount: float) -> float:
+        """Takes `amount` now (the level may go negative) and returns how long to wait before using it."""
+        if self.capacity <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            # A single request larger than the whole bucket just waits for a full bucket
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, delta: float):
+        """Corrects an earlier reservation once the real cost is known (positive = used more)."""
+        if self.capacity <= 0 or not delta:
+            return
+        with self._lock:
+            self.level = min(self.capacity, self.level - delta)
+
+    async def acquire(self, amount: float = 1):
+        wait = self._reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, amount: float = 1):
+        wait = self._reserve(amount)
+        if wait:
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stops sending requests after repeated failures, then lets one probe through per cooldown."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpenError("Gemini circuit breaker is open after repeated failures; try again shortly.")
+            # Half-open: let this call probe, and hold the others back for another cooldown
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold > 0 and self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error(f"Gemini circuit breaker opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+
+class ModelCallLayer:
+    """
+    Every Gemini request goes through here: requests/min and tokens/min buckets,
+    jittered exponential retry on 429/5xx, and a shared circuit breaker.
+    """
+
+    def __init__(self, rpm: int = GEMINI_RPM, tpm: int = GEMINI_TPM, max_retries: int = GEMINI_MAX_RETRIES,
+                 breaker_threshold: int = GEMINI_BREAKER_THRESHOLD, breaker_cooldown: float = GEMINI_BREAKER_COOLDOWN):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        hinted = _retry_after(error)
+        if hinted is not None:
+            return min(hinted, GEMINI_RETRY_CAP)
+        return random.uniform(0, min(GEMINI_RETRY_CAP, GEMINI_RETRY_BASE * (2 ** attempt)))
+
+    def _settle(self, result, estimated_tokens: int):
+        # Replace the estimate with the real token count when the response reports it
+        usage = getattr(result, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage else None
+        if actual:
+            self.tokens.adjust(actual - estimated_tokens)
+
+    def _on_error(self, error: Exception, attempt: int, label: str) -> float:
+        """Records the failure and returns the delay before retrying; re-raises once retrying is pointless."""
+        if not is_retryable(error):
+            raise error
+        self.breaker.record_failure()
+        if attempt >= self.max_retries:
+            raise error
+        delay = self._backoff(attempt, error)
+        logger.warning(f"{label}: retryable error ({error!r}), attempt {attempt + 1}/{self.max_retries}, retrying in {delay:.1f}s")
+        return delay
+
+    async def call(self, fn: Callable[[], Awaitable[T]], estimated_tokens: int = 0, label: str = "gemini") -> T:
+        """Runs an async API call under the rate limits, retrying transient failures."""
+        attempt, result, outcome = 0, None, "error"
+        started = time.perf_counter()
+        try:
+            while True:
+                self.breaker.before_call()
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimated_tokens)
+                try:
+                    result = await fn()
+                except Exception as e:
+                    delay = self._on_error(e, attempt, label)
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                self._settle(result, estimated_tokens)
+                outcome = "ok"
+                return result
+        finally:
+            record_call(label, time.perf_counter() - started, attempt + 1, getattr(result, "usage_metadata", None), outcome)
+
+    def call_sync(self, fn: Callable[[], T], estimated_tokens: int = 0, label: str = "gemini") -> T:
+        """Blocking variant of call(), for code running in worker threads."""
+        attempt, result, outcome = 0, None, "error"
+        started = time.perf_counter()
+        try:
+            while True:
+                self.breaker.before_call()
+                self.requests.acquire_sync(1)
+                self.tokens.acquire_sync(estimated_tokens)
+                try:
+                    result = fn()
+                except Exception as e:
+                    delay = self._on_error(e, attempt, label)
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                self._settle(result, estimated_tokens)
+                outcome = "ok"
+                return result
+        finally:
+            record_call(label, time.perf_counter() - started, attempt + 1, getattr(result, "usage_metadata", None), outcome)
+
+    async def stream(self, open_fn: Callable[[], Awaitable], estimated_tokens: int = 0, label: str = "gemini"):
+        """
+        Async generator over a streaming call. Failures before the first chunk are retried
+        like call(); once chunks have been yielded an error is raised as is.
+        """
+        attempt, usage, outcome = 0, None, "error"
+        began = time.perf_counter()
+        try:
+            while True:
+                self.breaker.before_call()
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimated_tokens)
+                started = False
+                try:
+                    stream = await open_fn()
+                    async for chunk in stream:
+                        started = True
+                        # The last chunk carries the totals
+                        usage = getattr(chunk, "usage_metadata", None) or usage
+                        yield chunk
+                except Exception as e:
+                    if started:
+                        raise
+                    delay = self._on_error(e, attempt, label)
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                if usage and getattr(usage, "total_token_count", None):
+                    self.tokens.adjust(usage.total_token_count - estimated_tokens)
+                outcome = "ok"
+                return
+        finally:
+            record_call(label, time.perf_counter() - began, attempt + 1, usage, outcome)
+
+    def stats(self) -> dict:
+        return {
+            "breaker_state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "request_budget": round(self.requests.level, 1),
+            "token_budget": round(self.tokens.level, 1),
+        }
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting prompts
+    return len(text) // 4 + 1
+
+
+# Process-wide call layer shared by the agents and FileManager
+model_calls = ModelCallLayer()
@@ -7,7 +7,9 @@ class UploadedFile(BaseModel):
     type: str # "reference" or "target"
     status: str = "uploaded" # 'pending', 'uploading', 'uploaded', 'failed'
     local_path: Optional[str] = None
+    content_hash: Optional[str] = None # sha256 of the file bytes
     error_message: Optional[str] = None
+    pending_since: Optional[float] = None # epoch seconds the upload was registered at, for spotting abandoned ones
 
 class AuditRule(BaseModel):
     rule_id: str = Field(description="Unique identifier for the rule")
@@ -18,15 +20,37 @@ class Finding(BaseModel):
     rule_id: str
     description: str
     status: str = Field(description="Pass/Fail/Warning")
-    evidence: str = Field(description="Quote from the target document")
+    evidence: str = Field(description="Verbatim quote from the target document in double quotes, or what is missing from it")
     file_name: str = Field(description="Name of the file where finding was found")
     page_number: Optional[int] = None
 
-class VerifiedFinding(Finding):
-    verification_status: str = Field(description="Verified/Hallucination")
-    reference_citation: str = Field(description="Citation from the reference document verifying the rule")
+class CheckedFinding(Finding):
+    # Deterministic ICD-10 checks of the codes quoted in the evidence: {code, status, detail}
+    code_checks: List[Dict[str, str]] = []
+
+class VerifiedFinding(CheckedFinding):
+    verification_status: str = Field(description="Verified/Hallucination/Unverified")
+    reference_citation: str = Field(default="", description="Citation from the reference document verifying the rule")
     explanation: Optional[str] = None
 
+class HistoryPage(BaseModel):
+    items: List[Dict[str, Any]] = []
+    page: int = 1 # 1 = most recent messages
+    page_size: int
+    total: int = 0 # messages in the whole history
+
+class SessionListItem(BaseModel):
+    session_id: str
+    reference_count: int = 0
+    target_count: int = 0
+    outcome: Optional[str] = None # e.g. "PASS", from the summary's Outcome line
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+class SessionList(BaseModel):
+    items: List[SessionListItem] = []
+    next_cursor: Optional[str] = None # pass back as `cursor` for the next page; None on the last page
+
 class ChatRequest(BaseModel):
     message: str
     scenario: str = "Universal Audit"
@@ -34,6 +58,18 @@ class ChatRequest(BaseModel):
     reference_files: List[UploadedFile] = []
     target_files: List[UploadedFile] = []
     history: List[Dict[str, str]] = []
+    run_id: Optional[str] = None # resume this earlier run from its checkpoints instead of starting over
+
+class AuditJob(BaseModel):
+    job_id: str
+    user_id: str
+    session_id: str
+    status: str # 'queued', 'running', 'succeeded', 'failed'
+    attempts: int = 0 # runs started, including ones whose worker died
+    error: Optional[str] = None
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
 
 class AgentStep(BaseModel):
     step_name: str
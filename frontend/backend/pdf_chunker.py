@@ -0,0 +1,48 @@
+import io
+import os
+import logging
+from typing import List, NamedTuple, Optional
+from pypdf import PdfReader, PdfWriter
+
+logger = logging.getLogger(__name__)
+
+
+class PageWindow(NamedTuple):
+    start: int # 1-based, inclusive
+    end: int   # 1-based, inclusive
+
+
+def page_count(path: str) -> Optional[int]:
+    """Number of pages in a local PDF, or None if it can't be read as one."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return len(PdfReader(path).pages)
+    except Exception as e:
+        logger.warning(f"Could not read {path} as PDF: {e}")
+        return None
+
+
+def plan_windows(total_pages: int, window: int, overlap: int) -> List[PageWindow]:
+    """Splits 1..total_pages into windows of `window` pages, each overlapping the previous by `overlap`."""
+    window = max(1, window)
+    step = max(1, window - max(0, overlap))
+    windows = []
+    start = 1
+    while True:
+        end = min(start + window - 1, total_pages)
+        windows.append(PageWindow(start, end))
+        if end >= total_pages:
+            return windows
+        start += step
+
+
+def extract_window(path: str, window: PageWindow) -> bytes:
+    """Builds a standalone PDF holding just the window's pages."""
+    reader = PdfReader(path)
+    writer = PdfWriter()
+    for index in range(window.start - 1, window.end):
+        writer.add_page(reader.pages[index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,233 @@
+import os
+import re
+import gzip
+import json
+import math
+import logging
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+from pypdf import PdfReader
+from backend.models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+# Page-text indexes of reference PDFs, one file per document content hash
+REFERENCE_INDEX_DIR = os.environ.get("REFERENCE_INDEX_DIR", os.path.join(tempfile.gettempdir(), "universal_audit_index"))
+# Pages sent to the strategist/verifier instead of the whole reference set
+REFERENCE_TOP_K_PAGES = int(os.environ.get("REFERENCE_TOP_K_PAGES", "8"))
+# Reference sets this small (in pages) are still sent whole: retrieval would save little and lose layout
+REFERENCE_RETRIEVAL_MIN_PAGES = int(os.environ.get("REFERENCE_RETRIEVAL_MIN_PAGES", "12")) # 0 = always retrieve
+# Pages with less extracted text than this are image-only; a document made of them isn't indexed
+MIN_PAGE_CHARS = 40
+INDEX_CACHE_ENTRIES = 16
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words, numbers and codes such as "C41.2" or "D16.6-" (trailing dash dropped)
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with "
+    "not no all any each if into other than then there these those such".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for t in _TOKEN.findall(text.lower()):
+        if t in _STOPWORDS:
+            continue
+        tokens.append(t)
+        if "." in t and not t[0].isdigit():
+            # A code also matches its category: "c41.2" -> "c41"
+            tokens.append(t.split(".", 1)[0])
+    return tokens
+
+
+class Passage(NamedTuple):
+    file_name: str
+    page: int # 1-based
+    text: str
+    score: float
+
+
+class DocumentIndex:
+    """Inverted index (term -> [(page, term frequency)]) over one document's page texts."""
+
+    def __init__(self, pages: List[str], postings: Dict[str, List[List[int]]] = None, lengths: List[int] = None):
+        self.pages = pages
+        if postings is None:
+            postings, lengths = {}, []
+            for page, text in enumerate(pages):
+                counts = Counter(tokenize(text))
+                lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    postings.setdefault(term, []).append([page, tf])
+        self.postings = postings
+        self.lengths = lengths
+
+    @classmethod
+    def from_pdf(cls, path: str) -> Optional["DocumentIndex"]:
+        """Extracts the PDF's page text. None if it has (almost) none, e.g. a scan."""
+        pages = [page.extract_text() or "" for page in PdfReader(path).pages]
+        if not pages or sum(len(p.strip()) >= MIN_PAGE_CHARS for p in pages) < len(pages) / 2:
+            return None
+        return cls(pages)
+
+    def to_json(self) -> dict:
+        return {"version": 1, "pages": self.pages, "postings": self.postings, "lengths": self.lengths}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "DocumentIndex":
+        return cls(data["pages"], data["postings"], data["lengths"])
+
+
+class ReferenceIndex:
+    """
+    Page-level BM25 retrieval over reference PDFs. Documents are indexed once at
+    upload (extraction is slow: seconds for a few dozen pages) and stored on
+    disk by content hash; queries rank the pages of a whole reference set.
+    Target documents are indexed too, for their page text (evidence checks).
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or REFERENCE_INDEX_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._cache: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _key(file_obj: UploadedFile) -> Optional[str]:
+        return file_obj.content_hash
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def ingest(self, file_obj: UploadedFile) -> bool:
+        """Indexes a reference file from its local copy (no-op if already indexed). True if it has an index."""
+        key = self._key(file_obj)
+        if not key:
+            return False
+        if key in self._cache or os.path.exists(self._path(key)):
+            return True
+        if not file_obj.local_path or not os.path.exists(file_obj.local_path):
+            return False
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # An audit arriving mid-upload waits for the upload's extraction instead of repeating it
+        with key_lock:
+            if os.path.exists(self._path(key)):
+                return True
+            return self._build(file_obj, key)
+
+    def _build(self, file_obj: UploadedFile, key: str) -> bool:
+        try:
+            index = DocumentIndex.from_pdf(file_obj.local_path)
+        except Exception as e:
+            logger.warning(f"Could not extract text from {file_obj.name}: {e}")
+            return False
+        if index is None:
+            logger.info(f"{file_obj.name} has no text layer, it will be sent whole.")
+            return False
+        with self._lock:
+            self._remember(key, index)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(index.to_json(), f)
+            os.replace(tmp_path, self._path(key)) # readers never see a half-written index
+        except OSError as e:
+            # Still usable from memory in this process
+            logger.warning(f"Could not store the index of {file_obj.name}: {e}")
+        logger.info(f"Indexed {file_obj.name}: {len(index.pages)} pages, {len(index.postings)} terms.")
+        return True
+
+    def _remember(self, key: str, index: DocumentIndex):
+        self._cache[key] = index
+        self._cache.move_to_end(key)
+        while len(self._cache) > INDEX_CACHE_ENTRIES:
+            self._cache.popitem(last=False)
+
+    def _load(self, file_obj: UploadedFile) -> Optional[DocumentIndex]:
+        key = self._key(file_obj)
+        if not key:
+            return None
+        with self._lock:
+            index = self._cache.get(key)
+            if index is not None:
+                self._cache.move_to_end(key)
+                return index
+        if not self.ingest(file_obj):
+            return None
+        with self._lock:
+            index = self._cache.get(key)
+        if index is None:
+            try:
+                with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                    index = DocumentIndex.from_json(json.load(f))
+            except Exception as e:
+                logger.warning(f"Reference index for {file_obj.name} unreadable: {e}")
+                return None
+            with self._lock:
+                self._remember(key, index)
+        return index
+
+    def page_texts(self, file_obj: UploadedFile) -> Optional[List[str]]:
+        """A document's extracted page texts (indexing it if needed). None if it has no text layer."""
+        index = self._load(file_obj)
+        return index.pages if index is not None else None
+
+    def search(self, reference_files: List[UploadedFile], query: str, k: int = REFERENCE_TOP_K_PAGES,
+               min_pages: int = REFERENCE_RETRIEVAL_MIN_PAGES) -> Optional[List[Passage]]:
+        """
+        The k pages of the reference set that best match the query, in document order.
+        None when retrieval doesn't apply (a file without a text index, or a set of
+        at most `min_pages` pages): callers then send the documents whole.
+        """
+        if not reference_files:
+            return None
+        indexes = [self._load(f) for f in reference_files]
+        if any(index is None for index in indexes):
+            return None
+        total_pages = sum(len(index.pages) for index in indexes)
+        if total_pages <= min_pages:
+            return None
+
+        # BM25 over the pages of all the documents, as one corpus
+        terms = set(tokenize(query))
+        avg_length = sum(sum(index.lengths) for index in indexes) / total_pages or 1.0
+        doc_freq = {t: sum(len(index.postings.get(t, ())) for index in indexes) for t in terms}
+        scored = []
+        for doc, index in enumerate(indexes):
+            scores: Dict[int, float] = {}
+            for term in terms:
+                postings = index.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_pages - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                for page, tf in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[page] / avg_length)
+                    scores[page] = scores.get(page, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            scored.extend((score, doc, page) for page, score in scores.items())
+
+        top = sorted(scored, reverse=True)[:k]
+        if not top:
+            # Nothing matches the query at all: the opening pages are the best guess
+            top = [(0.0, doc, page) for doc, index in enumerate(indexes) for page in range(min(k, len(index.pages)))][:k]
+        return [
+            Passage(reference_files[doc].name, page + 1, indexes[doc].pages[page], round(score, 3))
+            for score, doc, page in sorted(top, key=lambda t: (t[1], t[2]))
+        ]
+
+
+def format_passages(passages: List[Passage]) -> str:
+    """Retrieved pages as prompt text, each labelled with its document and page number."""
+    blocks = [f'--- Reference "{p.file_name}", page {p.page} ---\n{p.text.strip()}' for p in passages]
+    return (
+        "REFERENCE EXCERPTS (the pages of the reference documents most relevant to this task; "
+        "cite them by document name and page number):\n\n" + "\n\n".join(blocks)
+    )
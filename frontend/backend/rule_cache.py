@@ -0,0 +1,114 @@
+import os
+import re
+import time
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from supabase import Client
+from backend.models import AuditRule, UploadedFile
+
+logger = logging.getLogger(__name__)
+
+RULE_CACHE_TTL = int(os.environ.get("RULE_CACHE_TTL", str(24 * 3600))) # seconds
+RULE_CACHE_MAX_ENTRIES = int(os.environ.get("RULE_CACHE_MAX_ENTRIES", "256"))
+# Opt-in shared tier so every worker (and restarts) can reuse rules. Needs the rule_cache table.
+RULE_CACHE_SUPABASE = os.environ.get("RULE_CACHE_SUPABASE", "0") == "1"
+
+# Words that don't change what the user is asking the strategist for
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "for", "to", "in", "on", "with", "this", "that", "these",
+    "please", "can", "could", "you", "me", "my", "i", "is", "are", "it", "be", "do", "against", "all",
+}
+
+
+def normalize_intent(query: str) -> str:
+    """
+    Reduces a user query to its content words, so filler and casing don't split keys. Word order is
+    kept: "admission after discharge" and "discharge after admission" are different requests.
+    """
+    words = re.findall(r"\w+", (query or "").lower())
+    return " ".join(w for w in words if w not in _STOPWORDS)
+
+
+class RuleCache:
+    """
+    Memoizes the strategist's rule set per (scenario, query intent, reference corpus).
+    In-process LRU with TTL, optionally backed by a Supabase table shared across workers.
+    """
+
+    def __init__(self, ttl: int = RULE_CACHE_TTL, max_entries: int = RULE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db: Optional[Client] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # key -> (stored_at, rules)
+        self._lock = threading.Lock()
+
+    def attach_db(self, client: Optional[Client]):
+        """Enables the Supabase tier (only if RULE_CACHE_SUPABASE=1)."""
+        if RULE_CACHE_SUPABASE and client:
+            self.db = client
+
+    @staticmethod
+    def key(scenario: str, query: str, reference_files: List[UploadedFile]) -> Optional[str]:
+        """None (not cacheable) when a reference has no content hash: nothing else identifies its bytes."""
+        if any(not f.content_hash for f in reference_files):
+            return None
+        refs = sorted(f.content_hash for f in reference_files)
+        raw = json.dumps([scenario.strip().lower(), normalize_intent(query), refs])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, scenario: str, query: str, reference_files: List[UploadedFile]) -> Optional[List[AuditRule]]:
+        key = self.key(scenario, query, reference_files)
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return list(entry[1])
+            self._entries.pop(key, None)
+
+        rules = self._get_remote(key, now)
+        if rules:
+            self._store_local(key, rules, now)
+        return rules
+
+    def put(self, scenario: str, query: str, reference_files: List[UploadedFile], rules: List[AuditRule]):
+        if not rules:
+            return
+        key = self.key(scenario, query, reference_files)
+        if key is None:
+            return
+        self._store_local(key, rules, time.time())
+        if self.db:
+            try:
+                self.db.table("rule_cache").upsert({
+                    "cache_key": key,
+                    "rules": [r.model_dump() for r in rules],
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                }).execute()
+            except Exception as e:
+                logger.warning(f"Failed to write rule cache entry to Supabase: {e}")
+
+    def _store_local(self, key: str, rules: List[AuditRule], stored_at: float):
+        with self._lock:
+            self._entries[key] = (stored_at, list(rules))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_remote(self, key: str, now: float) -> Optional[List[AuditRule]]:
+        if not self.db:
+            return None
+        try:
+            cutoff = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - self.ttl))
+            response = self.db.table("rule_cache").select("rules").eq("cache_key", key).gte("created_at", cutoff).execute()
+            if response.data:
+                return [AuditRule(**r) for r in response.data[0]["rules"]]
+        except Exception as e:
+            logger.warning(f"Rule cache lookup in Supabase failed: {e}")
+        return None
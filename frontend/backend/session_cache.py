@@ -0,0 +1,265 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from backend.models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+# Reads within this window are served from memory with no round trip at all.
+# After it, the entry is revalidated by comparing `updated_at` (a one-column read).
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "10")) # seconds, 0 disables the cache
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "512"))
+# Deferred column writes are coalesced and flushed this often, or before a direct write to the same session
+SESSION_WRITE_BEHIND_INTERVAL = float(os.environ.get("SESSION_WRITE_BEHIND_INTERVAL", "1.0")) # seconds
+
+FILE_COLUMNS = ("reference", "target")
+
+
+def _file_key(f: UploadedFile):
+    return f.uri or f.local_path
+
+
+class _Entry:
+    def __init__(self, details: dict, owner: Optional[str], version: Optional[str]):
+        self.details = details       # {"reference": [UploadedFile], "target": [...], "summary"}
+        self.owner = owner           # the row's user_id, checked on every read
+        self.version = version       # updated_at of the row we loaded; None = unknown, reload on revalidation
+        self.checked_at = time.monotonic()
+
+
+def _copy(details: dict) -> dict:
+    """Callers get their own objects, so they can't mutate the cached ones."""
+    return {
+        "reference": [f.model_copy() for f in details.get("reference", [])],
+        "target": [f.model_copy() for f in details.get("target", [])],
+        "summary": details.get("summary"),
+    }
+
+
+class SessionCache:
+    """
+    Per-process read-through cache of parsed session rows, with LRU eviction,
+    a TTL after which entries are revalidated against the row's `updated_at`,
+    and write-behind for column overwrites that are repeated often enough to
+    coalesce. History is not cached, it is read a page at a time.
+
+    A deferred write carries the row version (updated_at) it was based on and is
+    dropped, not retried, if the row has changed by the time it is flushed: a late
+    flush must not overwrite a newer write from another worker. The writer
+    returns False in that case.
+
+    Other workers' changes are picked up at the latest one TTL later. Our own
+    writes are applied to the entry immediately and clear its version, so the
+    next revalidation reloads the row instead of trusting a timestamp we never saw.
+    """
+
+    def __init__(self, writer: Callable[[str, dict, Optional[str], Optional[str]], bool], ttl: float = SESSION_CACHE_TTL,
+                 max_entries: int = SESSION_CACHE_MAX_ENTRIES, flush_interval: float = SESSION_WRITE_BEHIND_INTERVAL):
+        self.writer = writer
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: Dict[str, Tuple[dict, Optional[str], Optional[str]]] = {} # session_id -> (columns, user_id, expected version)
+        self._inflight: Dict[str, dict] = {} # being written right now, still newer than the DB
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.RLock()
+        # Flushes run one at a time, so a direct write waiting on flush(session_id) comes after any in flight
+        self._flush_lock = threading.Lock()
+        self.hits = 0
+        self.stale_writes = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    # --- reads ---
+
+    def get(self, session_id: str, user_id: Optional[str], loader: Callable[[], Optional[Tuple[dict, Optional[str], Optional[str]]]],
+            version_of: Callable[[], Optional[str]], max_age: float = None) -> Optional[dict]:
+        """
+        Returns the session's details, from memory when fresh enough.
+        loader() -> (details, updated_at, owner user_id) or None if there is no such row; version_of() -> updated_at.
+        max_age overrides the TTL (0 = always revalidate, e.g. when polling for changes).
+        """
+        if not self.enabled:
+            loaded = loader()
+            return loaded[0] if loaded else None
+
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry and user_id and entry.owner != user_id:
+                entry = None # not this user's session, let the DB query decide
+            elif entry:
+                self._entries.move_to_end(session_id)
+                if time.monotonic() - entry.checked_at <= max_age:
+                    self.hits += 1
+                    return _copy(entry.details)
+
+        if entry and entry.version is not None:
+            # Cheap check: unchanged rows only cost a one-column read
+            if version_of() == entry.version:
+                with self._lock:
+                    self.revalidations += 1
+                    entry.checked_at = time.monotonic()
+                    return _copy(entry.details)
+
+        with self._lock:
+            self.misses += 1
+        loaded = loader()
+        if not loaded:
+            return None
+        details, version, owner = loaded
+        return self._store(session_id, owner, details, version)
+
+    def peek(self, session_id: str, user_id: Optional[str] = None) -> Optional[dict]:
+        """The cached details if they are within the TTL, without touching the DB."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if not entry or (user_id and entry.owner != user_id):
+                return None
+            if time.monotonic() - entry.checked_at > self.ttl:
+                return None
+            self.hits += 1
+            return _copy(entry.details)
+
+    def _store(self, session_id: str, owner: Optional[str], details: dict, version: Optional[str]) -> dict:
+        with self._lock:
+            # Deferred writes not yet in the DB win over what it still has
+            unwritten = {**self._inflight.get(session_id, {}), **self._pending.get(session_id, ({}, None, None))[0]}
+            if unwritten:
+                details = {**details, **{k: v for k, v in unwritten.items() if k not in FILE_COLUMNS}}
+            self._entries[session_id] = _Entry(_copy(details), owner, version)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return _copy(details)
+
+    # --- local updates after our own writes ---
+
+    def add_files(self, session_id: str, files: Dict[str, List[UploadedFile]], user_id: Optional[str] = None):
+        """Records files appended to the session (skipping ones it already has)."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if not entry or not self._writable(entry, user_id):
+                return
+            for file_type, incoming in files.items():
+                known = {_file_key(f) for f in entry.details[file_type]}
+                entry.details[file_type].extend(f.model_copy() for f in incoming if _file_key(f) not in known)
+            entry.version = None
+
+    def patch_file(self, session_id: str, file_type: str, file_obj: UploadedFile, user_id: Optional[str] = None):
+        """Records a file record replaced in place (matched by local_path)."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if not entry or not self._writable(entry, user_id):
+                return
+            entry.details[file_type] = [
+                file_obj.model_copy() if f.local_path == file_obj.local_path else f
+                for f in entry.details[file_type]
+            ]
+            entry.version = None
+
+    def set_columns(self, session_id: str, data: dict, user_id: Optional[str] = None):
+        """Records overwritten columns (reference/target lists of UploadedFile or dicts, summary); others are ignored."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if not entry or not self._writable(entry, user_id):
+                return
+            for column, value in data.items():
+                if column in FILE_COLUMNS:
+                    value = [f if isinstance(f, UploadedFile) else UploadedFile(**f) for f in value or []]
+                if column in entry.details:
+                    entry.details[column] = value
+            entry.version = None
+
+    @staticmethod
+    def _writable(entry: _Entry, user_id: Optional[str]) -> bool:
+        # The DB functions ignore writes to someone else's session; so do we
+        return not user_id or entry.owner is None or entry.owner == user_id
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    # --- write-behind ---
+
+    def queue_write(self, session_id: str, data: dict, user_id: Optional[str] = None, version: Optional[str] = None):
+        """
+        Applies column overwrites locally now and writes them to the DB on the next flush,
+        if the row is still at `version` (its updated_at when the write was made; None = no row).
+        """
+        self.set_columns(session_id, data, user_id)
+        with self._lock:
+            columns, _, _ = self._pending.get(session_id, ({}, None, None))
+            # Later writes to the same column replace earlier ones: one DB write per session per flush.
+            # The latest version wins too: the row can't have changed through us in between (see flush).
+            self._pending[session_id] = ({**columns, **data}, user_id, version)
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self, session_id: str = None):
+        """
+        Writes pending column overwrites (one session, or all). Failed writes stay queued,
+        stale ones (the row changed since they were made) are dropped. Call it for a session
+        before writing to it directly, so its deferred write isn't made stale by our own write.
+        """
+        with self._flush_lock:
+            self._flush(session_id)
+
+    def _flush(self, session_id: str = None):
+        with self._lock:
+            if session_id is None:
+                batch, self._pending = self._pending, {}
+                self._timer = None
+            else:
+                batch = {session_id: self._pending.pop(session_id)} if session_id in self._pending else {}
+
+        for sid, (data, user_id, version) in batch.items():
+            with self._lock:
+                self._inflight[sid] = data
+            try:
+                if not self.writer(sid, data, user_id, version):
+                    logger.warning(f"Dropped deferred write of {', '.join(data)} for session {sid}: the session changed since.")
+                    with self._lock:
+                        self.stale_writes += 1
+                    # Our copy holds the dropped values: reload it from the DB
+                    self.invalidate(sid)
+            except Exception as e:
+                logger.error(f"Deferred write for session {sid} failed, will retry: {e}")
+                with self._lock:
+                    # Keep anything written to the same columns since
+                    newer, _, newer_version = self._pending.get(sid, ({}, user_id, version))
+                    self._pending[sid] = ({**data, **newer}, user_id, newer_version)
+                    if self._timer is None:
+                        self._timer = threading.Timer(self.flush_interval, self.flush)
+                        self._timer.daemon = True
+                        self._timer.start()
+            finally:
+                with self._lock:
+                    self._inflight.pop(sid, None)
+
+    def pending_writes(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "misses": self.misses,
+                "pending_writes": len(self._pending),
+                "stale_writes": self.stale_writes,
+            }
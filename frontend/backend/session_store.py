@@ -0,0 +1,245 @@
+import json
+import time
+import base64
+import logging
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
+from postgrest.exceptions import APIError
+from supabase import Client
+from backend.models import HistoryPage, SessionList, SessionListItem
+
+logger = logging.getLogger(__name__)
+
+# PostgREST error code for "function not found in the schema cache"
+MISSING_FUNCTION_CODE = "PGRST202"
+
+# All session columns except the (unbounded) chat history
+OVERVIEW_COLUMNS = "session_id,user_id,reference,target,summary,updated_at"
+HISTORY_PAGE_SIZE = 50
+# Columns of a session listing row (generated columns, see supabase_schema.sql)
+LIST_COLUMNS = "session_id,reference_count,target_count,outcome,created_at,updated_at"
+
+
+def encode_cursor(updated_at: str, session_id: str) -> str:
+    """Opaque keyset cursor: the (updated_at, session_id) of the last row returned."""
+    raw = json.dumps([updated_at, session_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor. Raises ValueError on anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, session_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(updated_at, str) or not isinstance(session_id, str):
+        raise ValueError("Invalid cursor")
+    return updated_at, session_id
+
+
+def file_key(f: dict):
+    """A file is identified by its Gemini URI, or by its local path while still pending (mirrors session_file_key)."""
+    return f.get("uri") or f.get("local_path")
+
+
+def file_status(f: dict, stale_before: float = None) -> str:
+    """A file record's upload status, 'failed' if it has been pending since before stale_before (mirrors session_file_statuses)."""
+    status = f.get("status") or "uploaded"
+    if status == "pending" and stale_before is not None and f.get("pending_since") is not None and f["pending_since"] < stale_before:
+        return "failed"
+    return status
+
+
+class SessionStore:
+    """
+    Typed access to the `sessions` table.
+
+    Reads select only the columns the caller needs (files, statuses, summary,
+    one page of history), so polling and file lookups never ship the large
+    summary/history payloads. Every mutation is one round trip to a
+    single-statement SQL function (see supabase_schema.sql), so concurrent
+    writers to the same session can't lose each other's changes.
+    """
+
+    def __init__(self):
+        # Functions found missing (database not migrated yet); those calls fall back to plain queries.
+        self.missing_functions = set()
+
+    def _rpc(self, client: Client, fn: str, params: dict):
+        """Calls a session_* function. Returns its response, or None if it isn't installed, so callers can fall back."""
+        if fn in self.missing_functions:
+            return None
+        try:
+            return client.rpc(fn, params).execute()
+        except APIError as e:
+            if e.code != MISSING_FUNCTION_CODE:
+                raise
+            logger.warning(f"Supabase function {fn} not found, falling back to plain queries. Run supabase_schema.sql to fix.")
+            self.missing_functions.add(fn)
+            return None
+
+    def _select_row(self, client: Client, session_id: str, columns: str, user_id: str = None) -> Optional[dict]:
+        query = client.table("sessions").select(columns).eq("session_id", session_id)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        response = query.execute()
+        return response.data[0] if response.data else None
+
+    # --- Projected reads ---
+
+    def get_files(self, client: Client, session_id: str, user_id: str = None) -> Dict[str, List[dict]]:
+        """Reads just the reference/target lists of a session."""
+        row = self._select_row(client, session_id, "reference,target", user_id) or {}
+        return {"reference": row.get("reference") or [], "target": row.get("target") or []}
+
+    def get_file_statuses(self, client: Client, session_id: str, user_id: str = None, stale_after: float = None) -> List[str]:
+        """
+        Upload status of every file in the session, without the file records themselves.
+        Files pending for more than stale_after seconds are reported as 'failed'.
+        """
+        response = self._rpc(client, "session_file_statuses", {"p_session_id": session_id, "p_user_id": user_id, "p_stale_after": stale_after})
+        if response is not None:
+            return response.data or []
+        files = self.get_files(client, session_id, user_id)
+        stale_before = time.time() - stale_after if stale_after is not None else None
+        return [file_status(f, stale_before) for f in files["reference"] + files["target"]]
+
+    def get_summary(self, client: Client, session_id: str, user_id: str = None) -> Optional[str]:
+        """The latest audit report of the session."""
+        row = self._select_row(client, session_id, "summary", user_id)
+        return row.get("summary") if row else None
+
+    def get_overview(self, client: Client, session_id: str, user_id: str = None) -> Optional[dict]:
+        """Everything but the history: file lists, summary, owner and updated_at. None if there is no such session."""
+        return self._select_row(client, session_id, OVERVIEW_COLUMNS, user_id)
+
+    def get_version(self, client: Client, session_id: str, user_id: str = None) -> Optional[str]:
+        """The row's updated_at, a one-column read used to revalidate cached copies."""
+        row = self._select_row(client, session_id, "updated_at", user_id)
+        return row.get("updated_at") if row else None
+
+    def get_history_page(self, client: Client, session_id: str, user_id: str = None, page: int = 1, page_size: int = HISTORY_PAGE_SIZE) -> HistoryPage:
+        """
+        Page `page` of the chat history, counting back from the most recent message
+        (page 1 = the latest `page_size` messages), oldest first within the page.
+        """
+        page, page_size = max(1, page), max(1, page_size)
+        params = {"p_session_id": session_id, "p_user_id": user_id, "p_page": page, "p_page_size": page_size}
+        response = self._rpc(client, "session_history_page", params)
+        if response is not None:
+            data = response.data or {}
+            return HistoryPage(items=data.get("items") or [], page=page, page_size=page_size, total=data.get("total") or 0)
+
+        row = self._select_row(client, session_id, "history", user_id) or {}
+        history = row.get("history") or []
+        end = max(0, len(history) - (page - 1) * page_size)
+        return HistoryPage(items=history[max(0, end - page_size):end], page=page, page_size=page_size, total=len(history))
+
+    def list_sessions(self, client: Client, user_id: str, limit: int = 20, cursor: str = None) -> SessionList:
+        """
+        A page of the user's sessions, most recently updated first (keyset pagination,
+        so every page costs the same however deep it is). Raises ValueError on a bad cursor.
+        """
+        after_updated_at, after_session_id = decode_cursor(cursor) if cursor else (None, None)
+        # One extra row tells us whether there is a next page
+        params = {"p_user_id": user_id, "p_after_updated_at": after_updated_at, "p_after_session_id": after_session_id, "p_limit": limit + 1}
+        response = self._rpc(client, "session_list", params)
+        if response is not None:
+            rows = response.data or []
+        else:
+            query = client.table("sessions").select(LIST_COLUMNS).eq("user_id", user_id)
+            if cursor:
+                query = query.or_(
+                    f'updated_at.lt."{after_updated_at}",'
+                    f'and(updated_at.eq."{after_updated_at}",session_id.lt."{after_session_id}")'
+                )
+            rows = query.order("updated_at", desc=True).order("session_id", desc=True).limit(limit + 1).execute().data or []
+
+        items = [SessionListItem(**row) for row in rows[:limit]]
+        next_cursor = encode_cursor(items[-1].updated_at, items[-1].session_id) if len(rows) > limit else None
+        return SessionList(items=items, next_cursor=next_cursor)
+
+    # --- Atomic writes ---
+
+    def append_file_sets(self, client: Client, session_id: str, files: Dict[str, List[dict]], user_id: str = None):
+        """Adds files to the session's reference and target lists in one write, skipping ones already present."""
+        params = {
+            "p_session_id": session_id,
+            "p_user_id": user_id,
+            "p_reference": files.get("reference", []),
+            "p_target": files.get("target", []),
+        }
+        if self._rpc(client, "session_append_file_sets", params) is not None:
+            return
+
+        existing = self.get_files(client, session_id, user_id)
+        data = {}
+        for file_type, incoming in files.items():
+            if not incoming:
+                continue
+            known = {file_key(f) for f in existing[file_type]}
+            data[file_type] = existing[file_type] + [f for f in incoming if file_key(f) not in known]
+        if data:
+            self._legacy_save(client, session_id, data, user_id)
+
+    def append_files(self, client: Client, session_id: str, file_type: str, files: List[dict], user_id: str = None):
+        """Adds files to the session's reference/target list, skipping ones already present."""
+        self.append_file_sets(client, session_id, {file_type: files}, user_id)
+
+    def patch_file(self, client: Client, session_id: str, file_type: str, file: dict, user_id: str = None):
+        """Replaces the file record with the same local_path (e.g. to record its URI and status)."""
+        params = {"p_session_id": session_id, "p_user_id": user_id, "p_file_type": file_type, "p_file": file}
+        if self._rpc(client, "session_patch_file", params) is not None:
+            return
+
+        existing = (self._select_row(client, session_id, file_type, user_id) or {}).get(file_type) or []
+        if any(f.get("local_path") == file.get("local_path") for f in existing):
+            updated = [file if f.get("local_path") == file.get("local_path") else f for f in existing]
+            self._legacy_save(client, session_id, {file_type: updated}, user_id)
+
+    def upsert(self, client: Client, session_id: str, data: dict, user_id: str = None):
+        """Creates the session or updates only the columns present in data."""
+        params = {"p_session_id": session_id, "p_user_id": user_id, "p_data": data}
+        if self._rpc(client, "session_upsert", params) is not None:
+            return
+        self._legacy_save(client, session_id, data, user_id)
+
+    def upsert_if_unchanged(self, client: Client, session_id: str, data: dict, expected_version: Optional[str], user_id: str = None) -> bool:
+        """
+        Like upsert, but only if the row's updated_at is still expected_version (None: only if
+        there is no row yet). Returns False, writing nothing, when the row has changed since.
+        """
+        params = {"p_session_id": session_id, "p_user_id": user_id, "p_data": data, "p_expected_updated_at": expected_version}
+        response = self._rpc(client, "session_upsert_if_unchanged", params)
+        if response is not None:
+            return bool(response.data)
+
+        if expected_version is None:
+            if self._select_row(client, session_id, "session_id"):
+                return False
+            self._legacy_save(client, session_id, data, user_id)
+            return True
+        data = {**data, "updated_at": datetime.now(timezone.utc).isoformat()}
+        query = client.table("sessions").update(data).eq("session_id", session_id).eq("updated_at", expected_version)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        return bool(query.execute().data)
+
+    # --- Fallback path for databases without the session_* functions ---
+
+    def _legacy_save(self, client: Client, session_id: str, data: dict, user_id: str = None):
+        # Bump updated_at ourselves: cached copies in other workers are revalidated against it.
+        data = {**data, "updated_at": datetime.now(timezone.utc).isoformat()}
+        # Partial update if the row exists (upsert would reset omitted columns), insert otherwise.
+        check = client.table("sessions").select("session_id").eq("session_id", session_id).execute()
+        if check.data:
+            query = client.table("sessions").update(data).eq("session_id", session_id)
+            if user_id:
+                query = query.eq("user_id", user_id)
+            query.execute()
+        else:
+            payload = {"session_id": session_id, **data}
+            if user_id:
+                payload["user_id"] = user_id
+            client.table("sessions").insert(payload).execute()
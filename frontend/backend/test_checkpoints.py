@@ -0,0 +1,99 @@
+import pytest
+from backend import agents
+from backend.audit_pipeline import run_audit
+from backend.fake_gemini import _prompt_text, default_responder
+from backend.model_calls import ModelCallLayer
+from backend.models import ChatRequest, Finding, UploadedFile
+
+
+class FlakyModels:
+    """default_responder, except for the calls told to fail; counts calls by node."""
+
+    def __init__(self):
+        self.fail_unit, self.fail_verifier = True, True
+        self.calls = []
+
+    def __call__(self, model, contents, config):
+        schema = getattr(config, "response_schema", None)
+        node = "verifier" if schema is None else "auditor" if schema == list[Finding] else "strategist"
+        self.calls.append(node)
+        prompt = _prompt_text(contents)
+        if node == "auditor" and self.fail_unit and '"t1"' in prompt and "GEN-003" in prompt:
+            raise ValueError("auditor unit failed")
+        if node == "verifier" and self.fail_verifier:
+            raise ValueError("verifier failed")
+        return default_responder(model, contents, config)
+
+    def take(self):
+        counts = {node: self.calls.count(node) for node in ("strategist", "auditor", "verifier")}
+        self.calls.clear()
+        return counts
+
+
+@pytest.fixture
+def models(fake_gemini, monkeypatch):
+    # One rule per auditor call, so each (file, rule) is its own checkpointed unit
+    monkeypatch.setattr(agents, "AUDITOR_RULE_SHARD_TOKENS", 1)
+    monkeypatch.setattr(agents, "model_calls", ModelCallLayer(max_retries=0, breaker_threshold=100))
+    fake_gemini.responder = FlakyModels()
+    return fake_gemini.responder
+
+
+def request(run_id=None):
+    return ChatRequest(
+        message="audit the codes",
+        scenario="Checkpoint resume",
+        session_id="resume-1",
+        run_id=run_id,
+        reference_files=[UploadedFile(name="policy", uri="files/policy", type="reference")],
+        target_files=[UploadedFile(name=f"t{i}", uri=f"files/t{i}", type="target") for i in range(3)],
+    )
+
+
+async def collect(file_manager, user_id, run_id=None):
+    return [event async for event in run_audit(request(run_id), user_id, file_manager)]
+
+
+def started(events):
+    return next(e for e in events if e.get("status") == "started")
+
+
+def final(events):
+    return next(e["content"] for e in events if e["step"] == "final")
+
+
+@pytest.mark.anyio
+async def test_resume_repeats_only_what_failed(file_manager, models):
+    events = await collect(file_manager, "u1")
+    run_id = started(events)["run_id"]
+    first = models.take()
+    assert first["strategist"] == 1 and first["auditor"] == 15
+    assert final(events).startswith("Error generating final report")
+
+    # The failed unit, then the verifier: the rules and the 14 good units come from checkpoints
+    models.fail_unit = False
+    events = await collect(file_manager, "u1", run_id)
+    assert started(events)["resumed"] and started(events)["run_id"] == run_id
+    assert models.take() == {"strategist": 0, "auditor": 1, "verifier": 1}
+    restored = [e["step"] for e in events if e.get("checkpoint")]
+    assert restored == ["strategist"]
+
+    # Now the audit is complete, only the verifier runs again
+    models.fail_verifier = False
+    events = await collect(file_manager, "u1", run_id)
+    assert models.take() == {"strategist": 0, "auditor": 0, "verifier": 1}
+    assert [e["step"] for e in events if e.get("checkpoint")] == ["strategist", "auditor"]
+    assert final(events).startswith("# Audit Report")
+
+
+@pytest.mark.anyio
+async def test_run_ids_are_per_user(file_manager, models):
+    models.fail_unit = models.fail_verifier = False
+    run_id = started(await collect(file_manager, "u1"))["run_id"]
+    models.take()
+
+    # Another user naming the same run gets a fresh run, not u1's checkpoints
+    events = await collect(file_manager, "u2", run_id)
+    assert not started(events)["resumed"]
+    assert models.take()["auditor"] == 15
+    assert not any(e.get("checkpoint") for e in events)
@@ -0,0 +1,134 @@
+import threading
+import time as real_time
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from backend import context_cache as context_cache_module
+from backend.context_cache import FAILURE_BACKOFF, ReferenceContextCache
+from backend.models import UploadedFile
+
+TTL = 1000
+
+
+class MockCaches:
+    """Records cache calls; expire_time follows the test clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.created, self.updated, self.deleted = [], [], []
+        self.fail_creates = False
+        self.create_delay = 0
+
+    def _handle(self, name):
+        return SimpleNamespace(name=name, expire_time=datetime.fromtimestamp(self.clock[0] + TTL, timezone.utc))
+
+    def create(self, *, model, config=None):
+        if self.create_delay:
+            real_time.sleep(self.create_delay)
+        if self.fail_creates:
+            raise ValueError("Cached content is too small")
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append(name)
+        return self._handle(name)
+
+    def update(self, *, name, config=None):
+        self.updated.append(name)
+        return self._handle(name)
+
+    def delete(self, *, name):
+        self.deleted.append(name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(context_cache_module, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def caches(clock):
+    return MockCaches(clock)
+
+
+def make_cache(caches, max_entries=8):
+    client = SimpleNamespace(caches=caches)
+    return ReferenceContextCache(lambda: client, ttl=TTL, max_entries=max_entries, enabled=True)
+
+
+def refs(*hashes):
+    return [UploadedFile(name=f"{h}.pdf", uri=f"files/{h}", type="reference", content_hash=h) for h in hashes]
+
+
+def test_create_then_reuse(caches):
+    cache = make_cache(caches)
+    name = cache.get("model", refs("a", "b"))
+    assert name == "cachedContents/1"
+    # Same content in another order, re-uploaded under another uri: same handle
+    assert cache.get("model", refs("b", "a")) == name
+    assert caches.created == [name] and caches.updated == []
+    assert cache._key_locks == {}
+
+
+def test_no_handle_without_content_hashes(caches):
+    cache = make_cache(caches)
+    unhashed = [UploadedFile(name="ref.pdf", uri="files/ref", type="reference")]
+    assert cache.get("model", unhashed) is None
+    assert caches.created == []
+
+
+def test_refresh_when_little_ttl_is_left(caches, clock):
+    cache = make_cache(caches)
+    name = cache.get("model", refs("a"))
+    clock[0] += TTL * 0.5
+    cache.get("model", refs("a"))
+    assert caches.updated == []
+    clock[0] += TTL * 0.3 # 20% left
+    assert cache.get("model", refs("a")) == name
+    assert caches.updated == [name] and len(caches.created) == 1
+
+
+def test_expired_handle_is_replaced(caches, clock):
+    cache = make_cache(caches)
+    first = cache.get("model", refs("a"))
+    clock[0] += TTL + 1
+    second = cache.get("model", refs("a"))
+    assert second != first
+    assert caches.deleted == [first]
+
+
+def test_failed_create_backs_off(caches, clock):
+    cache = make_cache(caches)
+    caches.fail_creates = True
+    assert cache.get("model", refs("a")) is None
+    caches.fail_creates = False
+    assert cache.get("model", refs("a")) is None
+    assert caches.created == []
+    clock[0] += FAILURE_BACKOFF + 1
+    assert cache.get("model", refs("a")) == "cachedContents/1"
+    assert cache._failures == {}
+
+
+def test_lru_eviction_deletes_remote_handle(caches):
+    cache = make_cache(caches, max_entries=2)
+    a = cache.get("model", refs("a"))
+    b = cache.get("model", refs("b"))
+    cache.get("model", refs("a")) # a is now the most recently used
+    cache.get("model", refs("c"))
+    assert caches.deleted == [b]
+    assert cache.get("model", refs("a")) == a
+    assert len(cache._entries) == 2
+
+
+def test_one_create_per_set_under_concurrency(caches):
+    cache = make_cache(caches)
+    caches.create_delay = 0.05
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("model", refs("a")))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert caches.created == ["cachedContents/1"]
+    assert set(results) == {"cachedContents/1"}
+    assert cache._key_locks == {}
@@ -0,0 +1,98 @@
+import random
+import time
+from backend.evidence_check import EvidenceVerifier, HALLUCINATION, UNVERIFIED, VERIFIED, quoted_spans
+from backend.models import Finding, UploadedFile
+
+PAGES = [
+    "Patient: Jane Roe. Admission date: 03/01/2024. Attending physician: Dr. Alan Smith.",
+    "Diagnosis: malignant neoplasm of the long bones of the lower limb, C40.2. Biopsy confirmed osteosarcoma of the left femur.",
+    "Discharge summary. The patient was discharged home in stable condition on 03/09/2024 with follow-up in two weeks.",
+]
+TARGET = UploadedFile(name="record.pdf", uri="files/record", type="target", content_hash="record-hash")
+
+
+def verify(evidence, page_number=None, pages=PAGES):
+    verifier = EvidenceVerifier(lambda f: pages)
+    finding = Finding(rule_id="R1", description="check", status="Fail", evidence=evidence, file_name="record.pdf", page_number=page_number)
+    return verifier.verify([finding], [TARGET])[0]
+
+
+def test_quoted_spans():
+    assert quoted_spans('Record says "admitted on 03/01" and “discharged home”.') == ["admitted on 03/01", "discharged home"]
+    assert quoted_spans("No discharge date recorded.") == []
+
+
+def test_exact_quote():
+    result = verify('"Biopsy confirmed osteosarcoma of the left femur."', page_number=2)
+    assert result.verification_status == VERIFIED
+    assert result.page_number == 2
+
+
+def test_ocr_noisy_quote():
+    # A misread character and a word hyphenated over a line break
+    result = verify('"The patient was dis-\ncharged home in stab1e condition on 03/09/2024"')
+    assert result.verification_status == VERIFIED
+    # A ligature
+    assert verify('"Biopsy conﬁrmed osteosarcoma"').verification_status == VERIFIED
+
+
+def test_wrong_page_is_corrected():
+    result = verify('"Admission date: 03/01/2024"', page_number=3)
+    assert result.verification_status == VERIFIED
+    assert result.page_number == 1
+
+
+def test_absent_quote_is_a_hallucination():
+    result = verify('"The patient was transferred to intensive care on 03/04/2024 after a fall."')
+    assert result.verification_status == HALLUCINATION
+    assert "not found" in result.explanation
+
+
+def test_absence_statement_is_unverified():
+    result = verify("No documentation of discharge date found.")
+    assert result.verification_status == UNVERIFIED
+
+
+def test_paraphrase_is_unverified():
+    result = verify("The record shows the patient went home stable about a week after admission.")
+    assert result.verification_status == UNVERIFIED
+
+
+def test_unquoted_verbatim_evidence_is_verified():
+    result = verify("Biopsy confirmed osteosarcoma of the left femur.")
+    assert result.verification_status == VERIFIED
+
+
+def test_elided_quote():
+    result = verify('"Admission date: 03/01/2024 ... discharged home in stable condition"')
+    assert result.verification_status == VERIFIED
+
+
+def test_no_text_layer_is_unverified():
+    result = verify('"Admission date: 03/01/2024"', pages=None)
+    assert result.verification_status == UNVERIFIED
+
+
+def test_hundreds_of_findings_over_a_thousand_pages():
+    rng = random.Random(7)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    pages = [" ".join(rng.choice(vocabulary) for _ in range(300)) for _ in range(1000)]
+    findings = []
+    for i in range(300):
+        page = rng.randrange(len(pages))
+        ws = pages[page].split()
+        start = rng.randrange(len(ws) - 20)
+        quote = " ".join(ws[start:start + 15]) if i % 3 else "never seen " * 5
+        findings.append(Finding(rule_id=f"R{i}", description="check", status="Pass", evidence=f'"{quote}"', file_name="big.pdf"))
+    target = UploadedFile(name="big.pdf", uri="files/big", type="target", content_hash="big-hash")
+    verifier = EvidenceVerifier(lambda f: pages)
+    assert verifier.prepare(target)
+
+    started = time.perf_counter()
+    results = verifier.verify(findings, [target])
+    elapsed = time.perf_counter() - started
+
+    statuses = [r.verification_status for r in results]
+    assert statuses.count(VERIFIED) == 200
+    assert statuses.count(HALLUCINATION) == 100
+    assert elapsed < 2.0, f"verifying 300 findings took {elapsed:.2f}s"
@@ -0,0 +1,61 @@
+import pytest
+from backend.icd10_index import Icd10Index, normalize
+
+index = Icd10Index.open_default()
+pytestmark = pytest.mark.skipif(index is None, reason="ICD-10 index not built")
+
+
+def status(code):
+    return index.check(code).status
+
+
+def test_normalize():
+    assert normalize("c412") == "C41.2"
+    assert normalize("C41.2-") == "C41.2"
+    assert normalize("D05.-") == "D05"
+
+
+def test_listed_codes():
+    assert status("C41.2") == "valid"
+    assert status("C50.9") == "incomplete" # listed as C50.9-
+
+
+def test_extensions_of_dashed_codes():
+    # Any depth below a dashed entry is a completion, with the extension unchecked
+    for code in ("C50.91", "C50.911", "C50.912", "D05.11"):
+        check = index.check(code)
+        assert check.status == "valid", code
+        assert "extension not checked" in check.detail
+
+
+def test_category_prefixes():
+    for code in ("C44", "C44.5", "C44.50", "C50"):
+        assert status(code) == "incomplete", code
+
+
+def test_misses():
+    assert status("C41.5") == "invalid"
+    assert status("C41.21") == "invalid" # C41.2 is complete, nothing extends it
+    assert status("E11.9") == "not_covered"
+
+
+def test_check_text():
+    checks = index.check_text("Coded C50.911 and C44.5; also C41.5. Diabetes E11.9, again C50.911.")
+    assert [(c.code, c.status) for c in checks] == [
+        ("C50.911", "valid"), ("C44.5", "incomplete"), ("C41.5", "invalid"), ("E11.9", "not_covered")
+    ]
+
+
+def test_check_text_skips_codelike_tokens():
+    # Three characters and no code context: a room, an ID, not a diagnosis
+    assert index.check_text("Seen in Room D12 by the oncology team.") == []
+    assert index.check_text("Patient ID C34 transferred.") == []
+
+
+def test_check_text_code_context():
+    codes = lambda text: [c.code for c in index.check_text(text)]
+    assert codes("ICD-10: C34, C50 and D12") == ["C34", "C50", "D12"]
+    assert codes("dx C34") == ["C34"]
+    assert codes("Diagnosis code D12; follow-up in room 4") == ["D12"]
+    # A complete code in the table needs no keyword
+    assert codes("Treated for C61 last year") == ["C61"]
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from types import SimpleNamespace
+from backend import jobs
+from backend.jobs import AuditWorkerPool, JobStore
+from backend.models import ChatRequest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(jobs, "time", SimpleNamespace(time=lambda: now[0], monotonic=time.monotonic))
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def enqueue(store, session_id="s1", user_id="u1"):
+    return store.enqueue(user_id, ChatRequest(message="audit", session_id=session_id))
+
+
+def test_claims_are_exclusive(store, clock):
+    first, second = enqueue(store, "s1"), enqueue(store, "s2")
+    job, request = store.claim("w1")
+    assert (job.job_id, job.status, job.attempts, request.session_id) == (first.job_id, "running", 1, "s1")
+    assert store.claim("w2")[0].job_id == second.job_id
+    assert store.claim("w3") is None
+
+
+def test_concurrent_claims_never_share_a_job(store):
+    queued = {enqueue(store, f"s{i}").job_id for i in range(3)}
+    claimed, lock = [], threading.Lock()
+
+    def worker(n):
+        result = store.claim(f"w{n}")
+        if result:
+            with lock:
+                claimed.append(result[0].job_id)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == sorted(queued)
+
+
+def test_expired_lease_is_reclaimed(store, clock):
+    job = enqueue(store)
+    store.claim("w1")
+    clock[0] += jobs.AUDIT_JOB_LEASE + 1
+    reclaimed, _ = store.claim("w2")
+    assert reclaimed.job_id == job.job_id and reclaimed.attempts == 2
+    # The first worker lost it: it can neither renew nor record a result
+    assert not store.renew(job.job_id, "w1")
+    assert not store.finish(job.job_id, "w1", {"final_response": "late"})
+    assert store.finish(job.job_id, "w2", {"final_response": "report"})
+    assert store.get(job.job_id).status == "succeeded"
+
+
+def test_renewed_lease_is_kept(store, clock):
+    job = enqueue(store)
+    store.claim("w1")
+    clock[0] += jobs.AUDIT_JOB_LEASE * 0.9
+    assert store.renew(job.job_id, "w1")
+    clock[0] += jobs.AUDIT_JOB_LEASE * 0.5
+    assert store.claim("w2") is None
+
+
+def test_jobs_that_keep_losing_workers_fail(store, clock):
+    job = enqueue(store)
+    for n in range(jobs.AUDIT_JOB_MAX_ATTEMPTS):
+        assert store.claim(f"w{n}")[0].job_id == job.job_id
+        clock[0] += jobs.AUDIT_JOB_LEASE + 1
+    assert store.claim("next") is None
+    failed = store.get(job.job_id)
+    assert failed.status == "failed" and "Worker lost" in failed.error
+
+
+def test_requeue_only_finished_jobs(store, clock):
+    job = enqueue(store)
+    store.claim("w1")
+    assert not store.requeue(job.job_id)
+    store.finish(job.job_id, "w1", error="model unavailable")
+    assert store.requeue(job.job_id)
+    requeued = store.get(job.job_id)
+    assert (requeued.status, requeued.attempts, requeued.error) == ("queued", 0, None)
+    assert store.events(job.job_id)[-1][1] == {"step": "job", "status": "resumed"}
+
+
+def test_events_resume_after_an_id(store):
+    job = enqueue(store)
+    store.append_events(job.job_id, [{"step": "strategist", "status": "running"}, {"step": "strategist", "status": "completed"}])
+    store.append_events(job.job_id, [{"step": "final", "content": "report"}])
+    events = store.events(job.job_id)
+    assert [e["step"] for _, e in events] == ["strategist", "strategist", "final"]
+    ids = [event_id for event_id, _ in events]
+    assert ids == sorted(ids)
+    assert store.events(job.job_id, after=ids[1]) == [events[2]]
+
+
+def test_event_stream_replays_after_last_event_id():
+    from fastapi.testclient import TestClient
+    import backend.main as main
+
+    job = enqueue(main.job_store)
+    main.job_store.claim("w1")
+    main.job_store.append_events(job.job_id, [{"step": "auditor", "status": "completed"}, {"step": "final", "content": "report"}])
+    main.job_store.finish(job.job_id, "w1", {"final_response": "report"})
+    first_id = main.job_store.events(job.job_id)[0][0]
+
+    main.app.dependency_overrides[main.get_current_user_id] = lambda: "u1"
+    try:
+        # Not entered as a context manager: no startup, so no workers
+        client = TestClient(main.app)
+        body = client.get(f"/audits/{job.job_id}/events", headers={"Last-Event-ID": str(first_id)}).text
+        data = [json.loads(line[6:]) for line in body.splitlines() if line.startswith("data: {")]
+        assert data == [{"step": "final", "content": "report"}, {"step": "job", "status": "succeeded", "error": None}]
+        assert f"id: {first_id}\n" not in body
+        # Someone else's job doesn't exist for them
+        main.app.dependency_overrides[main.get_current_user_id] = lambda: "u2"
+        assert client.get(f"/audits/{job.job_id}/events").status_code == 404
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+# --- Worker pool ---
+
+def runner_from(steps, delay=0.0, started=None):
+    async def runner(request, user_id):
+        if started is not None:
+            started.set()
+        for step in steps:
+            await asyncio.sleep(delay)
+            yield step
+    return runner
+
+
+async def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+@pytest.mark.anyio
+async def test_pool_runs_jobs_and_stores_events(store, monkeypatch):
+    monkeypatch.setattr(jobs, "AUDIT_JOB_POLL_INTERVAL", 0.05)
+    steps = [{"step": "verifier", "status": "completed", "metrics": {"calls": 1}}, {"step": "final", "content": "report"}]
+    pool = AuditWorkerPool(store, runner_from(steps), workers=2)
+    job = enqueue(store)
+    pool.start()
+    try:
+        await wait_until(lambda: store.get(job.job_id).status == "succeeded")
+    finally:
+        await pool.stop()
+    assert store.result(job.job_id) == {"final_response": "report", "metrics": {"verifier": {"calls": 1}}}
+    assert [e for _, e in store.events(job.job_id)] == steps
+
+
+@pytest.mark.anyio
+async def test_heartbeat_keeps_a_long_job(store, monkeypatch):
+    monkeypatch.setattr(jobs, "AUDIT_JOB_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(jobs, "AUDIT_JOB_LEASE", 0.3)
+    pool = AuditWorkerPool(store, runner_from([{"step": "final", "content": "report"}] * 5, delay=0.2), workers=1)
+    job = enqueue(store)
+    pool.start()
+    try:
+        await wait_until(lambda: store.get(job.job_id).status == "running")
+        # Well past the first lease: still renewed, so nobody else can take it
+        await asyncio.sleep(0.6)
+        assert await asyncio.to_thread(store.claim, "other") is None
+        await wait_until(lambda: store.get(job.job_id).status == "succeeded")
+    finally:
+        await pool.stop()
+    assert store.get(job.job_id).attempts == 1
+
+
+@pytest.mark.anyio
+async def test_lost_lease_stops_the_run(store, monkeypatch):
+    monkeypatch.setattr(jobs, "AUDIT_JOB_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(jobs, "AUDIT_JOB_LEASE", 0.3)
+    started = asyncio.Event()
+    pool = AuditWorkerPool(store, runner_from([{"step": "final", "content": "late"}], delay=5, started=started), workers=1)
+    job = enqueue(store)
+    pool.start()
+    try:
+        await asyncio.wait_for(started.wait(), 5)
+        # Another worker took the job over (e.g. this one stalled past its lease)
+        with store._connect() as conn:
+            conn.execute("update jobs set worker_id = 'other' where job_id = ?", (job.job_id,))
+        await wait_until(lambda: not pool._running)
+    finally:
+        await pool.stop()
+    after = store.get(job.job_id)
+    assert after.status == "running" and store.result(job.job_id) is None
+
+
+@pytest.mark.anyio
+async def test_stopping_hands_the_job_back(store, monkeypatch):
+    monkeypatch.setattr(jobs, "AUDIT_JOB_POLL_INTERVAL", 0.05)
+    started = asyncio.Event()
+    pool = AuditWorkerPool(store, runner_from([{"step": "final", "content": "report"}], delay=5, started=started), workers=1)
+    job = enqueue(store)
+    pool.start()
+    await asyncio.wait_for(started.wait(), 5)
+    await pool.stop()
+    released = store.get(job.job_id)
+    assert (released.status, released.attempts) == ("queued", 0)
@@ -0,0 +1,27 @@
+from backend.models import AuditRule, UploadedFile
+from backend.rule_cache import RuleCache, normalize_intent
+
+REFERENCES = [UploadedFile(name="policy.pdf", uri="files/policy", type="reference", content_hash="policy-hash")]
+RULES = [AuditRule(rule_id="R1", description="Discharge follows admission", severity="High")]
+
+
+def test_normalize_intent_drops_filler_only():
+    assert normalize_intent("Please check that the discharge date is after the admission date") == \
+        normalize_intent("check discharge date after admission date")
+
+
+def test_reordered_requests_do_not_collide():
+    a = "check that discharge date is after admission date"
+    b = "check that admission date is after discharge date"
+    assert normalize_intent(a) != normalize_intent(b)
+    assert RuleCache.key("Medical", a, REFERENCES) != RuleCache.key("Medical", b, REFERENCES)
+
+    cache = RuleCache()
+    cache.put("Medical", a, REFERENCES, RULES)
+    assert cache.get("Medical", a, REFERENCES) == RULES
+    assert cache.get("Medical", b, REFERENCES) is None
+
+
+def test_references_without_hash_are_not_cached():
+    unhashed = [UploadedFile(name="policy.pdf", uri="", type="reference")]
+    assert RuleCache.key("Medical", "check dates", unhashed) is None
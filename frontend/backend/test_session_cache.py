@@ -0,0 +1,145 @@
+import pytest
+from backend import session_cache as session_cache_module
+from backend.models import UploadedFile
+from backend.session_cache import SessionCache
+
+
+class FakeRow:
+    """One session row: counts loads, version reads and writes the cache makes."""
+
+    def __init__(self):
+        self.details = {"reference": [UploadedFile(name="ref.pdf", uri="files/ref", type="reference")], "target": [], "summary": None}
+        self.version = "v1"
+        self.loads = 0
+        self.version_reads = 0
+        self.writes = []
+        self.fail_writes = 0
+
+    def loader(self):
+        self.loads += 1
+        return dict(self.details), self.version, "u1"
+
+    def version_of(self):
+        self.version_reads += 1
+        return self.version
+
+    def writer(self, session_id, data, user_id, version):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise ConnectionError("db unavailable")
+        if version != self.version:
+            return False
+        self.writes.append(data)
+        self.details.update(data)
+        self.version = f"v{len(self.writes) + 1}"
+        return True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_cache(row):
+    # A long flush interval: the tests flush explicitly
+    return SessionCache(row.writer, ttl=10, max_entries=4, flush_interval=3600)
+
+
+def get(cache, row, user_id="u1"):
+    return cache.get("s1", user_id, row.loader, row.version_of)
+
+
+def test_reads_within_ttl_are_served_from_memory(clock):
+    row = FakeRow()
+    cache = make_cache(row)
+    assert get(cache, row)["reference"][0].name == "ref.pdf"
+    clock[0] += 5
+    details = get(cache, row)
+    assert (row.loads, row.version_reads, cache.hits) == (1, 0, 1)
+    # Callers get copies
+    details["reference"].clear()
+    assert len(get(cache, row)["reference"]) == 1
+
+
+def test_other_users_never_hit(clock):
+    row = FakeRow()
+    cache = make_cache(row)
+    get(cache, row)
+    get(cache, row, user_id="u2")
+    assert row.loads == 2
+
+
+def test_expired_entries_are_revalidated_by_version(clock):
+    row = FakeRow()
+    cache = make_cache(row)
+    get(cache, row)
+    clock[0] += 11
+    get(cache, row)
+    assert (row.loads, row.version_reads, cache.revalidations) == (1, 1, 1)
+
+    # Changed by another worker: reloaded
+    clock[0] += 11
+    row.details = {**row.details, "summary": "from elsewhere"}
+    row.version = "v9"
+    assert get(cache, row)["summary"] == "from elsewhere"
+    assert row.loads == 2
+
+
+def test_deferred_writes_coalesce(clock):
+    row = FakeRow()
+    cache = make_cache(row)
+    get(cache, row)
+    cache.queue_write("s1", {"summary": "first"}, "u1", row.version)
+    cache.queue_write("s1", {"summary": "second"}, "u1", row.version)
+    # Applied locally before the flush
+    assert get(cache, row)["summary"] == "second"
+    cache.flush("s1")
+    assert row.writes == [{"summary": "second"}]
+    assert cache.pending_writes() == 0
+
+
+def test_stale_deferred_write_is_dropped(clock):
+    row = FakeRow()
+    cache = make_cache(row)
+    get(cache, row)
+    cache.queue_write("s1", {"summary": "ours"}, "u1", row.version)
+    # Another worker writes the row before the flush
+    row.details = {**row.details, "summary": "theirs"}
+    row.version = "v9"
+    cache.flush("s1")
+    assert row.writes == []
+    assert cache.stale_writes == 1
+    # The dropped value isn't served from memory
+    assert get(cache, row)["summary"] == "theirs"
+
+
+def test_failed_deferred_write_is_retried(clock):
+    row = FakeRow()
+    cache = make_cache(row)
+    get(cache, row)
+    row.fail_writes = 1
+    cache.queue_write("s1", {"summary": "report"}, "u1", row.version)
+    cache.flush("s1")
+    assert row.writes == [] and cache.pending_writes() == 1
+    cache.flush("s1")
+    assert row.writes == [{"summary": "report"}] and cache.pending_writes() == 0
+
+
+def test_summary_is_written_directly():
+    from bench.fake_supabase import InMemorySupabase
+    from backend.file_manager import FileManager
+
+    manager = FileManager()
+    manager.db = InMemorySupabase()
+    target = UploadedFile(name="t.pdf", uri="", local_path="/tmp/t.pdf", type="target", status="pending")
+    manager.add_files_to_session("s1", {"target": [target]}, "u1")
+    manager.get_session_details("s1", user_id="u1")
+    before = manager.db.round_trips
+    manager.update_session_summary("s1", "# Audit Report", user_id="u1")
+    # One upsert, nothing left to a later flush that a concurrent file update could make stale
+    assert manager.db.round_trips - before == 1
+    assert manager.session_cache.pending_writes() == 0
+    manager.update_file_status("s1", target.model_copy(update={"uri": "files/t", "status": "uploaded"}), "target", user_id="u1")
+    assert manager.db._session("s1")["summary"] == "# Audit Report"
@@ -0,0 +1,270 @@
+import time
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from bench.fake_supabase import InMemorySupabase
+from backend.session_store import SessionStore, decode_cursor, encode_cursor, file_key
+
+
+class PostgresClient:
+    """
+    The slice of the supabase client SessionStore uses on a migrated database, on a psycopg2
+    connection: rpc(fn, params) calls the session_* SQL functions, table().select().eq() reads.
+    Results look like PostgREST's: timestamps as ISO strings, scalar function results unwrapped.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _query(self, sql, values=None):
+        from psycopg2.extras import RealDictCursor
+
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql, values)
+            return [{k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()} for row in cur.fetchall()]
+
+    def rpc(self, fn, params):
+        from psycopg2.extras import Json
+
+        args = ", ".join(f"{name} => %({name})s" for name in params)
+        values = {name: Json(v) if isinstance(v, (dict, list)) else v for name, v in params.items()}
+
+        def execute():
+            rows = self._query(f"select * from {fn}({args})", values)
+            if len(rows) == 1 and list(rows[0]) == [fn]:
+                return SimpleNamespace(data=rows[0][fn])
+            return SimpleNamespace(data=rows)
+        return SimpleNamespace(execute=execute)
+
+    def table(self, name):
+        client, filters, columns = self, [], ["*"]
+
+        class Select:
+            def select(self, cols):
+                columns[0] = cols
+                return self
+
+            def eq(self, column, value):
+                filters.append((column, value))
+                return self
+
+            def execute(self):
+                where = " and ".join(f"{column} = %s" for column, _ in filters) or "true"
+                rows = client._query(f"select {columns[0]} from {name} where {where}", [v for _, v in filters])
+                return SimpleNamespace(data=rows)
+        return Select()
+
+    def row(self, session_id):
+        rows = self._query("select * from sessions where session_id = %s", (session_id,))
+        return rows[0] if rows else None
+
+
+class FakeClient(InMemorySupabase):
+    def row(self, session_id):
+        return self._session(session_id)
+
+
+class NotMigrated(FakeClient):
+    """A database without the session_* functions: every rpc fails with PGRST202."""
+
+    def __init__(self):
+        super().__init__()
+        self.rpc_calls = 0
+
+    def rpc(self, fn, params):
+        self.rpc_calls += 1
+        return super().rpc(f"missing_{fn}", params)
+
+
+@pytest.fixture(params=["postgres", "fake", "fallback"])
+def db(request):
+    """The same behaviour from the SQL functions, their in-memory copies, and the fallback queries."""
+    if request.param == "postgres":
+        return PostgresClient(request.getfixturevalue("postgres"))
+    return FakeClient() if request.param == "fake" else NotMigrated()
+
+
+def pending(name, path):
+    return {"name": name, "uri": "", "local_path": path, "type": "target", "status": "pending"}
+
+
+def uploaded(name, uri, path=None):
+    return {"name": name, "uri": uri, "local_path": path, "type": "target", "status": "uploaded"}
+
+
+def test_file_key():
+    assert file_key(uploaded("a", "files/a", "/tmp/a")) == "files/a"
+    assert file_key(pending("a", "/tmp/a")) == "/tmp/a"
+
+
+def test_append_merges_by_uri_then_local_path(db):
+    store = SessionStore()
+    store.append_file_sets(db, "s1", {"target": [uploaded("a.pdf", "files/a"), pending("b.pdf", "/tmp/b")]}, "u1")
+    store.append_file_sets(db, "s1", {"target": [
+        uploaded("renamed.pdf", "files/a"), # same uri
+        pending("b-again.pdf", "/tmp/b"), # same pending path
+        pending("c.pdf", "/tmp/c"),
+    ], "reference": [uploaded("ref.pdf", "files/ref")]}, "u1")
+    files = store.get_files(db, "s1", "u1")
+    assert [f["name"] for f in files["target"]] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert [f["name"] for f in files["reference"]] == ["ref.pdf"]
+
+
+def test_append_ignores_other_users(db):
+    store = SessionStore()
+    store.append_file_sets(db, "s1", {"target": [uploaded("a.pdf", "files/a")]}, "u1")
+    store.append_file_sets(db, "s1", {"target": [uploaded("x.pdf", "files/x")]}, "u2")
+    assert [f["name"] for f in store.get_files(db, "s1")["target"]] == ["a.pdf"]
+
+
+def test_patch_file_replaces_in_place(db):
+    store = SessionStore()
+    store.append_file_sets(db, "s1", {"target": [pending("a.pdf", "/tmp/a"), pending("b.pdf", "/tmp/b")]}, "u1")
+    before = db.row("s1")["updated_at"]
+    time.sleep(0.01)
+    store.patch_file(db, "s1", "target", uploaded("a.pdf", "files/a", "/tmp/a"), "u1")
+    target = store.get_files(db, "s1", "u1")["target"]
+    assert [(f["name"], f["status"]) for f in target] == [("a.pdf", "uploaded"), ("b.pdf", "pending")]
+    assert db.row("s1")["updated_at"] > before
+    # Someone else's session is left alone
+    store.patch_file(db, "s1", "target", uploaded("b.pdf", "files/b", "/tmp/b"), "u2")
+    assert store.get_file_statuses(db, "s1", "u1") == ["uploaded", "pending"]
+
+
+def test_abandoned_uploads_read_as_failed(db):
+    store = SessionStore()
+    now = time.time()
+    files = [pending("fresh.pdf", "/tmp/fresh"), pending("stale.pdf", "/tmp/stale"), pending("old.pdf", "/tmp/old")]
+    files[0]["pending_since"], files[1]["pending_since"] = now - 5, now - 700
+    store.append_file_sets(db, "s1", {"target": files}, "u1")
+    # Records from before pending_since was stored can't be judged: still pending
+    assert store.get_file_statuses(db, "s1", "u1", stale_after=600) == ["pending", "failed", "pending"]
+    assert store.get_file_statuses(db, "s1", "u1") == ["pending"] * 3
+    assert store.get_file_statuses(db, "s1", "u2", stale_after=600) == []
+
+
+def test_upsert_only_touches_given_columns(db):
+    store = SessionStore()
+    store.append_file_sets(db, "s1", {"target": [uploaded("a.pdf", "files/a")]}, "u1")
+    store.upsert(db, "s1", {"summary": "report"}, "u1")
+    assert store.get_summary(db, "s1", "u1") == "report"
+    assert len(store.get_files(db, "s1", "u1")["target"]) == 1
+
+
+def test_upsert_if_unchanged(db):
+    store = SessionStore()
+    # None: only if there is no row yet
+    assert store.upsert_if_unchanged(db, "s1", {"summary": "first"}, None, "u1")
+    assert not store.upsert_if_unchanged(db, "s1", {"summary": "again"}, None, "u1")
+
+    version = store.get_version(db, "s1", "u1")
+    time.sleep(0.01)
+    assert store.upsert_if_unchanged(db, "s1", {"summary": "second"}, version, "u1")
+    assert store.get_summary(db, "s1", "u1") == "second"
+    # The write moved the version on: the old one is stale now
+    assert store.get_version(db, "s1", "u1") != version
+    assert not store.upsert_if_unchanged(db, "s1", {"summary": "late"}, version, "u1")
+    assert store.get_summary(db, "s1", "u1") == "second"
+    # Not the owner
+    current = store.get_version(db, "s1", "u1")
+    assert not store.upsert_if_unchanged(db, "s1", {"summary": "theirs"}, current, "u2")
+
+
+def test_missing_functions_fall_back_once():
+    client = NotMigrated()
+    store = SessionStore()
+    store.append_file_sets(client, "s1", {"target": [pending("a.pdf", "/tmp/a")]}, "u1")
+    store.append_file_sets(client, "s1", {"target": [pending("b.pdf", "/tmp/b")]}, "u1")
+    store.patch_file(client, "s1", "target", uploaded("a.pdf", "files/a", "/tmp/a"), "u1")
+    assert store.missing_functions == {"session_append_file_sets", "session_patch_file"}
+    # Each missing function is tried once, later calls go straight to the fallback
+    assert client.rpc_calls == 2
+    assert store.get_file_statuses(client, "s1", "u1") == ["uploaded", "pending"]
+
+
+def test_updated_at_trigger(postgres):
+    store = SessionStore()
+    db = PostgresClient(postgres)
+    store.upsert(db, "s1", {"summary": "report"}, "u1")
+    before = db.row("s1")["updated_at"]
+    time.sleep(0.01)
+    # A plain update that doesn't set updated_at still moves it
+    with postgres.cursor() as cur:
+        cur.execute("update sessions set history = '[{\"role\": \"user\"}]'::jsonb where session_id = 's1'")
+    assert db.row("s1")["updated_at"] > before
+
+
+# --- Listing ---
+
+def seed(db, rows):
+    """Inserts listing rows as they are, updated_at included (ties on purpose)."""
+    if isinstance(db, PostgresClient):
+        with db.conn.cursor() as cur:
+            for row in rows:
+                cur.execute(
+                    "insert into sessions (session_id, user_id, summary, updated_at) values (%(session_id)s, %(user_id)s, %(summary)s, %(updated_at)s)",
+                    {"summary": None, **row},
+                )
+    else:
+        for row in rows:
+            db.tables.setdefault("sessions", []).append(db._new_row("sessions", row))
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("2026-01-01T00:00:00+00:00", "s/1")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == ("2026-01-01T00:00:00+00:00", "s/1")
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor("only", "x")[:-3], "WzEsIDJd", "eyJhIjogMX0"])
+def test_bad_cursors(cursor):
+    # Garbage, truncated, [1, 2] (not strings), {"a": 1} (not a pair)
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_keyset_pages_through_tied_timestamps(db):
+    tied = "2026-05-01T12:00:00+00:00"
+    seed(db, [{"session_id": f"s{i}", "user_id": "u1", "updated_at": tied} for i in range(7)]
+         + [{"session_id": "newest", "user_id": "u1", "updated_at": "2026-05-02T12:00:00+00:00"},
+            {"session_id": "oldest", "user_id": "u1", "updated_at": "2026-04-01T12:00:00+00:00"},
+            {"session_id": "other", "user_id": "u2", "updated_at": tied}])
+    store = SessionStore()
+    seen, cursor = [], None
+    for _ in range(10):
+        page = store.list_sessions(db, "u1", limit=3, cursor=cursor)
+        seen += [item.session_id for item in page.items]
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    # Every session exactly once, newest first, ties broken by session_id descending
+    assert seen == ["newest", "s6", "s5", "s4", "s3", "s2", "s1", "s0", "oldest"]
+
+
+def test_outcome_column(db):
+    summaries = {
+        "pass": "# Audit Report\n- **Outcome**: PASS\n- **Summary**: fine",
+        "risk": "**Outcome:** Risk Detected\nmore text",
+        "emoji": "**Outcome**: ✅ FAIL (2 issues)",
+        "none": "No certificate in this report.",
+    }
+    store = SessionStore()
+    for session_id, summary in summaries.items():
+        store.upsert(db, session_id, {"summary": summary}, "u1")
+    outcomes = {item.session_id: item.outcome for item in store.list_sessions(db, "u1", limit=10).items}
+    assert outcomes == {"pass": "PASS", "risk": "RISK DETECTED", "emoji": "FAIL", "none": None}
+
+
+def test_listing_is_an_index_only_scan(postgres):
+    with postgres.cursor() as cur:
+        cur.execute(
+            "insert into sessions (session_id, user_id, target, summary, updated_at)"
+            " select 's' || g, 'u' || (g % 100), '[{\"name\": \"t.pdf\"}]'::jsonb,"
+            " '- **Outcome**: PASS ' || repeat('text ', 200), now() - (g || ' seconds')::interval"
+            " from generate_series(1, 20000) g"
+        )
+        cur.execute("vacuum analyze sessions")
+        cur.execute("explain (analyze, buffers, costs off, timing off, summary off) select * from session_list('u7', null, null, 21)")
+        plan = "\n".join(row[0] for row in cur.fetchall())
+    assert "Index Only Scan using sessions_user_updated_list_idx" in plan, plan
+    assert "Heap Fetches: 0" in plan, plan
@@ -0,0 +1,71 @@
+import pytest
+from google.genai import errors
+from backend import agents, model_calls as model_calls_module
+from backend.fake_gemini import FakeGeminiClient
+from backend.gemini_client import gemini_clients
+from backend.model_calls import CircuitOpenError, ModelCallLayer
+from backend.models import AuditRule, UploadedFile
+
+
+def quota_exhausted(model, contents, config):
+    raise errors.ClientError(429, {"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}})
+
+
+@pytest.fixture
+def always_429(monkeypatch):
+    client = FakeGeminiClient(responder=quota_exhausted)
+    gemini_clients.use(client)
+    monkeypatch.setattr(model_calls_module, "GEMINI_RETRY_BASE", 0.0)
+    layer = ModelCallLayer(max_retries=2, breaker_threshold=3, breaker_cooldown=60)
+    monkeypatch.setattr(agents, "model_calls", layer)
+    yield client, layer
+    gemini_clients.use(None)
+
+
+def initial_state():
+    return {
+        "user_query": "check discharge dates",
+        "scenario": "Medical",
+        "chat_history": [],
+        "reference_files": [],
+        "target_files": [UploadedFile(name="record.pdf", uri="files/record", type="target")],
+        "run_id": None,
+        "messages": [],
+    }
+
+
+async def run_graph(state, started):
+    async for event in agents.app_graph.astream_events(state, version="v2"):
+        if event["event"] == "on_chain_start" and event["name"] in ("strategist", "auditor", "verifier"):
+            started.append(event["name"])
+
+
+def test_shard_rules_without_rules():
+    assert agents._shard_rules([], 2000) == []
+    rules = [AuditRule(rule_id="R1", description="Dates are present", severity="High")]
+    assert len(agents._shard_rules(rules, 2000)) == 1
+
+
+@pytest.mark.anyio
+async def test_rate_limited_strategist_fails_the_run(always_429):
+    client, layer = always_429
+    started = []
+    with pytest.raises(errors.ClientError):
+        await run_graph(initial_state(), started)
+    # One call plus two retries, then the failure surfaces
+    assert len(client.calls) == 3
+    assert layer.breaker.state == "open"
+    assert started == ["strategist"]
+
+    # With the breaker open the next run fails without calling the API, and still never audits
+    started.clear()
+    with pytest.raises(CircuitOpenError):
+        await run_graph(initial_state(), started)
+    assert len(client.calls) == 3
+    assert started == ["strategist"]
+
+
+@pytest.mark.anyio
+async def test_auditor_refuses_empty_rules():
+    with pytest.raises(ValueError):
+        await agents.auditor_agent({**initial_state(), "rules": []})
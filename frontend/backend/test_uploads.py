@@ -0,0 +1,137 @@
+import os
+import time
+import hashlib
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from backend.uploads import receive_upload, safe_filename
+
+BOUNDARY = "testboundary"
+
+
+def multipart(content: bytes, filename: str = "record.pdf", session_id: str = "s1") -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + (
+        f"\r\n--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="session_id"\r\n\r\n'
+        f"{session_id}\r\n--{BOUNDARY}--\r\n"
+    ).encode()
+
+
+def streamed_request(body: bytes, chunk_size: int = 1024, content_length: bool = True):
+    """A request whose body arrives in chunks; `sent` counts the chunks the handler pulled."""
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    sent = []
+
+    async def receive():
+        if len(sent) < len(chunks):
+            sent.append(1)
+            return {"type": "http.request", "body": chunks[len(sent) - 1], "more_body": len(sent) < len(chunks)}
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    return Request({"type": "http", "method": "POST", "path": "/upload/target", "headers": headers}, receive), sent
+
+
+def test_safe_filename():
+    assert safe_filename("../../etc/passwd") == "passwd"
+    assert safe_filename("..\\..\\boot.ini") == "boot.ini"
+    assert safe_filename("scan 01 (final).pdf") == "scan 01 (final).pdf"
+    assert safe_filename("..") == "upload"
+    assert safe_filename("a\x00b;rm -rf.pdf") == "a_b_rm -rf.pdf"
+
+
+@pytest.mark.anyio
+async def test_streams_file_part_to_disk(tmp_path):
+    content = os.urandom(300_000)
+    request, sent = streamed_request(multipart(content))
+    upload = await receive_upload(request, str(tmp_path), max_bytes=1_000_000)
+    assert upload.filename == "record.pdf"
+    assert upload.fields == {"session_id": "s1"}
+    assert upload.size == len(content)
+    assert upload.content_hash == hashlib.sha256(content).hexdigest()
+    with open(upload.path, "rb") as f:
+        assert f.read() == content
+
+
+@pytest.mark.anyio
+async def test_declared_oversize_is_refused_before_reading(tmp_path):
+    request, sent = streamed_request(multipart(os.urandom(200_000)))
+    with pytest.raises(HTTPException) as raised:
+        await receive_upload(request, str(tmp_path), max_bytes=100_000)
+    assert raised.value.status_code == 413
+    assert sent == []
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.anyio
+async def test_chunked_oversize_stops_at_the_limit(tmp_path):
+    request, sent = streamed_request(multipart(os.urandom(200_000)), content_length=False)
+    with pytest.raises(HTTPException) as raised:
+        await receive_upload(request, str(tmp_path), max_bytes=100_000)
+    assert raised.value.status_code == 413
+    # Refused within a chunk of the limit, the rest of the body is never read
+    assert len(sent) <= 100_000 // 1024 + 2
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.anyio
+async def test_missing_file_part(tmp_path):
+    body = (f"--{BOUNDARY}\r\n" 'Content-Disposition: form-data; name="session_id"\r\n\r\n' f"s1\r\n--{BOUNDARY}--\r\n").encode()
+    request, _ = streamed_request(body)
+    with pytest.raises(HTTPException) as raised:
+        await receive_upload(request, str(tmp_path))
+    assert raised.value.status_code == 422
+    assert os.listdir(tmp_path) == []
+
+
+def test_upload_endpoint_keeps_files_in_the_temp_dir():
+    from fastapi.testclient import TestClient
+    from bench.fake_supabase import InMemorySupabase
+    import backend.main as main
+
+    main.file_manager.db = InMemorySupabase()
+    main.app.dependency_overrides[main.get_current_user_id] = lambda: "u1"
+    try:
+        with TestClient(main.app) as client:
+            response = client.post(
+                "/upload/target",
+                files={"file": ("../../escape.pdf", b"%PDF-1.4 test", "application/pdf")},
+                data={"session_id": "../s2"},
+            )
+        assert response.status_code == 202, response.text
+        assert response.json()["name"] == "escape.pdf"
+        saved = main.file_manager.upload_cache.local_path(response.json()["content_hash"])
+        assert os.path.dirname(saved) == main.TEMP_DIR
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+@pytest.mark.anyio
+async def test_upload_wait_skips_abandoned_and_other_users_uploads(file_manager, monkeypatch):
+    monkeypatch.setattr(file_manager, "poll_upload_fallback", True)
+    record = file_manager.build_pending_file(__file__, "record.pdf", "target")
+    assert record.status == "pending" and record.pending_since is not None
+    file_manager.add_files_to_session("s1", {"target": [record]}, "u1")
+
+    # Pending in another worker: the owner waits for it until the timeout
+    started = time.monotonic()
+    await file_manager.wait_for_uploads("s1", "u1", timeout=0.5)
+    assert time.monotonic() - started >= 0.5
+    # Nobody else's audit waits on it
+    started = time.monotonic()
+    await file_manager.wait_for_uploads("s1", "u2", timeout=5)
+    assert time.monotonic() - started < 1
+
+    # Left pending past UPLOAD_PENDING_TIMEOUT (its worker died): failed, not waited for
+    row = file_manager.db._session("s1")
+    row["target"][0]["pending_since"] -= 3600
+    started = time.monotonic()
+    await file_manager.wait_for_uploads("s1", "u1", timeout=5)
+    assert time.monotonic() - started < 1
+    assert file_manager.get_session_file_statuses("s1", "u1") == ["failed"]
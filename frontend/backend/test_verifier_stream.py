@@ -0,0 +1,82 @@
+import asyncio
+import time
+import pytest
+from types import SimpleNamespace
+from backend import agents
+from backend.audit_pipeline import run_audit
+from backend.fake_gemini import FakeResponse, default_responder
+from backend.models import ChatRequest, UploadedFile
+
+REPORT = "# Audit Report\n\n" + "".join(f"- Finding {i}: rule checked against the record.\n" for i in range(20))
+
+
+def responder(model, contents, config):
+    schema = getattr(config, "response_schema", None)
+    if schema is None:
+        return FakeResponse(text=REPORT, output_tokens=len(REPORT) // 4)
+    return default_responder(model, contents, config)
+
+
+def request(session_id):
+    return ChatRequest(
+        message="check the record",
+        scenario=f"Streaming {session_id}",
+        session_id=session_id,
+        target_files=[UploadedFile(name="record.pdf", uri="files/record", type="target")],
+    )
+
+
+async def collect(session_id, file_manager):
+    return [event async for event in run_audit(request(session_id), "u1", file_manager)]
+
+
+@pytest.mark.anyio
+async def test_final_is_the_streamed_deltas(file_manager, fake_gemini):
+    fake_gemini.responder, fake_gemini.chunk_chars = responder, 7
+    events = await collect("stream-1", file_manager)
+    steps = [e["step"] for e in events]
+
+    deltas = [e["content"] for e in events if e["step"] == "final_delta"]
+    assert len(deltas) == -(-len(REPORT) // 7)
+    assert "".join(deltas) == REPORT
+    # Deltas arrive while the verifier runs, then the final event carries the same text
+    first, last = steps.index("final_delta"), len(steps) - 1 - steps[::-1].index("final_delta")
+    assert steps.index("verifier") < first
+    assert all(step == "final_delta" for step in steps[first:last + 1])
+    final = [e for e in events if e["step"] == "final"]
+    assert len(final) == 1 and final[0]["content"] == REPORT
+    assert steps.index("final") > last
+    # And the same report is the session's summary
+    assert file_manager.get_session_details("stream-1", user_id="u1")["summary"] == REPORT
+
+
+class StallingModels:
+    """Streams the first chunks of the report, then hangs."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def generate_content(self, *, model, contents, config=None):
+        return responder(model, contents, config)
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        async def stream():
+            for text in self.chunks:
+                yield FakeResponse(text=text)
+            await asyncio.sleep(30)
+        return stream()
+
+
+@pytest.mark.anyio
+async def test_verifier_deadline(file_manager, fake_gemini, monkeypatch):
+    fake_gemini.aio = SimpleNamespace(models=StallingModels(["# Audit", " Report\n"]))
+    monkeypatch.setattr(agents, "MODEL_CALL_TIMEOUT", 0.3)
+    started = time.perf_counter()
+    events = await collect("stream-2", file_manager)
+    assert time.perf_counter() - started < 5
+
+    # What was streamed before the deadline, then the error replaces it
+    assert [e["content"] for e in events if e["step"] == "final_delta"] == ["# Audit", " Report\n"]
+    final = [e for e in events if e["step"] == "final"]
+    assert len(final) == 1
+    assert final[0]["content"].startswith("Error generating final report: the model did not finish")
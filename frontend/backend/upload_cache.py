@@ -0,0 +1,144 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Gemini keeps uploaded files for 48h. Treat entries as stale a bit early so a
+# file doesn't expire in the middle of an audit that started with it.
+EXPIRY_MARGIN = timedelta(hours=1)
+DEFAULT_TTL = timedelta(hours=48)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    """Returns the sha256 hex digest of a local file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """
+    Persistent map of (content hash, mime type) -> Gemini file.
+    Lets identical bytes uploaded from different sessions share one remote file.
+    Backed by a local SQLite file, so every worker process on the host shares it
+    and each write touches only its own entry.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get(
+            "UPLOAD_CACHE_PATH",
+            os.path.join(tempfile.gettempdir(), "universal_audit_upload_cache.db")
+        )
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists uploads ("
+                " key text primary key,"
+                " uri text not null,"
+                " name text not null,"
+                " expires_at text not null)"
+            )
+            conn.execute(
+                "create table if not exists local_copies ("
+                " content_hash text primary key,"
+                " path text not null,"
+                " size integer not null,"
+                " mtime real not null)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps this safe to use from the upload threads.
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(content_hash: str, mime_type: str) -> str:
+        return f"{content_hash}:{mime_type}"
+
+    def get(self, content_hash: str, mime_type: str) -> Optional[dict]:
+        """Returns the cached entry if present and not (about to be) expired."""
+        key = self._key(content_hash, mime_type)
+        # The cache is only an optimisation, so failures are logged, not raised.
+        try:
+            with self._connect() as conn:
+                row = conn.execute("select uri, name, expires_at from uploads where key = ?", (key,)).fetchone()
+                if not row:
+                    return None
+                entry = {"uri": row[0], "name": row[1], "expires_at": row[2]}
+                expires_at = datetime.fromisoformat(entry["expires_at"])
+                if expires_at - EXPIRY_MARGIN <= datetime.now(timezone.utc):
+                    logger.info(f"Upload cache entry for {content_hash[:12]} expired.")
+                    conn.execute("delete from uploads where key = ? and expires_at = ?", (key, entry["expires_at"]))
+                    return None
+                return entry
+        except Exception as e:
+            logger.warning(f"Upload cache read failed {self.path}: {e}")
+            return None
+
+    def put(self, content_hash: str, mime_type: str, uri: str, name: str, expires_at: Optional[datetime] = None):
+        """Records the remote file that now holds these bytes."""
+        if expires_at is None:
+            expires_at = datetime.now(timezone.utc) + DEFAULT_TTL
+        elif expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "insert or replace into uploads (key, uri, name, expires_at) values (?, ?, ?, ?)",
+                    (self._key(content_hash, mime_type), uri, name, expires_at.isoformat())
+                )
+        except Exception as e:
+            logger.warning(f"Failed to persist upload cache {self.path}: {e}")
+
+    def evict(self, content_hash: str, mime_type: str):
+        """Drops an entry, e.g. when the remote file turned out to be deleted."""
+        try:
+            with self._connect() as conn:
+                conn.execute("delete from uploads where key = ?", (self._key(content_hash, mime_type),))
+        except Exception as e:
+            logger.warning(f"Failed to persist upload cache {self.path}: {e}")
+
+    def put_local(self, content_hash: str, path: str):
+        """Records where this host keeps a saved upload with these bytes."""
+        try:
+            stat = os.stat(path)
+            with self._connect() as conn:
+                conn.execute(
+                    "insert or replace into local_copies (content_hash, path, size, mtime) values (?, ?, ?, ?)",
+                    (content_hash, path, stat.st_size, stat.st_mtime)
+                )
+        except Exception as e:
+            logger.warning(f"Failed to record local copy of {content_hash[:12]}: {e}")
+
+    def local_path(self, content_hash: str) -> Optional[str]:
+        """The saved upload with these bytes on this host, None if gone or since overwritten."""
+        try:
+            with self._connect() as conn:
+                row = conn.execute("select path, size, mtime from local_copies where content_hash = ?", (content_hash,)).fetchone()
+        except Exception as e:
+            logger.warning(f"Upload cache read failed {self.path}: {e}")
+            return None
+        if not row:
+            return None
+        path, size, mtime = row
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # The same session and file name saves to the same path, so a later upload may have replaced the bytes
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return None
+        return path
@@ -0,0 +1,231 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Optional
+from fastapi import Request, HTTPException
+from python_multipart.multipart import MultipartParser, parse_options_header
+from backend.models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(250 * 1024 * 1024)))
+# Room for the multipart framing and the form fields on top of the file itself
+MAX_FORM_OVERHEAD = 64 * 1024
+# A file still pending after this long was abandoned (its worker died mid-upload): waiters treat it as failed
+UPLOAD_PENDING_TIMEOUT = float(os.environ.get("UPLOAD_PENDING_TIMEOUT", "600")) # seconds
+# How long registrations are collected before being written to Supabase together.
+REGISTRATION_BATCH_WINDOW = float(os.environ.get("REGISTRATION_BATCH_WINDOW", "0.05")) # seconds
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^\w.\- ()\[\]]+")
+
+
+def safe_filename(name: str, default: str = "upload") -> str:
+    """A client-supplied file name reduced to one harmless path component (no directories, no '..')."""
+    name = os.path.basename((name or "").replace("\\", "/"))
+    name = _UNSAFE_NAME_CHARS.sub("_", name).strip(" .")
+    return name[:200] or default
+
+
+@dataclass
+class StreamedUpload:
+    """A multipart upload written to disk as it arrived: the file part plus the form's text fields."""
+    path: str
+    filename: str # as sent by the client, not yet sanitized
+    content_hash: str # sha256 hex digest
+    size: int
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+
+
+async def receive_upload(request: Request, dest_dir: str, file_field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES) -> StreamedUpload:
+    """
+    Parses a multipart/form-data request body as it streams in, writing the `file_field` part to a
+    new file in dest_dir (hashing as it goes) and keeping the other parts as text fields.
+    Nothing is buffered beyond one network chunk: an oversized request is refused from its
+    Content-Length before the body is read, or with a 413 as soon as the file passes max_bytes.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    try:
+        declared = int(request.headers.get("content-length", ""))
+    except ValueError:
+        declared = None # chunked: checked as it streams
+    if declared is not None and declared > max_bytes + MAX_FORM_OVERHEAD:
+        raise _too_large(max_bytes)
+
+    fd, temp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload_")
+    buffer = os.fdopen(fd, "wb")
+    digest = hashlib.sha256()
+    fields: Dict[str, bytearray] = {}
+    state = {"headers": {}, "header": b"", "value": b"", "name": None, "is_file": False, "filename": None, "size": 0, "form": 0}
+    file_data: List[bytes] = [] # file bytes parsed from the current network chunk, written after it
+
+    def on_part_begin():
+        state.update(headers={}, name=None, is_file=False)
+
+    def on_header_field(data, start, end):
+        state["header"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header"].lower()] = state["value"]
+        state.update(header=b"", value=b"")
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        state["name"] = name
+        if name == file_field and b"filename" in disposition and state["filename"] is None:
+            state["is_file"] = True
+            state["filename"] = disposition[b"filename"].decode("utf-8", "replace")
+        elif b"filename" not in disposition:
+            fields.setdefault(name, bytearray())
+
+    def on_part_data(data, start, end):
+        if state["is_file"]:
+            state["size"] += end - start
+            if state["size"] > max_bytes:
+                raise _too_large(max_bytes)
+            chunk = bytes(data[start:end])
+            digest.update(chunk)
+            file_data.append(chunk)
+        elif state["name"] in fields:
+            state["form"] += end - start
+            if state["form"] > MAX_FORM_OVERHEAD:
+                raise HTTPException(status_code=413, detail="Form fields too large")
+            fields[state["name"]] += data[start:end]
+        # Anything else (extra files) is skipped without being kept
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    try:
+        with buffer:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if file_data:
+                    pending, file_data[:] = b"".join(file_data), []
+                    # Disk writes go to a worker thread so large files don't stall the event loop.
+                    await asyncio.to_thread(buffer.write, pending)
+            parser.finalize()
+        if state["filename"] is None:
+            raise HTTPException(status_code=422, detail=f"Missing file field '{file_field}'")
+    except HTTPException:
+        os.remove(temp_path)
+        raise
+    except Exception as e:
+        # Don't leave half-written files behind (client disconnects, malformed bodies).
+        os.remove(temp_path)
+        logger.warning(f"Upload aborted: {e!r}")
+        raise HTTPException(status_code=400, detail="Malformed or interrupted upload")
+
+    return StreamedUpload(
+        path=temp_path,
+        filename=state["filename"],
+        content_hash=digest.hexdigest(),
+        size=state["size"],
+        fields={name: bytes(value).decode("utf-8", "replace") for name, value in fields.items()},
+    )
+
+
+class RegistrationBatcher:
+    """
+    Collects file registrations arriving close together and writes each
+    (session, file type) group to the DB in one go instead of one write per file.
+    """
+
+    def __init__(self, file_manager, window: float = REGISTRATION_BATCH_WINDOW):
+        self.file_manager = file_manager
+        self.window = window
+        self._pending: Dict[Tuple[str, str, Optional[str]], List[Tuple[UploadedFile, asyncio.Future]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def register(self, session_id: str, file_obj: UploadedFile, file_type: str, user_id: str = None):
+        """Queues a file for registration and waits until its batch has been written."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault((session_id, file_type, user_id), []).append((file_obj, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        batches, self._pending = self._pending, {}
+        # Registrations arriving while this batch is written start a new window.
+        self._flush_task = None
+        await asyncio.gather(*(self._flush(key, items) for key, items in batches.items()))
+
+    async def _flush(self, key, items):
+        session_id, file_type, user_id = key
+        try:
+            await asyncio.to_thread(
+                self.file_manager.add_files_to_session,
+                session_id,
+                {file_type: [file_obj for file_obj, _ in items]},
+                user_id
+            )
+            logger.info(f"Registered {len(items)} {file_type} file(s) for session {session_id}")
+            for _, future in items:
+                future.set_result(None)
+        except Exception as e:
+            logger.error(f"Batched registration failed for session {session_id}: {e}")
+            for _, future in items:
+                future.set_exception(e)
+
+
+class UploadRegistry:
+    """
+    In-process registry of Gemini uploads still in flight, keyed by session and local path.
+    Uploads run in worker threads, so completion is signalled through
+    concurrent futures that async waiters can await.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, concurrent.futures.Future]] = {}
+
+    def track(self, session_id: str, file_key: str):
+        """Marks an upload as in flight."""
+        with self._lock:
+            self._pending.setdefault(session_id, {})[file_key] = concurrent.futures.Future()
+
+    def complete(self, session_id: str, file_key: str):
+        """Signals that an upload finished (successfully or not). Safe to call from any thread."""
+        with self._lock:
+            session = self._pending.get(session_id, {})
+            future = session.pop(file_key, None)
+            if not session:
+                self._pending.pop(session_id, None)
+        if future and not future.done():
+            future.set_result(None)
+
+    def pending_count(self, session_id: str) -> int:
+        with self._lock:
+            return len(self._pending.get(session_id, {}))
+
+    async def wait(self, session_id: str, timeout: float) -> bool:
+        """Waits for this process's uploads in a session. Returns False on timeout."""
+        with self._lock:
+            futures = list(self._pending.get(session_id, {}).values())
+        if not futures:
+            return True
+        _, not_done = await asyncio.wait([asyncio.wrap_future(f) for f in futures], timeout=timeout)
+        return not not_done
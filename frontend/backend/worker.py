@@ -0,0 +1,30 @@
+"""
+Standalone audit worker: runs queued audit jobs without serving HTTP, so
+workers can be scaled apart from API instances (set AUDIT_WORKERS=0 on those).
+
+    cd frontend
+    AUDIT_WORKERS=4 python -m backend.worker
+"""
+import asyncio
+import logging
+from backend.jobs import AuditWorkerPool, AUDIT_WORKERS
+from backend.main import job_store, file_manager
+from backend.audit_pipeline import run_audit
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    pool = AuditWorkerPool(job_store, lambda request, user_id: run_audit(request, user_id, file_manager), workers=max(1, AUDIT_WORKERS))
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Audit worker stopped.")
@@ -0,0 +1,103 @@
+import json
+import random
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from backend.models import AuditRule, Finding
+from backend.fake_gemini import FakeGeminiClient, FakeResponse, default_responder, _prompt_text
+
+
+@dataclass
+class LatencyProfile:
+    """Lognormal call latency: `median` seconds, spread `sigma` (0 = fixed)."""
+    median: float
+    sigma: float = 0.3
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        return rng.lognormvariate(0, self.sigma) * self.median
+
+
+# Rough medians for gemini-2.5-flash-lite, per agent. Override from the command line.
+DEFAULT_LATENCY = {
+    "strategist": LatencyProfile(1.2),
+    "auditor": LatencyProfile(2.5),
+    "verifier": LatencyProfile(1.5), # time to first chunk
+}
+
+
+@dataclass
+class ModelProfile:
+    """What the fake model answers and how long it takes."""
+    rules: int = 8                       # rules the strategist returns
+    latency: Dict[str, LatencyProfile] = field(default_factory=lambda: dict(DEFAULT_LATENCY))
+    latency_scale: float = 1.0           # multiplies every latency (0 = no waiting at all)
+    output_tokens_per_item: int = 60     # mean output tokens per rule/finding
+    report_tokens: int = 1500            # mean verifier report length
+    stream_chunk_chars: int = 200        # verifier stream chunk size (the API sends a few dozen tokens per chunk)
+    recorded: Optional[dict] = None      # {"strategist": [...rules], "auditor": [...findings], "verifier": "..."}
+    seed: int = 7
+
+
+def load_recorded(path: str) -> dict:
+    """Recorded responses captured from a real run (see the keys in ModelProfile.recorded)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _kind(config) -> str:
+    schema = getattr(config, "response_schema", None)
+    if schema == list[AuditRule]:
+        return "strategist"
+    if schema == list[Finding]:
+        return "auditor"
+    return "verifier"
+
+
+class BenchModel:
+    """Builds a FakeGeminiClient whose answers and latency follow a ModelProfile, deterministically per seed."""
+
+    def __init__(self, profile: ModelProfile):
+        self.profile = profile
+        self._rng = random.Random(profile.seed)
+        self._lock = threading.Lock()
+
+    def _tokens(self, mean: int) -> int:
+        with self._lock:
+            return max(1, int(self._rng.gauss(mean, mean * 0.25)))
+
+    def latency(self, model, contents, config) -> float:
+        profile = self.profile.latency.get(_kind(config))
+        if not profile or self.profile.latency_scale <= 0:
+            return 0.0
+        with self._lock:
+            return profile.sample(self._rng) * self.profile.latency_scale
+
+    def respond(self, model, contents, config) -> FakeResponse:
+        kind = _kind(config)
+        recorded = (self.profile.recorded or {}).get(kind)
+        prompt_tokens = len(_prompt_text(contents)) // 4 + 1
+
+        if kind == "strategist":
+            rules = [AuditRule(**r) for r in recorded] if recorded else [
+                AuditRule(rule_id=f"BENCH-{i:03d}", description=f"Benchmark compliance check #{i}: verify the documented value matches the reference.", severity=("High", "Medium", "Low")[i % 3])
+                for i in range(1, self.profile.rules + 1)
+            ]
+            return FakeResponse(text=json.dumps([r.model_dump() for r in rules]), parsed=rules,
+                                prompt_tokens=prompt_tokens, output_tokens=self._tokens(self.profile.output_tokens_per_item) * len(rules))
+
+        if kind == "auditor":
+            if recorded:
+                findings = [Finding(**f) for f in recorded]
+                return FakeResponse(text=json.dumps(recorded), parsed=findings, prompt_tokens=prompt_tokens,
+                                    output_tokens=self._tokens(self.profile.output_tokens_per_item) * len(findings))
+            return default_responder(model, contents, config)
+
+        text = recorded or ("# Audit Report\n\n" + "Finding text. " * (self._tokens(self.profile.report_tokens) // 3))
+        return FakeResponse(text=text, prompt_tokens=prompt_tokens, output_tokens=len(text) // 4 + 1)
+
+    def client(self) -> FakeGeminiClient:
+        return FakeGeminiClient(responder=self.respond, latency=self.latency, chunk_chars=self.profile.stream_chunk_chars)
@@ -0,0 +1,358 @@
+import re
+import copy
+import time
+import operator
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from postgrest.exceptions import APIError
+
+# Primary key per table, for upserts
+PRIMARY_KEYS = {"sessions": "session_id", "rule_cache": "cache_key"}
+# Same pattern as the generated `outcome` column in supabase_schema.sql
+OUTCOME_PATTERN = re.compile(r"\*\*Outcome:?\*\*:?[^A-Za-z\n]*([A-Za-z][A-Za-z ]*[A-Za-z])")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _file_key(f: dict):
+    # Mirrors session_file_key() in supabase_schema.sql
+    return f.get("uri") or f.get("local_path")
+
+
+# PostgREST filter operators used inside or_() strings
+_OPERATORS = {"eq": operator.eq, "neq": operator.ne, "lt": operator.lt, "lte": operator.le, "gt": operator.gt, "gte": operator.ge}
+
+
+def _split_filters(text: str) -> List[str]:
+    """Splits a PostgREST logical filter on its top-level commas (not inside parentheses or quotes)."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch in "()":
+            depth += 1 if ch == "(" else -1
+        elif not quoted and not depth and ch == ",":
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _filter(text: str):
+    """A row predicate for one condition: 'column.op.value', 'and(...)' or 'or(...)'."""
+    for prefix, combine in (("and(", all), ("or(", any)):
+        if text.startswith(prefix) and text.endswith(")"):
+            conditions = [_filter(c) for c in _split_filters(text[len(prefix):-1])]
+            return lambda row: combine(c(row) for c in conditions)
+    column, op, value = text.split(".", 2)
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    compare = _OPERATORS[op]
+    return lambda row: row.get(column) is not None and compare(row.get(column), value)
+
+
+class _Query:
+    """The slice of postgrest's query builder the backend uses, evaluated against in-memory rows."""
+
+    def __init__(self, db: "InMemorySupabase", table: str):
+        self.db = db
+        self.table = table
+        self.columns: Optional[List[str]] = None
+        self.filters = []
+        self.ordering = []
+        self.row_limit: Optional[int] = None
+        self.row_offset = 0
+        self.action = "select"
+        self.payload = None
+
+    # --- builders ---
+
+    def select(self, columns: str = "*", count=None):
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) <= value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, filters: str):
+        conditions = [_filter(c) for c in _split_filters(filters)]
+        self.filters.append(lambda row: any(c(row) for c in conditions))
+        return self
+
+    def order(self, column, desc: bool = False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, n: int):
+        self.row_limit = n
+        return self
+
+    def range(self, start: int, end: int):
+        self.row_offset = start
+        self.row_limit = end - start + 1
+        return self
+
+    def insert(self, payload):
+        self.action, self.payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self.action, self.payload = "update", payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = None):
+        self.action, self.payload = "upsert", payload
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    # --- execution ---
+
+    def _matches(self, row: dict) -> bool:
+        return all(f(row) for f in self.filters)
+
+    def _project(self, row: dict) -> dict:
+        if self.columns is None:
+            return copy.deepcopy(row)
+        return {c: copy.deepcopy(row.get(c)) for c in self.columns}
+
+    def execute(self):
+        self.db._round_trip()
+        with self.db._lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.action == "select":
+                selected = [r for r in rows if self._matches(r)]
+                for column, desc in reversed(self.ordering):
+                    selected.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+                selected = selected[self.row_offset:]
+                if self.row_limit is not None:
+                    selected = selected[:self.row_limit]
+                return SimpleNamespace(data=[self._project(r) for r in selected], count=None)
+
+            if self.action == "insert":
+                payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+                inserted = [self.db._new_row(self.table, p) for p in payloads]
+                rows.extend(inserted)
+                return SimpleNamespace(data=copy.deepcopy(inserted), count=None)
+
+            if self.action == "update":
+                updated = []
+                for row in rows:
+                    if self._matches(row):
+                        row.update(copy.deepcopy(self.payload))
+                        self.db._touch(self.table, row)
+                        updated.append(copy.deepcopy(row))
+                return SimpleNamespace(data=updated, count=None)
+
+            if self.action == "upsert":
+                payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+                pk = PRIMARY_KEYS.get(self.table, "id")
+                result = []
+                for p in payloads:
+                    existing = next((r for r in rows if r.get(pk) == p.get(pk)), None)
+                    if existing is None:
+                        existing = self.db._new_row(self.table, p)
+                        rows.append(existing)
+                    else:
+                        existing.update(copy.deepcopy(p))
+                        self.db._touch(self.table, existing)
+                    result.append(copy.deepcopy(existing))
+                return SimpleNamespace(data=result, count=None)
+
+            if self.action == "delete":
+                kept = [r for r in rows if not self._matches(r)]
+                deleted = [r for r in rows if self._matches(r)]
+                self.db.tables[self.table] = kept
+                return SimpleNamespace(data=copy.deepcopy(deleted), count=None)
+
+        raise ValueError(f"Unsupported action {self.action}")
+
+
+class _RpcCall:
+    def __init__(self, db: "InMemorySupabase", fn: str, params: dict):
+        self.db = db
+        self.fn = fn
+        self.params = params
+
+    def execute(self):
+        self.db._round_trip()
+        handler = getattr(self.db, f"_fn_{self.fn}", None)
+        if handler is None:
+            raise APIError({"code": "PGRST202", "message": f"Could not find the function public.{self.fn}"})
+        with self.db._lock:
+            return SimpleNamespace(data=handler(**copy.deepcopy(self.params)), count=None)
+
+
+class InMemorySupabase:
+    """
+    Stand-in for supabase.Client: the `sessions` and `rule_cache` tables and the
+    session_* SQL functions from supabase_schema.sql, held in memory.
+    `latency` (seconds) is slept on every round trip to mimic the network.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables: Dict[str, List[dict]] = {}
+        self.round_trips = 0
+        self._lock = threading.RLock()
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rpc(self, fn: str, params: dict) -> _RpcCall:
+        return _RpcCall(self, fn, params)
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_row(self, table: str, payload: dict) -> dict:
+        row = {}
+        if table == "sessions":
+            row = {"reference": [], "target": [], "summary": None, "history": [], "user_id": None,
+                   "created_at": _now(), "updated_at": _now()}
+        elif table == "rule_cache":
+            row = {"created_at": _now()}
+        row.update(copy.deepcopy(payload))
+        if table == "sessions":
+            self._generate(row)
+        return row
+
+    def _touch(self, table: str, row: dict):
+        if table == "sessions":
+            row["updated_at"] = _now()
+            self._generate(row)
+
+    @staticmethod
+    def _generate(row: dict):
+        # The generated columns of `sessions`
+        row["reference_count"] = len(row.get("reference") or [])
+        row["target_count"] = len(row.get("target") or [])
+        match = OUTCOME_PATTERN.search(row.get("summary") or "")
+        row["outcome"] = match.group(1)[:40].upper() if match else None
+
+    def _session(self, session_id: str) -> Optional[dict]:
+        return next((r for r in self.tables.setdefault("sessions", []) if r["session_id"] == session_id), None)
+
+    # --- session_* functions (same semantics as the SQL versions) ---
+
+    def _fn_session_append_file_sets(self, p_session_id, p_user_id, p_reference, p_target):
+        row = self._session(p_session_id)
+        if row is None:
+            self.tables["sessions"].append(self._new_row("sessions", {
+                "session_id": p_session_id, "user_id": p_user_id,
+                "reference": p_reference or [], "target": p_target or [],
+            }))
+            return None
+        if p_user_id is not None and row.get("user_id") != p_user_id:
+            return None
+        for column, incoming in (("reference", p_reference), ("target", p_target)):
+            known = {_file_key(f) for f in row[column]}
+            row[column] = row[column] + [f for f in incoming or [] if _file_key(f) not in known]
+        self._touch("sessions", row)
+        return None
+
+    def _fn_session_append_files(self, p_session_id, p_user_id, p_file_type, p_files):
+        return self._fn_session_append_file_sets(
+            p_session_id, p_user_id,
+            p_files if p_file_type == "reference" else [],
+            p_files if p_file_type == "target" else [],
+        )
+
+    def _fn_session_patch_file(self, p_session_id, p_user_id, p_file_type, p_file):
+        row = self._session(p_session_id)
+        if row is None or (p_user_id is not None and row.get("user_id") != p_user_id):
+            return None
+        row[p_file_type] = [p_file if f.get("local_path") == p_file.get("local_path") else f for f in row[p_file_type]]
+        self._touch("sessions", row)
+        return None
+
+    def _fn_session_upsert(self, p_session_id, p_user_id, p_data):
+        row = self._session(p_session_id)
+        if row is None:
+            self.tables["sessions"].append(self._new_row("sessions", {"session_id": p_session_id, "user_id": p_user_id, **p_data}))
+            return None
+        if p_user_id is not None and row.get("user_id") != p_user_id:
+            return None
+        for column in ("reference", "target", "summary", "history"):
+            if column in p_data:
+                row[column] = p_data[column]
+        self._touch("sessions", row)
+        return None
+
+    def _fn_session_upsert_if_unchanged(self, p_session_id, p_user_id, p_data, p_expected_updated_at):
+        row = self._session(p_session_id)
+        if p_expected_updated_at is None:
+            if row is not None:
+                return False
+            self._fn_session_upsert(p_session_id, p_user_id, p_data)
+            return True
+        if row is None or row["updated_at"] != p_expected_updated_at:
+            return False
+        if p_user_id is not None and row.get("user_id") != p_user_id:
+            return False
+        self._fn_session_upsert(p_session_id, p_user_id, p_data)
+        return True
+
+    def _fn_session_file_statuses(self, p_session_id, p_user_id, p_stale_after=None):
+        row = self._session(p_session_id)
+        if row is None or (p_user_id is not None and row.get("user_id") != p_user_id):
+            return []
+        stale_before = time.time() - p_stale_after if p_stale_after is not None else None
+        statuses = []
+        for f in (row.get("reference") or []) + (row.get("target") or []):
+            status = f.get("status") or "uploaded"
+            if status == "pending" and stale_before is not None and f.get("pending_since") is not None and f["pending_since"] < stale_before:
+                status = "failed"
+            statuses.append(status)
+        return statuses
+
+    def _fn_session_history_page(self, p_session_id, p_user_id, p_page, p_page_size):
+        row = self._session(p_session_id)
+        if row is None or (p_user_id is not None and row.get("user_id") != p_user_id):
+            return None
+        history = row.get("history") or []
+        end = max(0, len(history) - (p_page - 1) * p_page_size)
+        return {"total": len(history), "items": history[max(0, end - p_page_size):end]}
+
+    def _fn_session_list(self, p_user_id, p_after_updated_at, p_after_session_id, p_limit):
+        rows = [r for r in self.tables.setdefault("sessions", []) if r.get("user_id") == p_user_id]
+        if p_after_updated_at is not None:
+            after = (p_after_updated_at, p_after_session_id)
+            rows = [r for r in rows if (r["updated_at"], r["session_id"]) < after]
+        rows.sort(key=lambda r: (r["updated_at"], r["session_id"]), reverse=True)
+        columns = ("session_id", "reference_count", "target_count", "outcome", "created_at", "updated_at")
+        return [{c: r.get(c) for c in columns} for r in rows[:p_limit]]
@@ -0,0 +1,254 @@
+"""
+Offline benchmark for the audit pipeline: runs app_graph and/or the /chat/stream
+endpoint end to end against a fake Gemini client and an in-memory Supabase,
+sweeping target files x rules x concurrent sessions.
+
+    cd frontend
+    python -m bench.run --files 1,5,20 --rules 5,20 --sessions 1,8 --mode both
+
+Reports throughput, latency percentiles and memory per configuration. No network needed.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from typing import List
+
+# Backend modules read their configuration at import time
+_scratch = tempfile.mkdtemp(prefix="audit-bench-")
+os.environ["GEMINI_CLIENT"] = "fake"
+os.environ.setdefault("GEMINI_RPM", "0")
+os.environ.setdefault("GEMINI_TPM", "0")
+os.environ.setdefault("FINDINGS_STORE_PATH", os.path.join(_scratch, "findings.sqlite3"))
+os.environ.setdefault("UPLOAD_CACHE_PATH", os.path.join(_scratch, "upload_cache.db"))
+os.environ.setdefault("AUDIT_JOBS_PATH", os.path.join(_scratch, "jobs.sqlite3"))
+os.environ.setdefault("AUDIT_CHECKPOINTS_PATH", os.path.join(_scratch, "checkpoints.sqlite3"))
+os.environ.setdefault("REFERENCE_INDEX_DIR", os.path.join(_scratch, "reference_index"))
+
+import httpx
+from backend import agents
+from backend import main as api
+from backend.gemini_client import gemini_clients
+from backend.models import UploadedFile
+from bench.fake_model import BenchModel, ModelProfile, LatencyProfile, DEFAULT_LATENCY, load_recorded
+from bench.fake_supabase import InMemorySupabase
+
+logger = logging.getLogger("bench")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), int(round(pct / 100 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _files(kind: str, count: int, tag: str, pdf: str = None) -> List[UploadedFile]:
+    return [
+        UploadedFile(name=f"{kind}-{i}.pdf", uri=f"https://fake.local/v1beta/files/{tag}-{kind}-{i}", type=kind,
+                     local_path=pdf if kind == "target" else None, content_hash=f"{tag}-{kind}-{i}")
+        for i in range(count)
+    ]
+
+
+class Scenario:
+    def __init__(self, args, files: int, rules: int, sessions: int):
+        self.args = args
+        self.files = files
+        self.rules = rules
+        self.sessions = sessions
+
+    def request(self, index: int, round_no: int) -> dict:
+        # Cold runs use fresh file identities per audit so no cache can answer; warm runs share them
+        tag = "warm" if self.args.warm else f"r{round_no}-s{index}-{uuid.uuid4().hex[:8]}"
+        targets = _files("target", self.files, tag, self.args.target_pdf)
+        if self.args.target_pdf:
+            # The endpoint finds local copies by content hash, as it does for real uploads
+            for f in targets:
+                api.file_manager.upload_cache.put_local(f.content_hash, f.local_path)
+        return {
+            "message": "Audit the targets against the reference standard",
+            "scenario": "Medical",
+            "session_id": f"bench-{tag}-{index}",
+            "reference_files": _files("reference", self.args.references, tag),
+            "target_files": targets,
+        }
+
+
+async def _run_graph(request: dict) -> float:
+    started = time.perf_counter()
+    await agents.app_graph.ainvoke({
+        "user_query": request["message"],
+        "scenario": request["scenario"],
+        "chat_history": [],
+        "reference_files": request["reference_files"],
+        "target_files": request["target_files"],
+        "messages": [],
+    })
+    return time.perf_counter() - started
+
+
+async def _run_endpoint(client: httpx.AsyncClient, request: dict) -> float:
+    body = {**request,
+            "reference_files": [f.model_dump() for f in request["reference_files"]],
+            "target_files": [f.model_dump() for f in request["target_files"]]}
+    started = time.perf_counter()
+    response = await client.post("/chat/stream", json=body, headers={"Authorization": "Bearer bench"})
+    if response.status_code != 200 or '"step": "final"' not in response.text:
+        raise RuntimeError(f"chat_stream failed: {response.status_code} {response.text[-300:]}")
+    return time.perf_counter() - started
+
+
+async def run_scenario(scenario: Scenario, mode: str, model: BenchModel, db: InMemorySupabase) -> dict:
+    model.profile.rules = scenario.rules
+    fake = model.client()
+    gemini_clients.use(fake)
+    round_trips_before = db.round_trips
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(index: int, round_no: int) -> float:
+            request = scenario.request(index, round_no)
+            if mode == "graph":
+                return await _run_graph(request)
+            return await _run_endpoint(client, request)
+
+        if scenario.args.warm:
+            # Fill the caches once before measuring
+            await asyncio.gather(*(one(i, -1) for i in range(scenario.sessions)))
+            round_trips_before = db.round_trips
+            fake.calls.clear()
+
+        if scenario.args.tracemalloc:
+            tracemalloc.start()
+        latencies, failures = [], 0
+        wall_started = time.perf_counter()
+        for round_no in range(scenario.args.rounds):
+            results = await asyncio.gather(*(one(i, round_no) for i in range(scenario.sessions)), return_exceptions=True)
+            for r in results:
+                if isinstance(r, Exception):
+                    failures += 1
+                    logger.error(f"Audit failed: {r!r}")
+                else:
+                    latencies.append(r)
+        wall = time.perf_counter() - wall_started
+        traced_peak = None
+        if scenario.args.tracemalloc:
+            traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+
+    audits = len(latencies) + failures
+    return {
+        "mode": mode,
+        "files": scenario.files,
+        "rules": scenario.rules,
+        "sessions": scenario.sessions,
+        "audits": audits,
+        "failures": failures,
+        "throughput_per_s": round(len(latencies) / wall, 3) if wall else 0.0,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "model_calls_per_audit": round(len(fake.calls) / max(1, audits), 1),
+        "db_round_trips_per_audit": round((db.round_trips - round_trips_before) / max(1, audits), 1),
+        "peak_rss_mb": round(rss_mb(), 1),
+        "traced_peak_mb": round(traced_peak, 1) if traced_peak is not None else None,
+    }
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the audit pipeline.")
+    parser.add_argument("--mode", choices=["graph", "endpoint", "both"], default="both")
+    parser.add_argument("--files", type=_ints, default=[1, 5, 20], help="target files per audit (comma list)")
+    parser.add_argument("--rules", type=_ints, default=[8], help="rules returned by the strategist (comma list)")
+    parser.add_argument("--sessions", type=_ints, default=[1, 8], help="concurrent audits (comma list)")
+    parser.add_argument("--references", type=int, default=2, help="reference files per audit")
+    parser.add_argument("--rounds", type=int, default=3, help="measured rounds per configuration")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplies all model latencies; 0 = no waiting")
+    parser.add_argument("--strategist-ms", type=float, default=DEFAULT_LATENCY["strategist"].median * 1000)
+    parser.add_argument("--auditor-ms", type=float, default=DEFAULT_LATENCY["auditor"].median * 1000)
+    parser.add_argument("--verifier-ms", type=float, default=DEFAULT_LATENCY["verifier"].median * 1000)
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="lognormal spread of model latency")
+    parser.add_argument("--output-tokens", type=int, default=60, help="mean output tokens per rule/finding")
+    parser.add_argument("--report-tokens", type=int, default=1500, help="mean verifier report length")
+    parser.add_argument("--db-latency-ms", type=float, default=20, help="simulated Supabase round trip")
+    parser.add_argument("--recorded", help="JSON file of recorded responses (strategist/auditor/verifier)")
+    parser.add_argument("--target-pdf", help="local PDF attached to every target (exercises page windows)")
+    parser.add_argument("--warm", action="store_true", help="reuse the same files so caches are hit")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report traced Python heap peak (slower)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if not args.verbose:
+        # The backend logs every step at INFO; keep the report readable
+        logging.getLogger().setLevel(logging.WARNING)
+        for name in list(logging.root.manager.loggerDict):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    profile = ModelProfile(
+        latency={
+            "strategist": LatencyProfile(args.strategist_ms / 1000, args.latency_sigma),
+            "auditor": LatencyProfile(args.auditor_ms / 1000, args.latency_sigma),
+            "verifier": LatencyProfile(args.verifier_ms / 1000, args.latency_sigma),
+        },
+        latency_scale=args.latency_scale,
+        output_tokens_per_item=args.output_tokens,
+        report_tokens=args.report_tokens,
+        recorded=load_recorded(args.recorded) if args.recorded else None,
+        seed=args.seed,
+    )
+    model = BenchModel(profile)
+
+    db = InMemorySupabase(latency=args.db_latency_ms / 1000)
+    api.file_manager.db = db
+    api.app.dependency_overrides[api.get_current_user_id] = lambda: "bench-user"
+
+    modes = ["graph", "endpoint"] if args.mode == "both" else [args.mode]
+    results = []
+    header = f"{'mode':<9}{'files':>6}{'rules':>6}{'sess':>6}{'audits':>8}{'fail':>6}{'tput/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'calls':>7}{'db':>6}{'rssMB':>8}"
+    print(header)
+    print("-" * len(header))
+    for mode in modes:
+        for files in args.files:
+            for rules in args.rules:
+                for sessions in args.sessions:
+                    r = asyncio.run(run_scenario(Scenario(args, files, rules, sessions), mode, model, db))
+                    results.append(r)
+                    print(f"{r['mode']:<9}{r['files']:>6}{r['rules']:>6}{r['sessions']:>6}{r['audits']:>8}{r['failures']:>6}"
+                          f"{r['throughput_per_s']:>9.2f}{r['p50_s']:>8.2f}{r['p95_s']:>8.2f}{r['p99_s']:>8.2f}"
+                          f"{r['model_calls_per_audit']:>7.1f}{r['db_round_trips_per_audit']:>6.1f}{r['peak_rss_mb']:>8.1f}", flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -63,7 +63,7 @@ export default function Home() {
       }
 
       const data = await res.json();
-      const newFile = { name: data.name, uri: data.uri, type, local_path: data.local_path };
+      const newFile = { name: data.name, uri: data.uri, type, content_hash: data.content_hash };
 
       if (type === "reference") {
         setReferenceFiles(prev => [...prev, newFile]);
@@ -136,6 +136,11 @@ export default function ChatInterface({ referenceFiles, targetFiles, scenario, s
                                     lastMsg.steps = steps;
                                 }
 
+                                if (data.step === "final_delta") {
+                                    // Copy instead of mutating so a re-run updater doesn't append twice
+                                    newMsgs[newMsgs.length - 1] = { ...lastMsg, content: (lastMsg.content || "") + data.content };
+                                }
+
                                 if (data.step === "final") {
                                     lastMsg.content = data.content;
                                 }
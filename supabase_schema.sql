@@ -26,3 +26,238 @@ alter table sessions enable row level security;
 -- The Anon Key (frontend) should NOT have access if we want privacy.
 -- So we can drop Public Access and only allow Service Role.
 -- create policy "Service Role Full Access" on sessions for all to service_role using (true) with check (true);
+
+-- ---------------------------------------------------------------------------
+-- Atomic session mutations
+-- Each function is a single statement, so concurrent uploads to the same
+-- session can't overwrite each other's file lists (no read-modify-write).
+-- Called from the backend via supabase.rpc(...).
+-- ---------------------------------------------------------------------------
+
+-- A file is identified by its Gemini URI, or by its local path while still pending.
+create or replace function session_file_key(f jsonb) returns text
+language sql immutable as $$
+  select coalesce(nullif(f->>'uri', ''), f->>'local_path')
+$$;
+
+-- Appends the files in `incoming` that `existing` doesn't already contain.
+create or replace function session_merge_files(existing jsonb, incoming jsonb) returns jsonb
+language sql immutable as $$
+  select coalesce(existing, '[]'::jsonb) || coalesce(
+    (select jsonb_agg(f order by ord)
+       from jsonb_array_elements(incoming) with ordinality as i(f, ord)
+      where not exists (
+        select 1 from jsonb_array_elements(coalesce(existing, '[]'::jsonb)) as e(f)
+         where session_file_key(e.f) = session_file_key(i.f)
+      )),
+    '[]'::jsonb)
+$$;
+
+-- Replaces the file with the same local_path as `patched`, keeping list order.
+create or replace function session_replace_file(existing jsonb, patched jsonb) returns jsonb
+language sql immutable as $$
+  select coalesce(
+    (select jsonb_agg(case when e.f->>'local_path' = patched->>'local_path' then patched else e.f end order by ord)
+       from jsonb_array_elements(coalesce(existing, '[]'::jsonb)) with ordinality as e(f, ord)),
+    '[]'::jsonb)
+$$;
+
+-- Adds files to a session's reference and target lists in one statement, creating the session if needed.
+create or replace function session_append_file_sets(p_session_id text, p_user_id text, p_reference jsonb, p_target jsonb)
+returns void language sql as $$
+  insert into sessions as s (session_id, user_id, reference, target)
+  values (p_session_id, p_user_id, coalesce(p_reference, '[]'::jsonb), coalesce(p_target, '[]'::jsonb))
+  on conflict (session_id) do update set
+    reference = session_merge_files(s.reference, p_reference),
+    target = session_merge_files(s.target, p_target),
+    updated_at = now()
+  where p_user_id is null or s.user_id = p_user_id
+$$;
+
+-- Adds files to a session's reference/target list, creating the session if needed.
+create or replace function session_append_files(p_session_id text, p_user_id text, p_file_type text, p_files jsonb)
+returns void language sql as $$
+  select session_append_file_sets(
+    p_session_id,
+    p_user_id,
+    case when p_file_type = 'reference' then p_files else '[]'::jsonb end,
+    case when p_file_type = 'target' then p_files else '[]'::jsonb end
+  )
+$$;
+
+-- Updates one file record (matched by local_path) in place, e.g. pending -> uploaded.
+create or replace function session_patch_file(p_session_id text, p_user_id text, p_file_type text, p_file jsonb)
+returns void language sql as $$
+  update sessions as s set
+    reference = case when p_file_type = 'reference' then session_replace_file(s.reference, p_file) else s.reference end,
+    target = case when p_file_type = 'target' then session_replace_file(s.target, p_file) else s.target end,
+    updated_at = now()
+  where s.session_id = p_session_id
+    and (p_user_id is null or s.user_id = p_user_id)
+$$;
+
+-- Upserts only the columns present in p_data (reference, target, summary, history).
+create or replace function session_upsert(p_session_id text, p_user_id text, p_data jsonb)
+returns void language sql as $$
+  insert into sessions as s (session_id, user_id, reference, target, summary, history)
+  values (
+    p_session_id,
+    p_user_id,
+    coalesce(p_data->'reference', '[]'::jsonb),
+    coalesce(p_data->'target', '[]'::jsonb),
+    p_data->>'summary',
+    coalesce(p_data->'history', '[]'::jsonb)
+  )
+  on conflict (session_id) do update set
+    reference = case when p_data ? 'reference' then excluded.reference else s.reference end,
+    target = case when p_data ? 'target' then excluded.target else s.target end,
+    summary = case when p_data ? 'summary' then excluded.summary else s.summary end,
+    history = case when p_data ? 'history' then excluded.history else s.history end,
+    updated_at = now()
+  where p_user_id is null or s.user_id = p_user_id
+$$;
+
+-- Like session_upsert, but only while the row is still at p_expected_updated_at (null: only if there
+-- is no row yet). Returns whether it wrote. Deferred writes use it so a late flush can't overwrite a
+-- newer change made by another worker in the meantime.
+create or replace function session_upsert_if_unchanged(p_session_id text, p_user_id text, p_data jsonb, p_expected_updated_at timestamptz)
+returns boolean language plpgsql as $$
+declare
+  written int;
+begin
+  if p_expected_updated_at is null then
+    insert into sessions (session_id, user_id, reference, target, summary, history)
+    values (
+      p_session_id,
+      p_user_id,
+      coalesce(p_data->'reference', '[]'::jsonb),
+      coalesce(p_data->'target', '[]'::jsonb),
+      p_data->>'summary',
+      coalesce(p_data->'history', '[]'::jsonb)
+    )
+    on conflict (session_id) do nothing;
+  else
+    update sessions s set
+      reference = case when p_data ? 'reference' then p_data->'reference' else s.reference end,
+      target = case when p_data ? 'target' then p_data->'target' else s.target end,
+      summary = case when p_data ? 'summary' then p_data->>'summary' else s.summary end,
+      history = case when p_data ? 'history' then p_data->'history' else s.history end,
+      updated_at = now()
+    where s.session_id = p_session_id
+      and s.updated_at = p_expected_updated_at
+      and (p_user_id is null or s.user_id = p_user_id);
+  end if;
+  get diagnostics written = row_count;
+  return written > 0;
+end
+$$;
+
+-- ---------------------------------------------------------------------------
+-- Projected reads
+-- Return just what the caller needs instead of whole rows, so polling and
+-- history views don't ship every file record, summary and message.
+-- ---------------------------------------------------------------------------
+
+-- Upload status of every file in a session (for the upload-wait poll). A file pending
+-- for more than p_stale_after seconds (its upload was abandoned) is reported as 'failed'.
+drop function if exists session_file_statuses(text, text);
+create or replace function session_file_statuses(p_session_id text, p_user_id text, p_stale_after double precision default null)
+returns jsonb language sql stable as $$
+  select coalesce(jsonb_agg(
+           case when f->>'status' = 'pending'
+                 and (f->>'pending_since')::double precision < extract(epoch from now()) - p_stale_after
+                then 'failed'
+                else coalesce(f->>'status', 'uploaded')
+           end), '[]'::jsonb)
+    from sessions s,
+         jsonb_array_elements(coalesce(s.reference, '[]'::jsonb) || coalesce(s.target, '[]'::jsonb)) as f
+   where s.session_id = p_session_id
+     and (p_user_id is null or s.user_id = p_user_id)
+$$;
+
+-- Page p_page (1 = most recent) of a session's chat history, oldest first within the page,
+-- plus the total number of messages. Null if there is no such session.
+create or replace function session_history_page(p_session_id text, p_user_id text, p_page int, p_page_size int)
+returns jsonb language sql stable as $$
+  select jsonb_build_object(
+    'total', jsonb_array_length(h.history),
+    'items', coalesce((
+      select jsonb_agg(e.item order by e.ord)
+        from jsonb_array_elements(h.history) with ordinality as e(item, ord)
+       where e.ord > jsonb_array_length(h.history) - p_page * p_page_size
+         and e.ord <= jsonb_array_length(h.history) - (p_page - 1) * p_page_size
+    ), '[]'::jsonb)
+  )
+  from (
+    select coalesce(s.history, '[]'::jsonb) as history
+      from sessions s
+     where s.session_id = p_session_id
+       and (p_user_id is null or s.user_id = p_user_id)
+  ) as h
+$$;
+
+-- ---------------------------------------------------------------------------
+-- Session listing (GET /sessions)
+-- Keyset pagination over (user_id, updated_at desc, session_id desc), served
+-- straight from the covering index. The listed values are stored generated
+-- columns, so a page never has to read the large file/summary/history values.
+-- ---------------------------------------------------------------------------
+
+-- updated_at is the listing order and the session cache's version: keep it current on every update.
+update sessions set updated_at = coalesce(created_at, now()) where updated_at is null;
+alter table sessions alter column updated_at set not null;
+
+create or replace function sessions_touch_updated_at() returns trigger
+language plpgsql as $$
+begin
+  new.updated_at := now();
+  return new;
+end
+$$;
+
+drop trigger if exists sessions_touch_updated_at on sessions;
+create trigger sessions_touch_updated_at
+  before update on sessions
+  for each row execute function sessions_touch_updated_at();
+
+alter table sessions add column if not exists reference_count int
+  generated always as (jsonb_array_length(coalesce(reference, '[]'::jsonb))) stored;
+alter table sessions add column if not exists target_count int
+  generated always as (jsonb_array_length(coalesce(target, '[]'::jsonb))) stored;
+-- "PASS" / "FAIL" / "RISK DETECTED" from the report's "**Outcome**: ..." line
+alter table sessions add column if not exists outcome text
+  generated always as (upper(left(substring(summary from '\*\*Outcome:?\*\*:?[^A-Za-z\n]*([A-Za-z][A-Za-z ]*[A-Za-z])'), 40))) stored;
+
+-- Covering: the listed columns ride along in the index, so a page is an index-only scan (no heap fetches
+-- once the table is vacuumed). Replaces the earlier key-only sessions_user_updated_idx.
+-- EXPLAIN (ANALYZE, BUFFERS) on Postgres 16, 100k sessions over 200 users, after VACUUM ANALYZE: the first
+-- page, a cursor page and session_list() itself (inlined) are each
+--   Limit -> Index Only Scan using sessions_user_updated_list_idx, Heap Fetches: 0, Buffers: shared hit=4
+-- (frontend/backend/test_session_store.py checks the plan).
+create index if not exists sessions_user_updated_list_idx on sessions (user_id, updated_at desc, session_id desc)
+  include (reference_count, target_count, outcome, created_at);
+drop index if exists sessions_user_updated_idx;
+
+-- One page of a user's sessions, most recently updated first, strictly after the cursor (if any).
+create or replace function session_list(p_user_id text, p_after_updated_at timestamptz, p_after_session_id text, p_limit int)
+returns table (session_id text, reference_count int, target_count int, outcome text, created_at timestamptz, updated_at timestamptz)
+language sql stable as $$
+  select s.session_id, s.reference_count, s.target_count, s.outcome, s.created_at, s.updated_at
+    from sessions s
+   where s.user_id = p_user_id
+     and (p_after_updated_at is null or (s.updated_at, s.session_id) < (p_after_updated_at, p_after_session_id))
+   order by s.updated_at desc, s.session_id desc
+   limit p_limit
+$$;
+
+-- ---------------------------------------------------------------------------
+-- Strategist rule memoization (optional, enable with RULE_CACHE_SUPABASE=1)
+-- Keyed by a hash of (scenario, normalized query intent, reference content hashes).
+-- ---------------------------------------------------------------------------
+create table if not exists rule_cache (
+  cache_key text primary key,
+  rules jsonb not null,
+  created_at timestamptz default now()
+);
+
+alter table rule_cache enable row level security;